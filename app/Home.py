@@ -1,5 +1,7 @@
 import streamlit as st
 
+from resources import start_warmup
+
 st.set_page_config(page_title="GPT Call Center Support", page_icon="📖", layout="wide")
 
 
@@ -28,3 +30,6 @@ st.markdown("---")
 
 
 st.sidebar.success("Select a demo above.")
+
+# Load the models and clients a question needs while the user reads the page.
+start_warmup()
@@ -0,0 +1,170 @@
+"""In-memory cache of answers to semantically similar questions."""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+# ada-002 embeddings of questions that differ in one name, date or negation are often 0.95 similar or more.
+DEFAULT_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.98))
+DEFAULT_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+
+
+def source_set_key(sources: Iterable[Document]) -> str:
+    """Identify the context an answer was given from.
+
+    The key covers the source and the text of every chunk, so an answer is
+    never reused once a transcript it was based on has changed.
+    """
+    digest = hashlib.sha256()
+    for source, content in sorted((doc.metadata.get("source") or "", doc.page_content) for doc in sources):
+        digest.update(source.encode("utf-8") + b"\0")
+        digest.update(hashlib.sha256(content.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    embedding: np.ndarray
+    sources: Tuple[str, ...]
+    created_at: float
+
+
+class AnswerCache:
+    """Answers keyed by the set of sources they were given and the embedding of their question.
+
+    A lookup returns the answer to the most similar cached question over the
+    same sources, if its cosine similarity reaches the threshold. Entries
+    expire after a TTL, and the least recently used entry is evicted when the
+    cache is full.
+
+    Example:
+        .. code-block:: python
+
+            cache = AnswerCache(threshold=0.98)
+            cached = cache.get(query_embedding, sources)
+            if cached is None:
+                cache.put(query, query_embedding, sources, get_answer(query, context))
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int], CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, query_embedding: Sequence[float], sources: List[Document]) -> Optional[Tuple[CachedAnswer, float]]:
+        """Look up the answer to a similar question over the same sources.
+
+        Returns:
+            The cached answer and its similarity to the question, or None.
+        """
+        key = source_set_key(sources)
+        vector = self._normalize(query_embedding)
+        with self._lock:
+            self._expire(time.monotonic())
+            best_key, best_similarity = None, -1.0
+            for entry_key, entry in self._entries.items():
+                if entry_key[0] != key:
+                    continue
+                similarity = float(np.dot(vector, entry.embedding))
+                if similarity > best_similarity:
+                    best_key, best_similarity = entry_key, similarity
+
+            if best_key is not None and best_similarity >= self.threshold:
+                self.hits += 1
+                self._entries.move_to_end(best_key)
+                result = self._entries[best_key], best_similarity
+            else:
+                self.misses += 1
+                result = None
+
+        logger.info(
+            "Answer cache %s: best similarity %s, threshold %.3f, hits %d, misses %d, entries %d",
+            "hit" if result else "miss",
+            f"{best_similarity:.3f}" if best_key is not None else "n/a",
+            self.threshold, self.hits, self.misses, len(self._entries),
+        )
+        return result
+
+    def put(self, query: str, query_embedding: Sequence[float], sources: List[Document], answer: str) -> None:
+        """Store the answer to a question given a set of sources."""
+        key = source_set_key(sources)
+        entry = CachedAnswer(
+            query=query,
+            answer=answer,
+            embedding=self._normalize(query_embedding),
+            sources=tuple(sorted({doc.metadata.get("source") or "" for doc in sources})),
+            created_at=time.monotonic(),
+        )
+        with self._lock:
+            self._expire(entry.created_at)
+            self._entries[(key, self._next_id)] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, source: Optional[str] = None) -> int:
+        """Drop the answers based on a source, or every answer if no source is given.
+
+        Returns:
+            The number of answers dropped.
+        """
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if source is None or source in entry.sources]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            logger.info("Answer cache invalidated %d answer(s) for %s", len(keys), source or "all sources")
+        return len(keys)
+
+
+_answer_cache: Optional[AnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide answer cache, shared by every session of the app."""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
@@ -0,0 +1,142 @@
+"""Speaker-turn-aware chunking of call transcripts."""
+from __future__ import annotations
+
+import json
+import re
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from tokenizer import count_tokens
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+TICKS_PER_SECOND = 10_000_000
+
+# Windows are filled up to about CHUNK_TOKENS tokens, and each window repeats
+# the last CHUNK_OVERLAP_TOKENS tokens of the previous one.
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 60
+
+_DURATION = re.compile(r"^PT(?:(\d+(?:\.\d+)?)H)?(?:(\d+(?:\.\d+)?)M)?(?:(\d+(?:\.\d+)?)S)?$")
+_CONVERSATION_LINE = re.compile(r"^(?P<role>[^:]+): (?P<display>.*)$")
+
+
+def duration_to_seconds(duration: Optional[str]) -> Optional[float]:
+    """Parse an ISO 8601 duration such as ``PT1M2.5S``, as written by the Speech to Text API."""
+    match = _DURATION.match(duration or "")
+    if match is None:
+        return None
+    hours, minutes, seconds = (float(group) if group else 0.0 for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def get_phrases(conversation: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the conversation items of a published conversation.
+
+    Older documents carry the phrases as an escaped JSON string, or not at all,
+    in which case they are recovered from the conversation text without timestamps.
+    """
+    phrases = conversation.get("phrases")
+    if isinstance(phrases, str):
+        phrases = json.loads(phrases)
+    if phrases:
+        return phrases
+
+    phrases = []
+    for line in (conversation.get("conversation") or "").splitlines():
+        match = _CONVERSATION_LINE.match(line.strip())
+        if match:
+            phrases.append({"role": match["role"], "display": match["display"]})
+    return phrases
+
+
+def _phrase_start(phrase: Dict[str, Any]) -> Optional[float]:
+    if phrase.get("offsetInTicks") is not None:
+        return phrase["offsetInTicks"] / TICKS_PER_SECOND
+    return duration_to_seconds(phrase.get("offset"))
+
+
+def _phrase_end(phrase: Dict[str, Any]) -> Optional[float]:
+    start = _phrase_start(phrase)
+    duration = duration_to_seconds(phrase.get("duration"))
+    if start is None:
+        return None
+    return start + (duration or 0.0)
+
+
+def _split_into_turns(phrases: List[Dict[str, Any]], max_tokens: int) -> List[Dict[str, Any]]:
+    """Group consecutive phrases of the same speaker into turns of at most max_tokens tokens.
+
+    A single phrase longer than max_tokens becomes a turn of its own.
+    """
+    turns: List[Dict[str, Any]] = []
+    for phrase in phrases:
+        line = f"{phrase['role']}: {phrase['display']} \n"
+        tokens = count_tokens(line)
+        turn = turns[-1] if turns else None
+        if turn is None or turn["role"] != phrase["role"] or turn["tokens"] + tokens > max_tokens:
+            turn = {"role": phrase["role"], "phrases": [], "tokens": 0}
+            turns.append(turn)
+        turn["phrases"].append(phrase)
+        turn["tokens"] += tokens
+    return turns
+
+
+def chunk_conversation(
+    conversation: Dict[str, Any],
+    source: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> List[Document]:
+    """Split a conversation into overlapping windows of whole speaker turns.
+
+    Windows only break between turns, so a question and its answer tend to stay
+    together. Turns longer than a window are split between phrases. Each window
+    starts with the turns that made up the last ``overlap_tokens`` tokens of the
+    previous one.
+
+    Args:
+        conversation: A document published by the ingestion pipeline.
+        source: The location of the document, kept as the ``source`` metadata.
+        chunk_tokens: Target number of tokens per window.
+        overlap_tokens: Number of tokens repeated between consecutive windows.
+
+    Returns:
+        One Document per window, with the call ID, the window position and its
+        start and end time in seconds (None if the phrases carry no offsets) as metadata.
+    """
+    from langchain.docstore.document import Document
+
+    turns = _split_into_turns(get_phrases(conversation), chunk_tokens)
+    docs: List[Document] = []
+    start = 0
+    while start < len(turns):
+        end = start
+        tokens = 0
+        while end < len(turns) and (end == start or tokens + turns[end]["tokens"] <= chunk_tokens):
+            tokens += turns[end]["tokens"]
+            end += 1
+
+        window = [phrase for turn in turns[start:end] for phrase in turn["phrases"]]
+        docs.append(Document(
+            page_content="".join(f"{phrase['role']}: {phrase['display']} \n" for phrase in window),
+            metadata={
+                "source": source,
+                "transcription_id": conversation.get("transcription_id"),
+                "chunk": len(docs),
+                "start_seconds": _phrase_start(window[0]),
+                "end_seconds": _phrase_end(window[-1]),
+                "tokens": tokens,
+            },
+        ))
+        if end == len(turns):
+            break
+
+        # Step back over the turns that fit in the overlap, but always move forward.
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + turns[next_start - 1]["tokens"] <= overlap_tokens:
+            next_start -= 1
+            overlap += turns[next_start]["tokens"]
+        start = next_start
+    return docs
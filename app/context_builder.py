@@ -0,0 +1,117 @@
+"""Packs retrieved transcript chunks into a token-budgeted prompt context."""
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from tokenizer import count_tokens
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+# Tokens of context given to the chat model. The default leaves room for the
+# system prompt, the question and an 800 token answer in a 4k context window.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2800))
+TOKENIZER_MODEL_NAME = "gpt-4"
+
+ORDER_BY_RELEVANCE = "relevance"
+ORDER_BY_TIME = "time"
+
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def format_citation(doc: Document) -> str:
+    """Describe where a chunk comes from: its source and, when known, its time span in the call."""
+    citation = doc.metadata.get("source") or "unknown source"
+    start, end = doc.metadata.get("start_seconds"), doc.metadata.get("end_seconds")
+    if start is not None and end is not None:
+        citation += f" ({_format_seconds(start)}-{_format_seconds(end)})"
+    return citation
+
+
+def _call_id(doc: Document) -> str:
+    return doc.metadata.get("transcription_id") or doc.metadata.get("source") or ""
+
+
+def _overlaps(doc: Document, other: Document) -> bool:
+    """Return whether two chunks of the same call may share lines."""
+    if _call_id(doc) != _call_id(other):
+        return False
+    start, end = doc.metadata.get("start_seconds"), doc.metadata.get("end_seconds")
+    other_start, other_end = other.metadata.get("start_seconds"), other.metadata.get("end_seconds")
+    if None not in (start, end, other_start, other_end):
+        return start <= other_end and other_start <= end
+    chunk, other_chunk = doc.metadata.get("chunk"), other.metadata.get("chunk")
+    if chunk is not None and other_chunk is not None:
+        return abs(chunk - other_chunk) <= 1
+    return True
+
+
+def build_context(
+    docs: List[Document],
+    max_tokens: int = CONTEXT_TOKEN_BUDGET,
+    order: str = ORDER_BY_RELEVANCE,
+) -> Tuple[str, List[Document]]:
+    """Fill a token budget with as many of the ranked chunks as fit.
+
+    Chunks are taken in the order given, which should be most relevant first.
+    Lines a chunk shares with an already selected, overlapping window of the
+    same call are dropped, so overlapping windows are not paid for twice, and
+    a chunk with nothing new is skipped. A chunk that does not fit in the
+    remaining budget is skipped too, so a smaller one further down the ranking
+    can still be used.
+
+    Args:
+        docs: Retrieved chunks, most relevant first.
+        max_tokens: Token budget of the returned context, counted with the local tokenizer.
+        order: ORDER_BY_RELEVANCE keeps the ranking; ORDER_BY_TIME groups the
+            chunks by call and puts them in conversation order.
+
+    Returns:
+        The context, with every chunk headed by a numbered citation, and the
+        selected chunks in the same order and numbering.
+    """
+    from langchain.docstore.document import Document
+
+    if order not in (ORDER_BY_RELEVANCE, ORDER_BY_TIME):
+        raise ValueError(f"Unknown order '{order}', expected '{ORDER_BY_RELEVANCE}' or '{ORDER_BY_TIME}'")
+
+    selected: List[Tuple[int, Document]] = []
+    used_tokens = 0
+    for rank, doc in enumerate(docs):
+        seen: Set[str] = set()
+        for _, other in selected:
+            if _overlaps(doc, other):
+                seen.update(other.page_content.splitlines(keepends=True))
+        lines = [line for line in doc.page_content.splitlines(keepends=True) if line.strip() and line not in seen]
+        if not lines:
+            continue
+
+        # The header of each chunk counts against the budget as well.
+        text = "".join(lines)
+        tokens = count_tokens(f"[{len(selected) + 1}] {format_citation(doc)}\n{text}\n", TOKENIZER_MODEL_NAME)
+        if used_tokens + tokens > max_tokens:
+            continue
+
+        used_tokens += tokens
+        selected.append((rank, Document(page_content=text, metadata=doc.metadata)))
+
+    if order == ORDER_BY_TIME:
+        first_rank: Dict[str, int] = {}
+        for rank, doc in selected:
+            first_rank.setdefault(_call_id(doc), rank)
+        selected.sort(key=lambda item: (
+            first_rank[_call_id(item[1])],
+            item[1].metadata.get("start_seconds") or 0.0,
+            item[1].metadata.get("chunk") or 0,
+        ))
+
+    chosen = [doc for _, doc in selected]
+    context = "".join(
+        f"[{number}] {format_citation(doc)}\n{doc.page_content}\n"
+        for number, doc in enumerate(chosen, start=1)
+    )
+    return context, chosen
@@ -0,0 +1,195 @@
+"""Persistent, content-addressed cache of embedding vectors."""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", ".embedding_cache")
+DEFAULT_DIMENSIONS = 1536  # text-embedding-ada-002
+DEFAULT_CAPACITY = 50000
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so texts that embed identically share a cache entry."""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """Embedding vectors keyed by model name and a hash of the normalized text.
+
+    The vectors live in a memory-mapped float32 matrix with one row per slot,
+    and a small SQLite index maps each key to its slot together with a
+    last-used counter. When every slot is taken, the least recently used
+    entry is overwritten.
+
+    Several processes may share a directory, such as the app, the notebook
+    indexer and the benchmarks. Slots and the last-used counter are read
+    from the index inside a write transaction, which SQLite holds for one
+    process at a time, so no two processes hand out the same slot.
+
+    Example:
+        .. code-block:: python
+
+            cache = EmbeddingCache(".embedding_cache")
+            embeddings = OpenAIEmbeddings(cache=cache)
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        dimensions: int = DEFAULT_DIMENSIONS,
+        capacity: int = DEFAULT_CAPACITY,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dimensions = dimensions
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._index = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        with self._index:
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key BLOB PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._index.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+            )
+            for name, value in (("dimensions", dimensions), ("capacity", capacity)):
+                self._index.execute(
+                    "INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)", (name, value)
+                )
+                (stored,) = self._index.execute(
+                    "SELECT value FROM meta WHERE name = ?", (name,)
+                ).fetchone()
+                if stored != value:
+                    raise ValueError(
+                        f"Embedding cache in {directory} was created with {name}={stored}, not {value}."
+                    )
+
+        vectors_path = os.path.join(directory, "vectors.f32")
+        # Appending never truncates, unlike mode "w+", so a process opening the cache at the
+        # same time as another one that is writing to it keeps its vectors.
+        with open(vectors_path, "ab") as f:
+            if f.tell() < capacity * dimensions * 4:
+                f.truncate(capacity * dimensions * 4)
+        self._vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dimensions)
+        )
+
+    def _begin(self) -> int:
+        """Start a write transaction and return the next value of the last-used counter."""
+        self._index.execute("BEGIN IMMEDIATE")
+        (clock,) = self._index.execute(
+            "SELECT COALESCE(MAX(last_used), 0) FROM entries"
+        ).fetchone()
+        return clock + 1
+
+    @staticmethod
+    def key(model_name: str, text: str) -> bytes:
+        """Return the cache key of a text embedded with a model."""
+        return hashlib.sha256(
+            f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+        ).digest()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (size,) = self._index.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return size
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Look up the embeddings of several texts.
+
+        Args:
+            model_name: The embedding model the vectors were created with.
+            texts: The texts to look up.
+
+        Returns:
+            One embedding per text, or None where the text is not cached.
+        """
+        keys = [self.key(model_name, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        with self._lock, self._index:
+            # Also a write transaction, so no other process evicts a slot while it is read.
+            clock = self._begin()
+            for i, key in enumerate(keys):
+                row = self._index.execute(
+                    "SELECT slot FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._index.execute(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", (clock, key)
+                )
+                clock += 1
+                results[i] = self._vectors[row[0]].tolist()
+        return results
+
+    def put_many(
+        self, model_name: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]
+    ) -> None:
+        """Store the embeddings of several texts, evicting least recently used entries if full.
+
+        Args:
+            model_name: The embedding model the vectors were created with.
+            texts: The embedded texts.
+            embeddings: One embedding per text.
+        """
+        with self._lock, self._index:
+            clock = self._begin()
+            # Slots are taken in order and evicted entries hand theirs over, so the used slots are 0..size-1.
+            (size,) = self._index.execute("SELECT COUNT(*) FROM entries").fetchone()
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(model_name, text)
+                row = self._index.execute(
+                    "SELECT slot FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    slot = row[0]
+                elif size < self.capacity:
+                    slot = size
+                    size += 1
+                else:
+                    slot, evicted = self._index.execute(
+                        "SELECT slot, key FROM entries ORDER BY last_used LIMIT 1"
+                    ).fetchone()
+                    self._index.execute("DELETE FROM entries WHERE key = ?", (evicted,))
+
+                self._vectors[slot] = np.asarray(embedding, dtype=np.float32)
+                self._index.execute(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                    (key, slot, clock),
+                )
+                clock += 1
+            self._vectors.flush()
+
+    def close(self) -> None:
+        """Flush the vectors and close the index."""
+        with self._lock:
+            self._vectors.flush()
+            self._index.close()
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """Return the process-wide cache in ``EMBEDDING_CACHE_DIR``, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
@@ -1,16 +1,14 @@
 """Wrapper around OpenAI embedding models."""
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from langchain.embeddings.base import Embeddings
 from langchain.utils import get_from_dict_or_env
-from openai.error import APIConnectionError, APIError, RateLimitError, Timeout
 from pydantic import BaseModel, Extra, root_validator
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
+
+import tracing
+from rate_limiter import get_rate_limiter
+from tokenizer import count_tokens, get_encoding
 
 
 class OpenAIEmbeddings(BaseModel, Embeddings):
@@ -31,6 +29,16 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
     document_model_name: str = "text-embedding-ada-002"
     query_model_name: str = "text-embedding-ada-002"
     openai_api_key: Optional[str] = None
+    chunk_size: int = 16
+    """Maximum number of texts sent in one embedding request."""
+    max_batch_tokens: int = 32000
+    """Maximum number of tokens sent in one embedding request."""
+    max_concurrency: int = 4
+    """Maximum number of embedding requests in flight at once."""
+    cache: Any = None
+    """Optional EmbeddingCache checked before calling the API."""
+    rate_limiter: Any = None
+    """RateLimiter every request goes through, defaults to the process-wide one."""
 
     class Config:
         """Configuration for this pydantic object."""
@@ -62,37 +70,92 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
             )
         return values
 
-    @retry(
-        reraise=True,
-        stop=stop_after_attempt(100),
-        wait=wait_exponential(multiplier=1, min=10, max=60),
-        retry=(
-            retry_if_exception_type(Timeout)
-            | retry_if_exception_type(APIError)
-            | retry_if_exception_type(APIConnectionError)
-            | retry_if_exception_type(RateLimitError)
-        ),
-    )
+    def _limiter(self) -> Any:
+        return self.rate_limiter or get_rate_limiter()
+
     def _embedding_func(self, text: str, *, engine: str) -> List[float]:
-        """Call out to OpenAI's embedding endpoint with exponential backoff."""
+        """Call out to OpenAI's embedding endpoint through the rate limiter."""
         # replace newlines, which can negatively affect performance.
         text = text.replace("\n", " ")
-        return self.client.create(input=[text], engine=engine)["data"][0]["embedding"]
+        return self._limiter().call(
+            engine,
+            count_tokens(text, engine),
+            lambda: self.client.create(input=[text], engine=engine)["data"][0]["embedding"],
+        )
+
+    def _create_embeddings(self, texts: List[str], *, engine: str) -> List[List[float]]:
+        """Call out to OpenAI's embedding endpoint with several texts in one request."""
+        data = self._limiter().call(
+            engine,
+            sum(count_tokens(text, engine) for text in texts),
+            lambda: self.client.create(input=texts, engine=engine)["data"],
+        )
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    def _embed_batch(self, texts: List[str], *, engine: str) -> List[List[float]]:
+        """Embed a batch of texts in one request."""
+        if len(texts) == 1:
+            return [self._embedding_func(texts[0], engine=engine)]
+        return self._create_embeddings(texts, engine=engine)
+
+    def _batches(self, texts: List[str], *, engine: str) -> Iterator[Tuple[List[str], int]]:
+        """Pack texts into batches limited by chunk_size and max_batch_tokens, with their token counts."""
+        encoding = get_encoding(engine)
+        batch: List[str] = []
+        batch_tokens = 0
+        for text in texts:
+            text = text.replace("\n", " ")
+            tokens = len(encoding.encode(text))
+            if batch and (len(batch) >= self.chunk_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Call out to OpenAI's embedding endpoint for embedding search docs.
 
+        Texts are packed into batches of up to ``chunk_size`` texts and
+        ``max_batch_tokens`` tokens, and up to ``max_concurrency`` batches
+        are sent at once.
+
         Args:
             texts: The list of texts to embed.
 
         Returns:
             List of embeddings, one for each text.
         """
-        responses = [
-            self._embedding_func(text, engine=self.document_model_name)
-            for text in texts
-        ]
-        return responses
+        engine = self.document_model_name
+        with tracing.span("embed", model=engine, texts=len(texts)) as embed_span:
+            if self.cache is None:
+                return self._embed_texts(texts, engine=engine)
+
+            embeddings = self.cache.get_many(engine, texts)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            embed_span.set("cached", len(texts) - len(missing))
+            if missing:
+                missing_texts = [texts[i] for i in missing]
+                new_embeddings = self._embed_texts(missing_texts, engine=engine)
+                self.cache.put_many(engine, missing_texts, new_embeddings)
+                for i, embedding in zip(missing, new_embeddings):
+                    embeddings[i] = embedding
+            return embeddings
+
+    def _embed_texts(self, texts: List[str], *, engine: str) -> List[List[float]]:
+        """Embed texts in concurrent batches, without consulting the cache."""
+        batches = []
+        for batch, tokens in self._batches(texts, engine=engine):
+            batches.append(batch)
+            tracing.add("requests")
+            tracing.add("tokens", tokens)
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            results = [self._embed_batch(batch, engine=engine) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch(batch, engine=engine), batches))
+        return [embedding for result in results for embedding in result]
 
     def embed_query(self, text: str) -> List[float]:
         """Call out to OpenAI's embedding endpoint for embedding query text.
@@ -103,5 +166,14 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         Returns:
             Embeddings for the text.
         """
-        embedding = self._embedding_func(text, engine=self.query_model_name)
-        return embedding
+        with tracing.span("embed.query", model=self.query_model_name, cached=False) as embed_span:
+            if self.cache is not None:
+                (embedding,) = self.cache.get_many(self.query_model_name, [text])
+                if embedding is not None:
+                    embed_span.set("cached", True)
+                    return embedding
+            embed_span.set("tokens", count_tokens(text.replace("\n", " "), self.query_model_name))
+            embedding = self._embedding_func(text, engine=self.query_model_name)
+            if self.cache is not None:
+                self.cache.put_many(self.query_model_name, [text], [embedding])
+            return embedding
@@ -0,0 +1,95 @@
+"""Report what importing the app's modules costs at startup.
+
+Each module list is imported in a fresh interpreter with ``python -X importtime``,
+so the numbers match a cold start of the app. Run from this folder:
+
+    .. code-block:: bash
+
+        python import_profile.py                 # the modules the pages import
+        python import_profile.py utils --top 30  # any modules
+        python import_profile.py --deferred      # the modules start_warmup loads
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Modules the pages import before their first render.
+STARTUP_MODULES = [
+    "streamlit",
+    "answer_cache",
+    "chunking",
+    "components.sidebar",
+    "context_builder",
+    "resources",
+    "search_client",
+    "utils",
+    "vector_index",
+]
+
+# Modules the pages only import on the code path that needs them, or in the warm-up thread.
+DEFERRED_MODULES = [
+    "langchain.docstore.document",
+    "langchain.vectorstores.faiss",
+    "embeddings",
+    "embedding_cache",
+    "openai",
+    "tiktoken",
+]
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def profile_imports(modules: List[str]) -> List[Tuple[str, int, int, int]]:
+    """Import modules in a new interpreter and return, for every module it loaded,
+    its name, own and cumulative import time in microseconds, and nesting depth."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {module}" for module in modules)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {', '.join(modules)} failed:\n{result.stderr[-2000:]}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return timings
+
+
+def report(modules: List[str], top: int) -> str:
+    timings = profile_imports(modules)
+    total_us = sum(self_us for _, self_us, _, _ in timings)
+    lines = [
+        f"Imported {len(timings)} modules in {total_us / 1e6:.2f}s: {', '.join(modules)}",
+        "",
+        f"{'cumulative':>10}  {'self':>8}  module",
+    ]
+    for name, self_us, cumulative_us, _ in sorted(timings, key=lambda timing: -timing[2])[:top]:
+        lines.append(f"{cumulative_us / 1e3:>8.1f}ms  {self_us / 1e3:>6.1f}ms  {name}")
+
+    lines += ["", "Top-level packages:"]
+    packages = {}
+    for name, self_us, _, _ in timings:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"{self_us / 1e3:>8.1f}ms  {package}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", help="Modules to import, by default the pages' startup modules.")
+    parser.add_argument("--deferred", action="store_true", help="Profile the modules loaded after the first render.")
+    parser.add_argument("--top", type=int, default=20, help="Number of modules and packages listed.")
+    args = parser.parse_args()
+
+    modules = args.modules or (DEFERRED_MODULES if args.deferred else STARTUP_MODULES)
+    print(report(modules, args.top))
@@ -1,57 +1,93 @@
+import logging
 import os
+import time
 import requests
 from collections import OrderedDict
 
 import streamlit as st
 
-from openai.error import OpenAIError
-from langchain.docstore.document import Document
-
+from answer_cache import get_answer_cache
+from chunking import chunk_conversation
 from components.sidebar import sidebar
-from utils import embed_docs, get_answer, search_docs
+from context_builder import build_context, format_citation
+from rate_limiter import openai_errors
+from resources import get_embeddings, hybrid_search, search, start_warmup
+from search_client import CHUNK_INDEX_NAME, PROFILE_CHUNKS, TRANSCRIPTION_INDEX_NAME, chunk_hits_to_documents
+from utils import embed_docs, get_answer, search_docs, stream_answer
+from vector_index import get_vector_index
 
-AZURE_SEARCH_API_VERSION = '2021-04-30-Preview'
 AZURE_OPENAI_API_VERSION = "2023-03-15-preview"
 
+logger = logging.getLogger(__name__)
+
+# Number of chunks retrieved for a question; build_context keeps as many as fit its token budget.
+CONTEXT_CANDIDATES = 12
+
 def clear_submit():
     st.session_state["submit"] = False
 
+def show_sources(sources: list) -> None:
+    if sources:
+        st.markdown("#### Sources")
+        st.markdown("\n".join(f"{number}. {format_citation(source)}" for number, source in enumerate(sources, start=1)))
+
+def write_answer(query: str, query_embedding: list, context: str, sources: list) -> str:
+    st.markdown("#### Answer")
+
+    # Repeated questions over the same sources are answered from the cache.
+    answer_cache = get_answer_cache()
+    cached = answer_cache.get(query_embedding, sources)
+    if cached is not None:
+        cached_answer, similarity = cached
+        st.text_area(label='', value=cached_answer.answer, height=250)
+        st.caption(f"Cached answer to \"{cached_answer.query}\" (similarity {similarity:.2f})")
+        return cached_answer.answer
+
+    if not st.session_state.get("stream_answers", True):
+        answer = get_answer(query, context = context)
+        st.text_area(label='', value=answer, height=250)
+        answer_cache.put(query, query_embedding, sources, answer)
+        return answer
+
+    placeholder = st.empty()
+    placeholder.markdown("▌")
+    started = time.perf_counter()
+    time_to_first_token = None
+    answer = ""
+    pieces = stream_answer(query, context = context)
+    try:
+        for piece in pieces:
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - started
+            answer += piece
+            # When the question changes, Streamlit stops this run at the next call like this one,
+            # and closing the stream below stops the completion from being read any further.
+            placeholder.markdown(answer + "▌")
+    finally:
+        pieces.close()
+    elapsed = time.perf_counter() - started
+
+    placeholder.text_area(label='', value=answer, height=250)
+    answer_cache.put(query, query_embedding, sources, answer)
+    if time_to_first_token is not None:
+        logger.info("Answer streamed: time to first token %.3fs, total %.3fs", time_to_first_token, elapsed)
+        st.session_state["time_to_first_token"] = time_to_first_token
+        st.caption(f"First token after {time_to_first_token:.2f}s, full answer after {elapsed:.2f}s")
+    return answer
+
 # Use type hints to make the function signature clear.
 def get_search_results(query: str, indexes: list) -> list:
-    headers = {'Content-Type': 'application/json','api-key': os.environ["AZURE_SEARCH_KEY"]}
-    agg_search_results = []
-    
-    for index in indexes:
-        url = os.environ["AZURE_SEARCH_ENDPOINT"] + '/indexes/'+ index + '/docs'
-        url += '?api-version={}'.format(AZURE_SEARCH_API_VERSION)
-        url += '&search={}'.format(query)
-        url += '&select=*'
-        url += '&$top=5'  # You can change this to anything you need/want
-        url += '&queryLanguage=en-us'
-        # url += '&queryType=semantic'
-        # url += '&semanticConfiguration=content'
-        url += '&$count=true'
-        url += '&speller=lexicon'
-        # url += '&answers=extractive|count-3'
-        # url += '&captions=extractive|highlight-false'
-
-        resp = requests.get(url, headers=headers)
-
-        # Print statements are useful for debugging but should be removed in production code.
-        print(url)
-        print(resp.status_code)
-
-        search_results = resp.json()
-        
-        agg_search_results.append(search_results)
-
-    return agg_search_results
+    # All indexes are queried at once; the hits are merged by score, best first.
+    # Only the fields needed to chunk each call are returned, see search_client.PROFILE_CHUNKS.
+    # Results are shared by every session for a short time, see resources.search.
+    return search(query, indexes, profile=PROFILE_CHUNKS)
 
 st.set_page_config(page_title="GPT Call Center Support", page_icon="📖", layout="wide")
 st.header("GPT Call Center Support")
 
 with st.sidebar:
     st.markdown("""# Instructions""")
+    st.checkbox("Stream answers", value=True, key="stream_answers")
     st.markdown("""
                     Ask a question about your call center data.
 
@@ -67,7 +103,7 @@ with st.sidebar:
 coli1, coli2 = st.columns([2,1])
 
 with coli1:
-    query = st.text_input("Ask a question to your call center data", value= "What is the customer agent name?")
+    query = st.text_input("Ask a question to your call center data", value= "What is the customer agent name?", on_change=clear_submit)
 
 col1, col2, col3 = st.columns([1,1,3])
 
@@ -90,22 +126,65 @@ else:
          # Also provide more specific error messages when possible.
          st.warning("Please enter a question!")
          
+    elif CHUNK_INDEX_NAME:
+         # Hybrid index: keyword and vector retrieval of chunks in one request, see notebooks/search.ipynb.
+         st.session_state["submit"] = True
+
+         try:
+             with st.spinner("Reading the source documents to provide the best answer... ⏳"):
+                 # Embedded once, for the search and for the answer cache.
+                 query_embedding = get_embeddings().embed_query(query)
+                 hits = hybrid_search(query, query_embedding, CHUNK_INDEX_NAME, top=CONTEXT_CANDIDATES)
+                 context, cited_sources = build_context(chunk_hits_to_documents(hits))
+
+             if len(cited_sources) > 0:
+                 write_answer(query, query_embedding, context, cited_sources)
+                 show_sources(cited_sources)
+             else:
+                 st.markdown("#### Answer")
+                 st.text_area(label='', value="No results found", height=250)
+
+         except openai_errors() as e:
+             st.error(f"Open AI Error occurred. Error message: {e}")
+         except requests.RequestException as e:
+             st.error(f"Azure Search Error occurred. Error message: {e}")
+
+    elif (vector_index := get_vector_index()) is not None:
+         # Prebuilt index: only the question is embedded, see vector_index.py.
+         st.session_state["submit"] = True
+
+         try:
+             with st.spinner("Reading the source documents to provide the best answer... ⏳"):
+                 query_embedding = get_embeddings().embed_query(query)
+                 sources = search_docs(index=vector_index.store, query=query, k=CONTEXT_CANDIDATES, query_embedding=query_embedding)
+                 context, cited_sources = build_context(sources)
+
+             if len(cited_sources) > 0:
+                 write_answer(query, query_embedding, context, cited_sources)
+                 show_sources(cited_sources)
+             else:
+                 st.markdown("#### Answer")
+                 st.text_area(label='', value="No results found", height=250)
+
+         except openai_errors() as e:
+             st.error(f"Open AI Error occurred. Error message: {e}")
+
     else:
          # Azure Search
-         indexes = ["transcription-index"]
-         
-         agg_search_results = get_search_results(query=query, indexes=indexes)
+         indexes = [TRANSCRIPTION_INDEX_NAME]
          
          file_content = OrderedDict()
          
          try:
-             for search_results in agg_search_results:                    
-                 for result in search_results['value']:                        
-                     file_content[result['content']['transcription_id']]={
-                                             "caption": result['content']['conversation'],
+             search_results = get_search_results(query=query, indexes=indexes)
+
+             for result in search_results:
+                 # Results are merged best first, so keep the first hit of each transcription.
+                 file_content.setdefault(result['content']['transcription_id'], {
+                                             "content": result['content'],
                                              "score": result['@search.score'],
                                              "location": result['metadata_storage_path']                  
-                                         }
+                                         })
          except Exception as e:  # Catch specific exceptions instead of using a bare except clause.
               # Provide more specific error messages when possible.
               st.markdown(f"No data returned from Azure Search. Error message: {e}")
@@ -117,9 +196,10 @@ else:
               
               try:
                   docs_list=[]
+                  cited_sources=[]
                   
                   for key,value in file_content.items():                        
-                      docs_list.append(Document(page_content=value['caption'], metadata={"source": value["location"]}))
+                      docs_list.extend(chunk_conversation(value['content'], source=value["location"]))
 
                       add_text="Reading the source documents to provide the best answer... ⏳"
                       
@@ -129,16 +209,20 @@ else:
                         if(len(docs_list)>0):
                             language="en"  # random.choice(list(file_content.items()))[1]["language"]
                             index=embed_docs(docs=docs_list, language=language)
-                            sources=search_docs(index=index, query=query)   
-                            
-                            answer = get_answer(query, context = sources[0].page_content)                   
-                        else: 
-                            answer="No results found"
+                            query_embedding=get_embeddings().embed_query(query)
+                            sources=search_docs(index=index, query=query, k=CONTEXT_CANDIDATES, query_embedding=query_embedding)
+                            context, cited_sources = build_context(sources)
                       
                   with placeholder_container.container():
-                      st.markdown("#### Answer")                      
-                      st.text_area(label='', value=answer, height=250)
+                      if len(cited_sources) > 0:
+                          write_answer(query, query_embedding, context, cited_sources)
+                          show_sources(cited_sources)
+                      else:
+                          st.markdown("#### Answer")                      
+                          st.text_area(label='', value="No results found", height=250)
                               
-              except OpenAIError as e:
+              except openai_errors() as e:
                   # Provide more specific error messages when possible.
-                  st.error(f"Open AI Error occurred. Error message: {e}")
\ No newline at end of file
+                  st.error(f"Open AI Error occurred. Error message: {e}")
+
+start_warmup()
@@ -0,0 +1,212 @@
+"""Client-side rate limiting of Azure OpenAI calls, shared by every session of the app."""
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    from openai.error import RateLimitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Limits of a deployment that is not listed in AZURE_OPENAI_RATE_LIMITS.
+DEFAULT_REQUESTS_PER_MINUTE = 300
+DEFAULT_TOKENS_PER_MINUTE = 60000
+
+# Longest a call may wait for capacity, retries included, before it fails instead.
+DEFAULT_LATENCY_BUDGET_SECONDS = float(os.environ.get("AZURE_OPENAI_LATENCY_BUDGET_SECONDS", 20))
+MAX_ATTEMPTS = 4
+RETRY_SECONDS = 1.0
+
+
+class RateLimitBudgetExceeded(Exception):
+    """Raised instead of waiting when a call could not start within its latency budget."""
+
+
+def openai_errors() -> Tuple[type, ...]:
+    """The exceptions an Azure OpenAI call made through the limiter can raise, for except clauses.
+
+    openai is only imported once a call has failed, so callers need not import it at startup.
+    """
+    from openai.error import OpenAIError
+
+    return OpenAIError, RateLimitBudgetExceeded
+
+
+def parse_rate_limits(value: str) -> Dict[str, Tuple[int, int]]:
+    """Parse limits written as ``deployment=requests_per_minute/tokens_per_minute``, separated by commas.
+
+    Example:
+        ``text-embedding-ada-002=720/120000,gpt-4-32k=60/60000``
+    """
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            deployment, _, limit = item.partition("=")
+            requests_per_minute, _, tokens_per_minute = limit.partition("/")
+            limits[deployment.strip()] = (int(requests_per_minute), int(tokens_per_minute))
+    return limits
+
+
+class _Bucket:
+    """A token bucket refilled continuously up to its capacity. Its level goes negative while calls queue."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until the bucket holds amount, capped at its capacity."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute token buckets for each deployment.
+
+    A call reserves one request and its estimated tokens before it is sent.
+    If the buckets cannot cover it yet, the call queues behind the calls that
+    reserved before it, but only as long as the wait fits in its latency
+    budget; otherwise it fails at once with RateLimitBudgetExceeded. A 429
+    answer blocks the deployment for the retry-after time the service sent.
+
+    Example:
+        .. code-block:: python
+
+            limiter = RateLimiter({"gpt-4-32k": (60, 60000)})
+            response = limiter.call("gpt-4-32k", tokens=1500, func=lambda: openai.ChatCompletion.create(...))
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        latency_budget_seconds: float = DEFAULT_LATENCY_BUDGET_SECONDS,
+    ) -> None:
+        self.limits = limits or {}
+        self.latency_budget_seconds = latency_budget_seconds
+        self._buckets: Dict[str, Tuple[_Bucket, _Bucket]] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _get_buckets(self, deployment: str) -> Tuple[_Bucket, _Bucket]:
+        buckets = self._buckets.get(deployment)
+        if buckets is None:
+            requests_per_minute, tokens_per_minute = self.limits.get(
+                deployment, (DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE))
+            buckets = self._buckets[deployment] = (_Bucket(requests_per_minute), _Bucket(tokens_per_minute))
+        return buckets
+
+    def acquire(self, deployment: str, tokens: int, deadline: float) -> float:
+        """Reserve capacity for one call, sleeping until it is available.
+
+        Args:
+            deployment: The deployment the call is sent to.
+            tokens: Estimated tokens of the call, prompt and completion.
+            deadline: time.monotonic() value by which the call must have started.
+
+        Returns:
+            The seconds waited.
+
+        Raises:
+            RateLimitBudgetExceeded: If the call could not start before the deadline.
+        """
+        with self._lock:
+            now = time.monotonic()
+            request_bucket, token_bucket = self._get_buckets(deployment)
+            request_bucket.refill(now)
+            token_bucket.refill(now)
+            wait = max(
+                request_bucket.wait_for(1),
+                token_bucket.wait_for(tokens),
+                self._blocked_until.get(deployment, 0.0) - now,
+            )
+            if now + wait > deadline:
+                raise RateLimitBudgetExceeded(
+                    f"Rate limit of deployment '{deployment}' would delay this call by {wait:.1f}s, "
+                    f"beyond its latency budget. Please try again shortly.")
+            # Reserving now, even into a negative level, keeps queued calls in order.
+            request_bucket.level -= 1
+            token_bucket.level -= min(tokens, token_bucket.capacity)
+
+        if wait > 0:
+            logger.info("Queued call to '%s' for %.2fs (%d tokens)", deployment, wait, tokens)
+            time.sleep(wait)
+        return wait
+
+    def block(self, deployment: str, seconds: float) -> None:
+        """Hold every call to a deployment for a number of seconds, as asked by a retry-after header."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._blocked_until.get(deployment, 0.0):
+                self._blocked_until[deployment] = until
+        logger.warning("Deployment '%s' is throttled, holding calls for %.1fs", deployment, seconds)
+
+    def call(self, deployment: str, tokens: int, func: Callable[[], T],
+             latency_budget_seconds: Optional[float] = None) -> T:
+        """Call func once the limits allow, retrying throttled and transient failures within the latency budget.
+
+        Args:
+            deployment: The deployment func sends its request to.
+            tokens: Estimated tokens of the request, prompt and completion.
+            func: Sends the request.
+            latency_budget_seconds: Overrides the limiter's latency budget for this call.
+
+        Returns:
+            What func returns.
+        """
+        from openai.error import APIConnectionError, APIError, RateLimitError, Timeout
+
+        budget = self.latency_budget_seconds if latency_budget_seconds is None else latency_budget_seconds
+        deadline = time.monotonic() + budget
+        attempt = 1
+        while True:
+            self.acquire(deployment, tokens, deadline)
+            try:
+                return func()
+            except RateLimitError as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                self.block(deployment, get_retry_after(e))
+            except (Timeout, APIError, APIConnectionError) as e:
+                if attempt == MAX_ATTEMPTS or time.monotonic() + RETRY_SECONDS * attempt > deadline:
+                    raise
+                logger.warning("Call to '%s' failed, retrying: %r", deployment, e)
+                time.sleep(RETRY_SECONDS * attempt)
+            attempt += 1
+
+
+def get_retry_after(error: "RateLimitError", default: float = 10.0) -> float:
+    """Seconds to wait after a 429 answer, from its retry-after headers."""
+    headers = getattr(error, "headers", None) or {}
+    for name in ("retry-after-ms", "Retry-After-Ms", "x-ms-retry-after-ms"):
+        if headers.get(name):
+            return float(headers[name]) / 1000
+    for name in ("retry-after", "Retry-After"):
+        if headers.get(name):
+            try:
+                return float(headers[name])
+            except ValueError:
+                break
+    return default
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter, configured from AZURE_OPENAI_RATE_LIMITS."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(parse_rate_limits(os.environ.get("AZURE_OPENAI_RATE_LIMITS", "")))
+        return _rate_limiter
@@ -0,0 +1,171 @@
+"""Clients and caches built once per process and shared by every session of the app.
+
+Streamlit runs a page from the top on every interaction, but imported modules
+stay loaded, so everything here is created on first use and then reused
+across reruns and sessions. Each accessor is safe to call from any session's
+thread. The tokenizer is loaded once by tokenizer.count_tokens, and the
+search client, caches, rate limiter and prebuilt vector index have
+process-wide accessors in their own modules.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from search_client import QUERY_PROFILES, TRANSCRIPTION_INDEX_NAME, QueryProfile, get_search_client
+
+if TYPE_CHECKING:
+    from embeddings import OpenAIEmbeddings
+
+logger = logging.getLogger(__name__)
+
+AZURE_OPENAI_API_VERSION = "2023-03-15-preview"
+EMBEDDING_MODEL_NAME = "text-embedding-ada-002"
+
+# Search results are reused for identical queries within this many seconds.
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", 60))
+SEARCH_CACHE_MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+_openai_configured = False
+_embeddings: Optional["OpenAIEmbeddings"] = None
+
+
+def _configure_openai() -> None:
+    import openai
+
+    global _openai_configured
+    openai.api_type = "azure"
+    openai.api_base = os.environ.get("AZURE_OPENAI_ENDPOINT")
+    openai.api_version = AZURE_OPENAI_API_VERSION
+    openai.api_key = os.environ.get("AZURE_OPENAI_API_KEY")
+    _openai_configured = True
+
+
+def configure_openai() -> None:
+    """Point the openai package at Azure OpenAI, once per process."""
+    with _lock:
+        if not _openai_configured:
+            _configure_openai()
+
+
+def get_embeddings() -> "OpenAIEmbeddings":
+    """Return the process-wide embeddings client, used both to build and to query indexes."""
+    from embedding_cache import get_default_cache
+    from embeddings import OpenAIEmbeddings
+
+    global _embeddings
+    with _lock:
+        if _embeddings is None:
+            _embeddings = OpenAIEmbeddings(
+                document_model_name=EMBEDDING_MODEL_NAME,
+                query_model_name=EMBEDDING_MODEL_NAME,
+                cache=get_default_cache(),
+            )
+            # Constructing the client sets the global openai settings for embeddings only;
+            # set them once more for every kind of call.
+            _configure_openai()
+        return _embeddings
+
+
+class TTLCache:
+    """A small, thread-safe memo whose entries expire after a number of seconds."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the value stored for key, or compute and store it if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        # Computed outside the lock, so one slow query does not hold up the others.
+        value = compute()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+_search_results = TTLCache(SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_MAX_ENTRIES)
+
+
+def _query_key(query: str) -> str:
+    return " ".join(query.split()).lower()
+
+
+def search(query: str, indexes: List[str], profile: Union[str, QueryProfile]) -> List[Dict[str, Any]]:
+    """Search several indexes with the process-wide client, memoized for SEARCH_CACHE_TTL_SECONDS."""
+    if isinstance(profile, str):
+        profile = QUERY_PROFILES[profile]
+    return _search_results.get_or_compute(
+        ("search", _query_key(query), tuple(indexes), profile.name),
+        lambda: get_search_client().search(query, indexes, profile=profile),
+    )
+
+
+def hybrid_search(query: str, query_embedding: List[float], index: str, top: int) -> List[Dict[str, Any]]:
+    """Hybrid search of a chunk index with the process-wide client, memoized for SEARCH_CACHE_TTL_SECONDS."""
+    return _search_results.get_or_compute(
+        ("hybrid", _query_key(query), index, top),
+        lambda: get_search_client().hybrid_search(query, query_embedding, index, top=top),
+    )
+
+
+_warmup_thread: Optional[threading.Thread] = None
+
+
+def _warm_up() -> None:
+    started = time.monotonic()
+    # Deferred everywhere else so the first render does not wait for them.
+    import langchain.docstore.document  # noqa: F401
+    import langchain.vectorstores.faiss  # noqa: F401
+    import openai  # noqa: F401
+
+    from embedding_cache import get_default_cache
+    from rate_limiter import get_rate_limiter
+    from tokenizer import count_tokens
+    from vector_index import get_vector_index
+
+    count_tokens("warm up")
+    count_tokens("warm up", "gpt-4")
+    get_rate_limiter()
+    get_default_cache()
+    if os.environ.get("AZURE_SEARCH_ENDPOINT"):
+        get_search_client().has_structured_phrases(TRANSCRIPTION_INDEX_NAME)
+    if os.environ.get("AZURE_OPENAI_API_KEY") and os.environ.get("AZURE_OPENAI_ENDPOINT"):
+        get_embeddings()
+        get_vector_index()
+    logger.info("Warm-up finished in %.2fs", time.monotonic() - started)
+
+
+def _run_warmup() -> None:
+    try:
+        _warm_up()
+    except Exception:
+        # The same work is retried on the request path, where its errors are shown.
+        logger.warning("Warm-up failed", exc_info=True)
+
+
+def start_warmup() -> None:
+    """Load the deferred modules and build the shared clients and index in a background thread.
+
+    Call it at the end of a page, so the first render does not wait for it.
+    The thread is started once per process; later calls do nothing.
+    """
+    global _warmup_thread
+    with _lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_run_warmup, name="warmup", daemon=True)
+            _warmup_thread.start()
@@ -0,0 +1,336 @@
+"""Concurrent queries over several Azure Cognitive Search indexes."""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+AZURE_SEARCH_API_VERSION = "2021-04-30-Preview"
+# Vector queries need a newer API version than the keyword queries above.
+AZURE_SEARCH_VECTOR_API_VERSION = "2023-11-01"
+
+# Conversation-level index filled by the indexer of notebooks/search.ipynb.
+TRANSCRIPTION_INDEX_NAME = "transcription-index"
+
+# Chunk-level index with a vector field, created by notebooks/search.ipynb. Hybrid search is off when unset.
+CHUNK_INDEX_NAME = os.environ.get("AZURE_SEARCH_CHUNK_INDEX")
+CHUNK_VECTOR_FIELD = "contentVector"
+CHUNK_FIELDS = ["id", "source", "transcription_id", "chunk", "start_seconds", "end_seconds", "content"]
+
+# Seconds an index gets to answer before the page goes on without its results.
+DEFAULT_TIMEOUT_SECONDS = float(os.environ.get("AZURE_SEARCH_TIMEOUT_SECONDS", 5))
+CONNECT_TIMEOUT_SECONDS = 3.05
+POOL_MAXSIZE = 16
+
+# Semantic configuration used by profiles that ask for captions. The index must define it.
+SEMANTIC_CONFIGURATION = os.environ.get("AZURE_SEARCH_SEMANTIC_CONFIGURATION", "content")
+
+
+@dataclass(frozen=True)
+class QueryProfile:
+    """What a caller needs back from a search: which fields, how many hits, and which passages.
+
+    Selecting only the needed fields keeps the service from returning whole
+    transcripts, with every phrase, for each hit.
+    """
+    name: str
+    select: List[str]
+    top: int = 5
+    highlight: List[str] = field(default_factory=list)
+    captions: bool = False
+    extra: Dict[str, Any] = field(default_factory=dict)
+    # Subfields of content/phrases, selected only from indexes that define phrases as nested items.
+    phrase_fields: List[str] = field(default_factory=list)
+
+    def params(self, structured_phrases: bool = True) -> Dict[str, Any]:
+        """Return the query parameters of this profile.
+
+        Older indexes store content/phrases as a JSON string, which has no
+        subfields to select, so phrase_fields are left out unless structured_phrases.
+        """
+        select = self.select + ([f"content/phrases/{name}" for name in self.phrase_fields] if structured_phrases else [])
+        params: Dict[str, Any] = {"$select": ",".join(select), "$top": self.top, **self.extra}
+        if self.highlight:
+            params["highlight"] = ",".join(self.highlight)
+            params["highlightPreTag"] = "**"
+            params["highlightPostTag"] = "**"
+        if self.captions:
+            params["queryType"] = "semantic"
+            params["semanticConfiguration"] = SEMANTIC_CONFIGURATION
+            params["captions"] = "extractive|highlight-false"
+        return params
+
+
+_LANGUAGE = {"queryLanguage": "en-us", "speller": "lexicon"}
+
+# The fields chunking.chunk_conversation reads. It falls back to the conversation text when
+# the index has no phrase subfields, or a document has no phrases.
+PROFILE_CHUNKS = QueryProfile(
+    name="chunks",
+    select=["metadata_storage_path", "content/transcription_id", "content/conversation"],
+    top=5,
+    extra=_LANGUAGE,
+    phrase_fields=["role", "display", "offsetInTicks", "duration"],
+)
+
+# Only the matching passages of each call, for listing calls rather than answering from them.
+PROFILE_PASSAGES = QueryProfile(
+    name="passages",
+    select=["metadata_storage_path", "content/transcription_id", "content/conversationDuration"],
+    top=10,
+    highlight=["content/conversation"],
+    extra=_LANGUAGE,
+)
+
+# Like PROFILE_PASSAGES, with semantic captions instead of keyword highlights.
+PROFILE_CAPTIONS = QueryProfile(
+    name="captions",
+    select=["metadata_storage_path", "content/transcription_id", "content/conversationDuration"],
+    top=10,
+    captions=True,
+    extra=_LANGUAGE,
+)
+
+QUERY_PROFILES = {profile.name: profile for profile in (PROFILE_CHUNKS, PROFILE_PASSAGES, PROFILE_CAPTIONS)}
+
+
+class SearchClient:
+    """Queries several indexes of one search service at once over a pooled session.
+
+    Each index is queried on its own thread, so a question takes as long as
+    the slowest index rather than the sum of all of them. An index that fails,
+    or does not answer within its timeout, is logged and left out of the results.
+
+    Example:
+        .. code-block:: python
+
+            client = SearchClient(endpoint, key)
+            results = client.search("customer agent name", [TRANSCRIPTION_INDEX_NAME])
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        key: str,
+        api_version: str = AZURE_SEARCH_API_VERSION,
+        max_workers: int = 8,
+    ) -> None:
+        self.endpoint = endpoint.rstrip("/")
+        self.api_version = api_version
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json", "api-key": key})
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self._structured_phrases: Dict[str, bool] = {}
+
+    def has_structured_phrases(self, index: str, timeout: float = DEFAULT_TIMEOUT_SECONDS) -> bool:
+        """Whether an index defines content/phrases as nested items, as notebooks/search.ipynb does.
+
+        The index definition is read once per index. If the key may not read it,
+        the index is treated as an older one, whose phrases are a string. If the
+        service does not answer, the same is assumed until a later call reads it.
+        """
+        if index in self._structured_phrases:
+            return self._structured_phrases[index]
+        try:
+            response = self.session.get(
+                f"{self.endpoint}/indexes/{index}",
+                params={"api-version": self.api_version},
+                timeout=(min(CONNECT_TIMEOUT_SECONDS, timeout), timeout),
+            )
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            logger.warning("Could not read the definition of index '%s', not selecting phrase fields: %r", index, e)
+            structured = False
+        except requests.RequestException as e:
+            logger.warning("Could not reach index '%s', not selecting phrase fields this time: %r", index, e)
+            return False
+        else:
+            content = next((f for f in response.json().get("fields", []) if f["name"] == "content"), {})
+            phrases = next((f for f in content.get("fields") or [] if f["name"] == "phrases"), {})
+            structured = phrases.get("type") == "Collection(Edm.ComplexType)"
+        self._structured_phrases[index] = structured
+        return structured
+
+    def search_index(
+        self,
+        index: str,
+        params: Dict[str, Any],
+        timeout: float,
+        parent: Optional[tracing.Span] = None,
+        profile: Optional[QueryProfile] = None,
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Query one index and return its response.
+
+        The profile's parameters go before params, with phrase fields selected if the index has them.
+        With a deadline, a time.monotonic() value, the request only gets the time left until then,
+        so a thread that waited for a free worker still returns in time.
+        """
+        if profile is not None:
+            params = {**profile.params(self.has_structured_phrases(index, timeout)), **params}
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise requests.Timeout(f"No time left to query index '{index}'")
+        with tracing.span("search.index", parent=parent, index=index) as index_span:
+            response = self.session.get(
+                f"{self.endpoint}/indexes/{index}/docs",
+                params={"api-version": self.api_version, **params},
+                timeout=(min(CONNECT_TIMEOUT_SECONDS, timeout), timeout),
+            )
+            index_span.set("bytes", len(response.content))
+            response.raise_for_status()
+            return response.json()
+
+    def search(
+        self,
+        query: str,
+        indexes: List[str],
+        profile: Union[str, QueryProfile, None] = None,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Union[float, Dict[str, float]] = DEFAULT_TIMEOUT_SECONDS,
+    ) -> List[Dict[str, Any]]:
+        """Query several indexes concurrently and merge their hits by score.
+
+        Args:
+            query: The search text. It is URL-encoded with the other parameters.
+            indexes: Names of the indexes to query.
+            profile: A QueryProfile, or the name of one in QUERY_PROFILES.
+            params: Further query parameters, which override those of the profile.
+            timeout: Seconds to wait for every index, or for each index by name.
+
+        Returns:
+            The hits of every index that answered in time, highest ``@search.score``
+            first, each with the name of its index under ``@search.index``.
+
+        Raises:
+            Exception: The error of the last index, if no index answered.
+        """
+        if isinstance(profile, str):
+            profile = QUERY_PROFILES[profile]
+        params = {"search": query, **(params or {})}
+        if profile is not None and profile.phrase_fields:
+            # Index definitions are read before the indexes' deadlines start, and only once:
+            # start_warmup reads the usual one before the first question.
+            list(self._executor.map(self.has_structured_phrases, [index for index in indexes if index not in self._structured_phrases]))
+        started = time.monotonic()
+        search_span = tracing.start_span("search", indexes=len(indexes), profile=profile.name if profile else None)
+        futures = {}
+        for index in indexes:
+            index_timeout = timeout.get(index, DEFAULT_TIMEOUT_SECONDS) if isinstance(timeout, dict) else timeout
+            index_params = params
+            if profile is not None:
+                index_params = {**profile.params(self._structured_phrases.get(index, False)), **params}
+            future = self._executor.submit(
+                self.search_index, index, index_params, index_timeout, search_span, deadline=started + index_timeout)
+            futures[index] = (future, index_timeout)
+
+        hits: List[Dict[str, Any]] = []
+        answered = 0
+        error: Optional[BaseException] = None
+        for index, (future, index_timeout) in futures.items():
+            try:
+                response = future.result(timeout=max(0.0, started + index_timeout - time.monotonic()))
+            except Exception as e:
+                logger.warning("Search index '%s' gave no results within %.1fs: %r", index, index_timeout, e)
+                error = e
+                continue
+            answered += 1
+            hits.extend(dict(hit, **{"@search.index": index}) for hit in response.get("value", []))
+
+        search_span.set("hits", len(hits))
+        search_span.end(error=error if indexes and not answered else None)
+        if indexes and not answered:
+            raise error
+        logger.info("Searched %d/%d index(es) in %.3fs", answered, len(indexes), time.monotonic() - started)
+        return sorted(hits, key=lambda hit: hit.get("@search.score") or 0.0, reverse=True)
+
+    def hybrid_search(
+        self,
+        query: str,
+        vector: List[float],
+        index: str,
+        top: int = 12,
+        k: int = 50,
+        select: Optional[List[str]] = None,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+    ) -> List[Dict[str, Any]]:
+        """Run a keyword and a vector query over a chunk index in one request.
+
+        The service fuses both rankings, so the hits are ready to use as context
+        without any embedding or vector search in the app beyond the question.
+
+        Args:
+            query: The search text.
+            vector: The embedding of the question.
+            index: Name of a chunk index with a CHUNK_VECTOR_FIELD field.
+            top: Number of hits to return.
+            k: Number of nearest neighbours the vector query contributes to the fusion.
+            select: Fields to return, defaults to CHUNK_FIELDS.
+            timeout: Seconds to wait for the service.
+
+        Returns:
+            The hits, best first.
+        """
+        started = time.monotonic()
+        with tracing.span("search.hybrid", index=index, top=top) as search_span:
+            response = self.session.post(
+                f"{self.endpoint}/indexes/{index}/docs/search",
+                params={"api-version": AZURE_SEARCH_VECTOR_API_VERSION},
+                json={
+                    "search": query,
+                    "vectorQueries": [{"kind": "vector", "vector": vector, "fields": CHUNK_VECTOR_FIELD, "k": k}],
+                    "select": ",".join(select or CHUNK_FIELDS),
+                    "top": top,
+                },
+                timeout=(min(CONNECT_TIMEOUT_SECONDS, timeout), timeout),
+            )
+            search_span.set("bytes", len(response.content))
+            response.raise_for_status()
+            hits = response.json().get("value", [])
+            search_span.set("hits", len(hits))
+        logger.info("Hybrid search of '%s' returned %d hit(s) in %.3fs", index, len(hits), time.monotonic() - started)
+        return hits
+
+
+def chunk_hits_to_documents(hits: List[Dict[str, Any]]) -> List[Document]:
+    """Turn hits of a chunk index into Documents with the metadata chunking.chunk_conversation sets."""
+    from langchain.docstore.document import Document
+
+    return [
+        Document(
+            page_content=hit["content"],
+            metadata={name: hit.get(name) for name in CHUNK_FIELDS if name not in ("id", "content")},
+        )
+        for hit in hits
+    ]
+
+
+_search_client: Optional[SearchClient] = None
+_search_client_lock = threading.Lock()
+
+
+def get_search_client() -> SearchClient:
+    """Return the process-wide client for AZURE_SEARCH_ENDPOINT, creating it on first use."""
+    global _search_client
+    with _search_client_lock:
+        if _search_client is None:
+            _search_client = SearchClient(os.environ["AZURE_SEARCH_ENDPOINT"], os.environ["AZURE_SEARCH_KEY"])
+        return _search_client
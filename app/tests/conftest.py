@@ -0,0 +1,6 @@
+"""Tests of the app's modules. Run from this folder's parent: ``python -m pytest tests``."""
+import os
+import sys
+
+# The pages import the app's modules from the app folder, as Streamlit runs them.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import chunking
+from chunking import chunk_conversation, duration_to_seconds, get_phrases
+
+
+@pytest.fixture(autouse=True)
+def count_words(monkeypatch):
+    # One token per word keeps the window sizes easy to work out, and needs no tokenizer download.
+    monkeypatch.setattr(chunking, "count_tokens", lambda text: len(text.split()))
+
+
+def _phrases(count, words=9, roles=("Agent", "Customer")):
+    """Phrases of ``words + 1`` tokens each, one second apart, alternating between roles."""
+    return [
+        {
+            "role": roles[i % len(roles)],
+            "display": " ".join(f"p{i}w{j}" for j in range(words)),
+            "offsetInTicks": i * chunking.TICKS_PER_SECOND,
+            "duration": "PT0.5S",
+        }
+        for i in range(count)
+    ]
+
+
+def _phrase_numbers(doc):
+    return [int(line.split()[1].split("w")[0][1:]) for line in doc.page_content.splitlines()]
+
+
+def test_windows_overlap_by_whole_turns():
+    conversation = {"transcription_id": "call-1", "phrases": _phrases(10)}
+    docs = chunk_conversation(conversation, source="call-1.json", chunk_tokens=35, overlap_tokens=15)
+    assert [_phrase_numbers(doc) for doc in docs] == [[0, 1, 2], [2, 3, 4], [4, 5, 6], [6, 7, 8], [8, 9]]
+    assert [doc.metadata["chunk"] for doc in docs] == [0, 1, 2, 3, 4]
+    assert [doc.metadata["tokens"] for doc in docs] == [30, 30, 30, 30, 20]
+    assert docs[1].metadata["start_seconds"] == 2.0
+    assert docs[1].metadata["end_seconds"] == 4.5
+    assert {doc.metadata["source"] for doc in docs} == {"call-1.json"}
+    assert {doc.metadata["transcription_id"] for doc in docs} == {"call-1"}
+
+
+@pytest.mark.parametrize("chunk_tokens,overlap_tokens", [(35, 0), (35, 25), (50, 20), (100, 60), (25, 40)])
+def test_windows_cover_every_phrase_and_move_forward(chunk_tokens, overlap_tokens):
+    conversation = {"phrases": _phrases(23)}
+    docs = chunk_conversation(conversation, source="call", chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+    windows = [_phrase_numbers(doc) for doc in docs]
+    assert windows[0][0] == 0 and windows[-1][-1] == 22
+    for previous, window in zip(windows, windows[1:]):
+        assert window[0] > previous[0]
+        # Each window starts inside the previous one, or right after it, and repeats at most overlap_tokens.
+        assert window[0] <= previous[-1] + 1
+        assert (previous[-1] - window[0] + 1) * 10 <= max(overlap_tokens, 0)
+    for doc in docs:
+        assert doc.metadata["tokens"] <= max(chunk_tokens, 10)
+
+
+def test_consecutive_phrases_of_a_speaker_stay_together():
+    phrases = _phrases(6, words=4, roles=("Agent",)) + _phrases(2, words=4, roles=("Customer",))
+    docs = chunk_conversation({"phrases": phrases}, source="call", chunk_tokens=25, overlap_tokens=0)
+    # The agent's six phrases make a turn of 25 tokens and one of 5, which shares a window with the customer's turn.
+    assert [len(doc.page_content.splitlines()) for doc in docs] == [5, 3]
+    assert docs[1].page_content.splitlines()[0].startswith("Agent: p5w0")
+
+
+def test_phrase_longer_than_a_window_is_a_window_of_its_own():
+    phrases = _phrases(3)
+    phrases[1]["display"] = " ".join(["long"] * 50)
+    docs = chunk_conversation({"phrases": phrases}, source="call", chunk_tokens=35, overlap_tokens=15)
+    assert [doc.metadata["tokens"] for doc in docs] == [10, 51, 10]
+
+
+def test_legacy_documents():
+    phrases = _phrases(2)
+    assert get_phrases({"phrases": json.dumps(phrases)}) == phrases
+    assert get_phrases({"conversation": "Agent: Hello, how can I help? \nCustomer: My order: it is late. \n"}) == [
+        {"role": "Agent", "display": "Hello, how can I help?"},
+        {"role": "Customer", "display": "My order: it is late."},
+    ]
+    docs = chunk_conversation({"conversation": "Agent: Hello \nCustomer: Hi \n"}, source="call")
+    assert len(docs) == 1
+    assert docs[0].metadata["start_seconds"] is None and docs[0].metadata["end_seconds"] is None
+
+
+def test_empty_conversation_has_no_windows():
+    assert chunk_conversation({"phrases": []}, source="call") == []
+
+
+@pytest.mark.parametrize("duration,seconds", [
+    ("PT1M2.5S", 62.5), ("PT2H", 7200.0), ("PT0S", 0.0), ("PT1.25S", 1.25), ("", None), (None, None), ("2 seconds", None),
+])
+def test_duration_to_seconds(duration, seconds):
+    assert duration_to_seconds(duration) == seconds
@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+
+import pytest
+
+import embeddings
+from embeddings import OpenAIEmbeddings
+from rate_limiter import RateLimiter
+
+
+class WordEncoding:
+    """One token per word, so batch sizes are easy to work out and no tokenizer is downloaded."""
+
+    def encode(self, text):
+        return text.split()
+
+
+class FakeClient:
+    """Stands in for openai.Embedding: the embedding of "text 7" is [7.0], returned out of order after a random delay."""
+
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def create(self, input, engine):
+        with self._lock:
+            self.requests.append(list(input))
+        time.sleep(random.uniform(0, 0.02))
+        data = [{"index": i, "embedding": [float(text.split()[-1])]} for i, text in enumerate(input)]
+        random.shuffle(data)
+        return {"data": data}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://openai")
+    monkeypatch.setattr(embeddings, "get_encoding", lambda model_name: WordEncoding())
+    monkeypatch.setattr(embeddings, "count_tokens", lambda text, model_name="": len(text.split()))
+    return FakeClient()
+
+
+def _embeddings(client, **settings):
+    model = OpenAIEmbeddings(rate_limiter=RateLimiter({"text-embedding-ada-002": (100000, 10000000)}), **settings)
+    model.client = client
+    return model
+
+
+def _texts(count, words=1):
+    return [" ".join(["word"] * (words - 1) + [str(i)]) for i in range(count)]
+
+
+def test_batches_are_limited_by_items(client):
+    model = _embeddings(client, chunk_size=4, max_batch_tokens=1000)
+    assert [len(batch) for batch, _ in model._batches(_texts(10), engine="text-embedding-ada-002")] == [4, 4, 2]
+
+
+def test_batches_are_limited_by_tokens(client):
+    model = _embeddings(client, chunk_size=16, max_batch_tokens=10)
+    batches = list(model._batches(_texts(7, words=3), engine="text-embedding-ada-002"))
+    assert [(len(batch), tokens) for batch, tokens in batches] == [(3, 9), (3, 9), (1, 3)]
+
+
+def test_text_over_the_token_limit_is_sent_alone(client):
+    model = _embeddings(client, chunk_size=16, max_batch_tokens=10)
+    texts = _texts(2, words=3) + [" ".join(["long"] * 25 + ["2"])] + _texts(2, words=3)
+    batches = [batch for batch, _ in model._batches(texts, engine="text-embedding-ada-002")]
+    assert [len(batch) for batch in batches] == [2, 1, 2]
+    assert model.embed_documents(texts) == [[0.0], [1.0], [2.0], [0.0], [1.0]]
+
+
+def test_newlines_are_replaced_before_counting(client):
+    model = _embeddings(client)
+    assert list(model._batches(["a\nb", "c"], engine="text-embedding-ada-002")) == [(["a b", "c"], 3)]
+
+
+def test_empty_input(client):
+    model = _embeddings(client)
+    assert list(model._batches([], engine="text-embedding-ada-002")) == []
+    assert model.embed_documents([]) == []
+    assert client.requests == []
+
+
+def test_order_is_kept_across_concurrent_batches(client):
+    model = _embeddings(client, chunk_size=3, max_batch_tokens=1000, max_concurrency=4)
+    result = model.embed_documents(_texts(50))
+    assert result == [[float(i)] for i in range(50)]
+    assert len(client.requests) == 17
+    assert sorted(text for request in client.requests for text in request) == sorted(_texts(50))
@@ -0,0 +1,117 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimitBudgetExceeded, RateLimiter, parse_rate_limits
+
+
+class FakeClock:
+    """Stands in for the time module, so waits are checked without sleeping."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("text-embedding-ada-002=720/120000, gpt-4-32k=60/60000,") == {
+        "text-embedding-ada-002": (720, 120000),
+        "gpt-4-32k": (60, 60000),
+    }
+
+
+def test_acquire_within_capacity_does_not_wait(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    for _ in range(60):
+        assert limiter.acquire("chat", 100, deadline=clock.now) == 0
+    assert clock.slept == []
+
+
+def test_acquire_queues_for_tokens(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    limiter.acquire("chat", 6000, deadline=clock.now)
+    # The bucket refills at 100 tokens a second.
+    assert limiter.acquire("chat", 500, deadline=clock.now + 10) == pytest.approx(5)
+    assert clock.slept == [pytest.approx(5)]
+
+
+def test_acquire_queues_behind_earlier_reservations(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    limiter.acquire("chat", 6000, deadline=clock.now)
+    first = limiter.acquire("chat", 1000, deadline=clock.now + 60)
+    second = limiter.acquire("chat", 1000, deadline=clock.now + 60)
+    assert (first, second) == (pytest.approx(10), pytest.approx(10))
+    assert sum(clock.slept) == pytest.approx(20)
+
+
+def test_acquire_over_budget_fails_without_reserving(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    limiter.acquire("chat", 6000, deadline=clock.now)
+    with pytest.raises(RateLimitBudgetExceeded):
+        limiter.acquire("chat", 1000, deadline=clock.now + 5)
+    assert clock.slept == []
+    # The failed call took nothing, so a call that fits the budget waits as if it never happened.
+    assert limiter.acquire("chat", 400, deadline=clock.now + 5) == pytest.approx(4)
+
+
+def test_tokens_are_capped_at_the_bucket_capacity(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    assert limiter.acquire("chat", 10000, deadline=clock.now) == 0
+
+
+def test_deployments_have_their_own_buckets(clock):
+    limiter = RateLimiter({"chat": (1, 6000)})
+    limiter.acquire("chat", 1, deadline=clock.now)
+    assert limiter.acquire("embeddings", 1, deadline=clock.now) == 0
+    with pytest.raises(RateLimitBudgetExceeded):
+        limiter.acquire("chat", 1, deadline=clock.now + 30)
+
+
+def test_block_holds_calls(clock):
+    limiter = RateLimiter({"chat": (60, 6000)})
+    limiter.block("chat", 3)
+    with pytest.raises(RateLimitBudgetExceeded):
+        limiter.acquire("chat", 1, deadline=clock.now + 2)
+    assert limiter.acquire("chat", 1, deadline=clock.now + 3) == pytest.approx(3)
+
+
+def test_call_retries_after_throttling(clock):
+    from openai.error import RateLimitError
+
+    limiter = RateLimiter({"chat": (60, 6000)}, latency_budget_seconds=20)
+    responses = [RateLimitError("throttled", headers={"retry-after": "2"}), "answer"]
+
+    def func():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call("chat", 100, func) == "answer"
+    assert clock.slept == [pytest.approx(2)]
+
+
+def test_call_fails_when_throttling_outlasts_the_budget(clock):
+    from openai.error import RateLimitError
+
+    limiter = RateLimiter({"chat": (60, 6000)}, latency_budget_seconds=5)
+
+    def func():
+        raise RateLimitError("throttled", headers={"retry-after": "30"})
+
+    with pytest.raises(RateLimitBudgetExceeded):
+        limiter.call("chat", 100, func)
+    assert clock.slept == []
@@ -0,0 +1,24 @@
+"""Local token counting with tiktoken, loaded once per process."""
+from functools import lru_cache
+from typing import Any
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> Any:
+    """Return the tiktoken encoding used to count tokens for a model."""
+    try:
+        import tiktoken
+    except ImportError:
+        raise ValueError(
+            "Could not import tiktoken python package. "
+            "Please it install it with `pip install tiktoken`."
+        )
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: str = "text-embedding-ada-002") -> int:
+    """Count the tokens of a text with the tokenizer of a model, without calling the API."""
+    return len(get_encoding(model_name).encode(text))
@@ -0,0 +1,156 @@
+"""Spans timing each stage of answering a question or ingesting a recording, exported as JSON lines.
+
+Set TRACE_FILE to a file that finished spans are appended to, one JSON object
+per line. The fields follow the OpenTelemetry span data model: hex trace and
+span IDs, start and end times in Unix nanoseconds, attributes and a status.
+Payload sizes are recorded in the ``bytes`` attribute and token counts in
+``tokens``, ``prompt_tokens`` and ``completion_tokens``, so
+``scripts/trace_report.py`` can tell where the seconds, bytes and tokens go.
+
+Without TRACE_FILE, spans are still timed but not written anywhere.
+
+The app and the ingestion scripts are deployed separately, so this file is
+kept twice, as app/tracing.py and scripts/utils/tracing.py. Edit one and copy
+it over the other; scripts/tests/test_tracing.py checks they are the same.
+
+Example:
+    .. code-block:: python
+
+        with tracing.span("upload", parent=job.span, bytes=job.audio_bytes):
+            blobs.upload_audio_file_to_container(...)
+"""
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+# Each copy names its service after the folder it is in.
+_SERVICE_NAMES = {"app": "gpt-call-center-app", "utils": "gpt-call-center-ingestion"}
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME") or _SERVICE_NAMES.get(
+    os.path.basename(os.path.dirname(os.path.abspath(__file__))), "gpt-call-center")
+
+
+class Span:
+    """A timed operation, with the attributes recorded while it ran."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None,
+                 start_ns: Optional[int] = None) -> None:
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[BaseException] = None
+        self._started = time.perf_counter()
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float = 1) -> None:
+        """Add to a counter attribute, such as ``bytes`` or ``tokens``."""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    @property
+    def seconds(self) -> float:
+        if self.end_ns is not None:
+            return (self.end_ns - self.start_ns) / 1e9
+        return time.perf_counter() - self._started
+
+    def end(self, error: Optional[BaseException] = None, end_ns: Optional[int] = None) -> None:
+        """Finish the span and export it. Later calls do nothing."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else self.start_ns + int((time.perf_counter() - self._started) * 1e9)
+        self.error = error
+        if _exporter is not None:
+            _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        status = {"code": "ERROR", "message": repr(self.error)} if self.error is not None else {"code": "OK"}
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "attributes": self.attributes,
+            "status": status,
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+
+
+_exporter: Optional[JsonLinesExporter] = JsonLinesExporter(TRACE_FILE) if TRACE_FILE else None
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+
+def set_exporter(exporter: Optional[JsonLinesExporter]) -> None:
+    """Replace the exporter set up from TRACE_FILE, or turn exporting off with None."""
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Optional[Span]:
+    """The innermost span opened with span() in this thread, if any."""
+    return _current.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+    """Start a span that the caller ends, for work that does not fit in a with block.
+
+    The span is a child of parent, or of the current span, but does not become
+    the current span itself.
+    """
+    return Span(name, parent if parent is not None else _current.get(), attributes)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Span]:
+    """Time a block as a span, the current span while the block runs."""
+    current = start_span(name, parent, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def record_span(name: str, start: float, end: float, parent: Optional[Span] = None, **attributes: Any) -> Span:
+    """Export a span measured elsewhere, from its start and end as time.time() values."""
+    recorded = Span(name, parent, attributes, start_ns=int(start * 1e9))
+    recorded.end(end_ns=int(end * 1e9))
+    return recorded
+
+
+def add(key: str, value: float = 1) -> None:
+    """Add to a counter attribute of the current span, if there is one."""
+    current = _current.get()
+    if current is not None:
+        current.add(key, value)
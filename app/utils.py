@@ -1,27 +1,28 @@
-import re
-from typing import Any, Dict, List
+from __future__ import annotations
 
-import streamlit as st
+import os
+from typing import TYPE_CHECKING, Iterator, List, Optional
 
-from embeddings import OpenAIEmbeddings
-from langchain.chains.qa_with_sources import load_qa_with_sources_chain
-from langchain.docstore.document import Document
-from langchain.vectorstores.faiss import FAISS
-from langchain.vectorstores import VectorStore
+import tracing
+from rate_limiter import get_rate_limiter
+from resources import configure_openai, get_embeddings
+from tokenizer import count_tokens
 
-import os
-import openai
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+    from langchain.vectorstores import VectorStore
+
+# Chat deployment used to answer questions. Context is packed to a token budget,
+# see context_builder.py, so a smaller, faster deployment than gpt-4-32k fits.
+CHAT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4-32k")
 
-def get_answer(query, context):
-    openai.api_type = "azure"
-    openai.api_base = os.environ.get("AZURE_OPENAI_ENDPOINT")
-    openai.api_version = "2023-03-15-preview"
-    openai.api_key = os.environ.get("AZURE_OPENAI_API_KEY")
+def _answer_request(query, context, deployment=None):
+    configure_openai()
 
-    content = "You are an enterprise Call Center chatbot whose primary goal is to help users extract insights from calls bewteen agents and customers. \n•\tProvide concise replies that are polite and professional. \n•\tAnswer questions truthfully based on provided below context. \n•\tDo not answer questions that are not related to conversations and respond with \"I can only help with any call center questions you may have.\". \n•\tIf you do not know the answer to a question, respond by saying “I do not know the answer to your question in the prodvided context”\n•\t"
+    content = "You are an enterprise Call Center chatbot whose primary goal is to help users extract insights from calls bewteen agents and customers. \n•\tProvide concise replies that are polite and professional. \n•\tAnswer questions truthfully based on provided below context. \n•\tDo not answer questions that are not related to conversations and respond with \"I can only help with any call center questions you may have.\". \n•\tIf you do not know the answer to a question, respond by saying “I do not know the answer to your question in the prodvided context”\n•\tThe context is made of numbered excerpts of calls. Cite the excerpts you use by their number, for example [1].\n•\t"
 
-    response = openai.ChatCompletion.create(
-                engine="gpt-4-32k",
+    return dict(
+                engine=deployment or CHAT_DEPLOYMENT,
                 messages = [{"role":"system","content":content+context}
                             ,{"role":"user","content": query}],
                 temperature=0.7,
@@ -30,26 +31,81 @@ def get_answer(query, context):
                 frequency_penalty=0,
                 presence_penalty=0,
                 stop=None)
-                
+
+def _create_completion(query, context, deployment=None, span=None, **kwargs):
+    import openai
+
+    request = _answer_request(query, context, deployment)
+    prompt_tokens = sum(count_tokens(message["content"], "gpt-4") for message in request["messages"])
+    if span is not None:
+        span.set("deployment", request["engine"])
+        span.set("prompt_tokens", prompt_tokens)
+    # Azure OpenAI counts max_tokens against the tokens-per-minute limit, whatever the answer's length.
+    tokens = prompt_tokens + request["max_tokens"]
+    return get_rate_limiter().call(request["engine"], tokens, lambda: openai.ChatCompletion.create(**request, **kwargs))
+
+def get_answer(query, context, deployment=None):
+    with tracing.span("completion", stream=False) as completion_span:
+        response = _create_completion(query, context, deployment, span=completion_span)
+        usage = response.get("usage") or {}
+        if usage.get("prompt_tokens"):
+            completion_span.set("prompt_tokens", usage["prompt_tokens"])
+        completion_span.set("completion_tokens", usage.get("completion_tokens"))
+
     return response.choices[0].message.content
 
+def stream_answer(query, context, deployment=None) -> Iterator[str]:
+    """Yields the answer in pieces as the chat deployment generates them.
+
+    Closing the generator, for example when the question changes, stops reading the response.
+    """
+    # Not the current span: the generator may be resumed and closed from elsewhere.
+    completion_span = tracing.start_span("completion", stream=True)
+    pieces = []
+    error = None
+    try:
+        response = _create_completion(query, context, deployment, span=completion_span, stream=True)
+        try:
+            for chunk in response:
+                # Azure OpenAI may send chunks without choices, such as content filter results.
+                if chunk.choices and chunk.choices[0].delta.get("content"):
+                    if not pieces:
+                        completion_span.set("first_token_ms", round(completion_span.seconds * 1000, 1))
+                    pieces.append(chunk.choices[0].delta["content"])
+                    yield pieces[-1]
+        finally:
+            response.close()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Streamed responses carry no usage, so the answer is counted here.
+        completion_span.set("completion_tokens", count_tokens("".join(pieces), "gpt-4"))
+        completion_span.end(error=error)
+
 def embed_docs(docs: List[Document], language: str) -> VectorStore:
     """Embeds a list of Documents and returns a FAISS index"""
+    # langchain takes seconds to import, so it is only loaded once a question needs it.
+    from langchain.vectorstores.faiss import FAISS
 
-    embeddings = OpenAIEmbeddings(
-        document_model_name="text-embedding-ada-002",
-        query_model_name="text-embedding-ada-002",
-    )
-    
-    index = FAISS.from_documents(docs, embeddings)
+    with tracing.span("faiss.build", docs=len(docs)):
+        index = FAISS.from_documents(docs, get_embeddings())
 
     return index
 
 
-def search_docs(index: VectorStore, query: str) -> List[Document]:
-    """Searches a FAISS index for similar chunks to the query and returns a list of Documents."""
+def search_docs(index: VectorStore, query: str, k: int = 4, query_embedding: Optional[List[float]] = None) -> List[Document]:
+    """Searches a FAISS index for similar chunks to the query and returns a list of Documents.
+
+    Pass query_embedding when the query is already embedded, so it is not embedded again.
+    """
 
     # Search for similar chunks
-    documents = index.similarity_search(query, k=4)
+    with tracing.span("faiss.search", k=k) as search_span:
+        if query_embedding is None:
+            documents = index.similarity_search(query, k=k)
+        else:
+            documents = index.similarity_search_by_vector(query_embedding, k=k)
+        search_span.set("hits", len(documents))
 
     return documents
\ No newline at end of file
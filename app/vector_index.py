@@ -0,0 +1,219 @@
+"""Prebuilt FAISS index over the conversations in the transcription container.
+
+The index is built offline, once per conversation, and saved to disk next to a
+manifest of the blobs it covers. The app memory-maps the saved index instead of
+embedding search results on every question, so answering a question only
+embeds the question and runs one nearest-neighbour lookup.
+
+Run this module to build or update the index:
+
+    .. code-block:: bash
+
+        cd app
+        python vector_index.py
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import pickle
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from answer_cache import get_answer_cache
+from chunking import chunk_conversation
+from rate_limiter import get_rate_limiter
+from resources import get_embeddings
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+    from langchain.vectorstores.faiss import FAISS
+
+    from embeddings import OpenAIEmbeddings
+
+DEFAULT_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "vector_index")
+DEFAULT_CONTAINER_NAME = os.environ.get("VECTOR_INDEX_CONTAINER", "transcription")
+
+INDEX_NAME = "index"
+MANIFEST_FILE = "manifest.json"
+
+# Bumped whenever documents are chunked differently, so saved indexes are rebuilt.
+INDEX_VERSION = 2
+
+
+def read_conversation(blob_name: str, data: bytes) -> Dict[str, Any]:
+    """Parse a conversation published by the ingestion pipeline.
+
+    Handles every output format of ``scripts/utils/conversation.py``: a JSON
+    document, the same document gzip-compressed, or a header line followed by
+    one JSON line per phrase. JSON lines written before the header was added
+    only have the phrases, so the conversation text is rebuilt from them.
+    """
+    if blob_name.endswith(".gz"):
+        data = gzip.decompress(data)
+    if not blob_name.endswith(".jsonl"):
+        return json.loads(data)
+
+    lines = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+    if lines and "conversation" in lines[0]:
+        return dict(lines[0], phrases=lines[1:])
+
+    first = lines[0] if lines else {}
+    return {
+        "source": first.get("source"),
+        "transcription_id": first.get("transcription_id"),
+        "conversation": "".join(f"{phrase['role']}: {phrase['display']} \n" for phrase in lines),
+        "phrases": lines,
+    }
+
+
+def iter_conversation_blobs(container_client: Any) -> Iterator[Tuple[str, str]]:
+    """Yield the name and ETag of every published conversation in a container."""
+    for blob in container_client.list_blobs():
+        if blob.name.endswith((".json", ".jsonl", ".json.gz")):
+            yield blob.name, blob.etag
+
+
+class VectorIndex:
+    """A FAISS index saved in a directory together with the blobs it was built from."""
+
+    def __init__(self, directory: str = DEFAULT_INDEX_DIR) -> None:
+        self.directory = directory
+        self.store: Optional[FAISS] = None
+        self.manifest: Dict[str, str] = {}
+        self.outdated = False
+        self.loaded_mtime: Optional[float] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def exists(self) -> bool:
+        """Return whether an index has been saved in the directory."""
+        return os.path.exists(self.manifest_path)
+
+    def load(self, embeddings: Optional[OpenAIEmbeddings] = None) -> "VectorIndex":
+        """Load the saved index, memory-mapping the vectors where FAISS supports it."""
+        from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+        faiss = dependable_faiss_import()
+        embeddings = embeddings or get_embeddings()
+        index_path = os.path.join(self.directory, f"{INDEX_NAME}.faiss")
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = faiss.read_index(index_path)
+        with open(os.path.join(self.directory, f"{INDEX_NAME}.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        self.outdated = manifest.get("version") != INDEX_VERSION
+        self.manifest = manifest.get("blobs", {})
+
+        self.store = FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+        self.loaded_mtime = os.path.getmtime(self.manifest_path)
+        return self
+
+    def is_stale(self) -> bool:
+        """Return whether the saved index changed since it was loaded."""
+        return self.exists() and os.path.getmtime(self.manifest_path) != self.loaded_mtime
+
+    def save(self) -> None:
+        """Save the index, replacing the previous files only once the new ones are written."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.store.save_local(self.directory, index_name=f"{INDEX_NAME}.tmp")
+        for extension in ("faiss", "pkl"):
+            os.replace(
+                os.path.join(self.directory, f"{INDEX_NAME}.tmp.{extension}"),
+                os.path.join(self.directory, f"{INDEX_NAME}.{extension}"),
+            )
+        # The manifest is written last, so it never describes vectors that were not saved.
+        manifest_tmp = f"{self.manifest_path}.tmp"
+        with open(manifest_tmp, "w") as f:
+            json.dump({"version": INDEX_VERSION, "blobs": self.manifest}, f)
+        os.replace(manifest_tmp, self.manifest_path)
+
+    def update(
+        self,
+        container_client: Any,
+        embeddings: Optional[OpenAIEmbeddings] = None,
+    ) -> Tuple[int, int]:
+        """Bring the index up to date with the conversations in a container.
+
+        New conversations are embedded and added to the existing index. If a
+        conversation was changed or removed, the index is rebuilt; conversations
+        that did not change are then served from the embedding cache.
+
+        Returns:
+            The number of conversations embedded, and the number of chunks added.
+        """
+        from langchain.vectorstores.faiss import FAISS
+
+        embeddings = embeddings or get_embeddings()
+        if self.store is None and self.exists():
+            self.load(embeddings)
+
+        blobs = dict(iter_conversation_blobs(container_client))
+        rebuild = self.outdated or any(blobs.get(name) != etag for name, etag in self.manifest.items())
+        if rebuild:
+            self.store, self.manifest, self.outdated = None, {}, False
+        pending = [name for name, etag in blobs.items() if self.manifest.get(name) != etag]
+        if not pending:
+            return 0, 0
+
+        docs: List[Document] = []
+        for name in pending:
+            blob_client = container_client.get_blob_client(name)
+            conversation = read_conversation(name, blob_client.download_blob().readall())
+            docs.extend(chunk_conversation(conversation, source=blob_client.url))
+
+        if docs:
+            if self.store is None:
+                self.store = FAISS.from_documents(docs, embeddings)
+            else:
+                self.store.add_documents(docs)
+        if self.store is not None:
+            self.manifest.update((name, blobs[name]) for name in pending)
+            self.save()
+        return len(pending), len(docs)
+
+
+_vector_index: Optional[VectorIndex] = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index(directory: str = DEFAULT_INDEX_DIR) -> Optional[VectorIndex]:
+    """Return the process-wide prebuilt index, or None if it has not been built.
+
+    The index is loaded on first use and reloaded when the indexing job saves a
+    newer version. Cached answers are dropped if a transcript they may have
+    been based on changed or was removed.
+    """
+    global _vector_index
+    with _vector_index_lock:
+        if _vector_index is None or _vector_index.directory != directory or _vector_index.is_stale():
+            previous = _vector_index
+            vector_index = VectorIndex(directory)
+            _vector_index = vector_index.load() if vector_index.exists() else None
+            if previous is not None and (
+                _vector_index is None
+                or any(_vector_index.manifest.get(name) != etag for name, etag in previous.manifest.items())
+            ):
+                get_answer_cache().invalidate()
+        return _vector_index
+
+
+if __name__ == "__main__":
+    from azure.storage.blob import ContainerClient
+
+    container_client = ContainerClient.from_connection_string(
+        os.environ["AZURE_STORAGE_CONNECTION_STRING"], DEFAULT_CONTAINER_NAME
+    )
+    # The offline job queues for capacity as long as it takes instead of failing like an interactive request.
+    get_rate_limiter().latency_budget_seconds = float("inf")
+    vector_index = VectorIndex()
+    conversations, chunks = vector_index.update(container_client)
+    print(
+        f"Indexed {conversations} conversation(s) as {chunks} chunk(s) in '{vector_index.directory}'"
+    )
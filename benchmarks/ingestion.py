@@ -0,0 +1,85 @@
+"""Benchmark the ingestion pipeline of scripts/call_center.py against local stand-ins.
+
+Synthetic WAV recordings are uploaded, transcribed and published through the
+Speech and Blob stand-ins, and the time each recording took from upload to
+publish is reported with the pipeline's own stage timings:
+
+    .. code-block:: bash
+
+        python benchmarks/ingestion.py --files 200 --audio-seconds 60 --latency-ms 40
+        python benchmarks/ingestion.py --service blob:requests_per_second=20 --json ingestion.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+from latency import add_stand_in_arguments, format_counts, format_summaries, stand_in_config, summarize, write_json
+from stand_ins import ACCOUNT_KEY, StandInServer
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts")
+
+STORAGE_ACCOUNT_NAME = "standin"
+
+
+def write_recordings(directory: str, count: int, audio_seconds: float) -> list:
+    """Write count silent 16 kHz, 16-bit mono WAV files, and return their paths."""
+    frames = b"\0\0" * int(16000 * audio_seconds)
+    paths = []
+    for number in range(count):
+        path = os.path.join(directory, f"call-{number:05d}.wav")
+        with wave.open(path, "wb") as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(16000)
+            audio.writeframes(frames)
+        paths.append(path)
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20, help="Number of recordings.")
+    parser.add_argument("--audio-seconds", type=float, default=30, help="Length of each recording.")
+    parser.add_argument("--max-workers", type=int, default=8, help="Worker threads for each pipeline stage.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Recordings per transcription job.")
+    parser.add_argument("--poll-seconds", type=float, default=0.5, help="Shortest interval between status checks.")
+    add_stand_in_arguments(parser)
+    args = parser.parse_args()
+    config = stand_in_config(args)
+
+    with StandInServer(config) as server, tempfile.TemporaryDirectory() as directory:
+        # Read when the scripts' modules are imported, so set before importing them.
+        os.environ["AZURE_STORAGE_ACCOUNT_URL"] = f"{server.url}/{{account}}"
+        os.environ["AZURE_STORAGE_ACCOUNT_KEY"] = ACCOUNT_KEY
+        sys.path.insert(0, SCRIPTS_DIR)
+        from utils import pipeline
+
+        recordings = write_recordings(directory, args.files, args.audio_seconds)
+        ingestion_pipeline = pipeline.IngestionPipeline(storage_account_name = STORAGE_ACCOUNT_NAME
+                                                        , source_container_name = "landing"
+                                                        , target_container_name = "transcription"
+                                                        , speech_endpoint = server.url
+                                                        , speech_subscription_key = "stand-in"
+                                                        , max_workers = args.max_workers
+                                                        , poll_seconds = args.poll_seconds
+                                                        , batch_size = args.batch_size
+                                                        , batch_linger_seconds = args.poll_seconds)
+        started = time.monotonic()
+        stats = ingestion_pipeline.run(recordings)
+        elapsed = time.monotonic() - started
+
+    summaries = [summarize("ingest file", stats.file_seconds, elapsed, errors=stats.failed)]
+    print(stats.report())
+    print()
+    print(format_summaries(summaries))
+    print()
+    print(format_counts(server.counts))
+    if args.json:
+        write_json(args.json, summaries, server.counts, config)
+
+
+if __name__ == "__main__":
+    main()
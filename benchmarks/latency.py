@@ -0,0 +1,122 @@
+"""Latency percentiles, throughput and the command-line options shared by the benchmarks."""
+import argparse
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, List, Sequence
+
+from stand_ins import SERVICES, PayloadConfig, ServiceConfig, StandInConfig
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """The q-th percentile of values, interpolated linearly between the closest ranks."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+@dataclass
+class Summary:
+    """Latency distribution and throughput of one measured operation."""
+    name: str
+    count: int
+    errors: int
+    elapsed_seconds: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    max_ms: float
+    throughput_per_second: float
+
+
+def summarize(name: str, seconds: Sequence[float], elapsed_seconds: float, errors: int = 0) -> Summary:
+    """Summarize the latencies, in seconds, of the operations completed in elapsed_seconds."""
+    return Summary(
+        name=name,
+        count=len(seconds),
+        errors=errors,
+        elapsed_seconds=elapsed_seconds,
+        p50_ms=percentile(seconds, 50) * 1000,
+        p95_ms=percentile(seconds, 95) * 1000,
+        p99_ms=percentile(seconds, 99) * 1000,
+        mean_ms=sum(seconds) / len(seconds) * 1000 if seconds else float("nan"),
+        max_ms=max(seconds) * 1000 if seconds else float("nan"),
+        throughput_per_second=len(seconds) / elapsed_seconds if elapsed_seconds > 0 else float("nan"),
+    )
+
+
+def format_summaries(summaries: List[Summary]) -> str:
+    lines = [f"{'operation':<16} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'per s':>8}"]
+    for summary in summaries:
+        lines.append(f"{summary.name:<16} {summary.count:>6} {summary.errors:>6} {summary.p50_ms:>9.1f} "
+                     f"{summary.p95_ms:>9.1f} {summary.p99_ms:>9.1f} {summary.max_ms:>9.1f} {summary.throughput_per_second:>8.2f}")
+    return "\n".join(lines)
+
+
+def format_counts(counts: Dict[str, Dict[str, int]]) -> str:
+    lines = [f"{'stand-in':<8} {'requests':>9} {'throttled':>9} {'KB in':>10} {'KB out':>10}"]
+    for service, count in counts.items():
+        lines.append(f"{service:<8} {count['requests']:>9} {count['throttled']:>9} "
+                     f"{count['bytes_in'] / 1024:>10.1f} {count['bytes_out'] / 1024:>10.1f}")
+    return "\n".join(lines)
+
+
+def write_json(path: str, summaries: List[Summary], counts: Dict[str, Dict[str, int]], config: StandInConfig) -> None:
+    """Save the results, to compare runs and catch regressions."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"summaries": [asdict(summary) for summary in summaries], "stand_ins": counts,
+                   "config": asdict(config)}, f, indent=2)
+
+
+def add_stand_in_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("stand-ins")
+    group.add_argument("--latency-ms", type=float, default=ServiceConfig.latency_ms, help="Added latency of every service.")
+    group.add_argument("--jitter-ms", type=float, default=ServiceConfig.jitter_ms, help="Random variation of the latency.")
+    group.add_argument("--requests-per-second", type=float, default=ServiceConfig.requests_per_second,
+                       help="Requests per second each service serves before throttling, 0 for no limit.")
+    group.add_argument("--throttle-fraction", type=float, default=ServiceConfig.throttle_fraction,
+                       help="Fraction of requests throttled at random.")
+    group.add_argument("--retry-after-ms", type=int, default=ServiceConfig.retry_after_ms,
+                       help="Retry-after time sent with throttled requests.")
+    group.add_argument("--service", action="append", default=[], metavar="NAME:FIELD=VALUE[,FIELD=VALUE]",
+                       help=f"Override the settings above for one of {', '.join(SERVICES)}, "
+                            "for example openai:latency_ms=400,requests_per_second=5.")
+    payload = PayloadConfig()
+    group.add_argument("--phrases", type=int, default=payload.phrases_per_call, help="Phrases per call.")
+    group.add_argument("--words-per-phrase", type=int, default=payload.words_per_phrase)
+    group.add_argument("--corpus", type=int, default=payload.corpus_size, help="Distinct conversations served.")
+    group.add_argument("--transcription-seconds", type=float, default=payload.transcription_seconds,
+                       help="Seconds a transcription runs before it succeeds.")
+    group.add_argument("--search-hits", type=int, default=payload.search_hits)
+    group.add_argument("--answer-words", type=int, default=payload.answer_words)
+    group.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+
+
+def stand_in_config(args: argparse.Namespace) -> StandInConfig:
+    """Build the stand-in configuration from the options added by add_stand_in_arguments."""
+    services = {
+        service: ServiceConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               requests_per_second=args.requests_per_second,
+                               throttle_fraction=args.throttle_fraction, retry_after_ms=args.retry_after_ms)
+        for service in SERVICES
+    }
+    types = {field.name: field.type for field in fields(ServiceConfig)}
+    for override in args.service:
+        service, _, settings = override.partition(":")
+        if service not in services:
+            raise argparse.ArgumentTypeError(f"Unknown service '{service}', expected one of {SERVICES}")
+        for setting in settings.split(","):
+            name, _, value = setting.partition("=")
+            if name not in types:
+                raise argparse.ArgumentTypeError(f"Unknown setting '{name}', expected one of {list(types)}")
+            setattr(services[service], name, types[name](value))
+
+    payload = PayloadConfig(phrases_per_call=args.phrases, words_per_phrase=args.words_per_phrase,
+                            corpus_size=args.corpus, transcription_seconds=args.transcription_seconds,
+                            search_hits=args.search_hits, answer_words=args.answer_words)
+    return StandInConfig(services=services, payload=payload, seed=args.seed)
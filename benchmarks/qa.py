@@ -0,0 +1,174 @@
+"""Benchmark the app's question-answer path against local stand-ins.
+
+Each question goes through the same steps as the support page: the Azure
+Search query with the chunks profile, chunking of the hits, embed_docs and
+search_docs over them, build_context and get_answer. With ``--hybrid`` the
+question is answered from a hybrid query of a chunk index instead. Questions
+run concurrently, like sessions of the app:
+
+    .. code-block:: bash
+
+        python benchmarks/qa.py --questions 200 --concurrency 8
+        python benchmarks/qa.py --hybrid --stream --service openai:latency_ms=300
+        AZURE_OPENAI_RATE_LIMITS=gpt-4-32k=60/60000 python benchmarks/qa.py --concurrency 16
+
+The app's rate limiter applies as configured, so questions beyond the
+deployments' limits fail fast and are counted as errors.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from latency import add_stand_in_arguments, format_counts, format_summaries, stand_in_config, summarize, write_json
+from stand_ins import _WORDS, StandInServer
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+
+# Same as the support page.
+CONTEXT_CANDIDATES = 12
+SEARCH_INDEXES = ["transcription-index"]
+CHUNK_INDEX = "transcription-chunks-index"
+
+STAGES = ["search", "chunk", "embed", "retrieve", "context", "first token", "answer", "question"]
+
+
+class Timings:
+    """Latencies of every stage, collected from several threads."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[stage].append(seconds)
+
+    def fail(self, stage: str) -> None:
+        with self._lock:
+            self.errors[stage] += 1
+
+
+def make_questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What did the customer say about the {rng.choice(_WORDS)} {rng.choice(_WORDS)}?" for _ in range(count)]
+
+
+def answer_question(query: str, args: argparse.Namespace, timings: Timings) -> None:
+    from chunking import chunk_conversation
+    from context_builder import build_context
+    from resources import get_embeddings
+    from search_client import PROFILE_CHUNKS, chunk_hits_to_documents, get_search_client
+    from utils import embed_docs, get_answer, search_docs, stream_answer
+
+    started = time.monotonic()
+    try:
+        if args.hybrid:
+            # The question is embedded before the hybrid query, and timed and counted on its own.
+            stage, stage_started = "embed", time.monotonic()
+            vector = get_embeddings().embed_query(query)
+            timings.add("embed", time.monotonic() - stage_started)
+
+            stage, stage_started = "search", time.monotonic()
+            hits = get_search_client().hybrid_search(query, vector, CHUNK_INDEX, top=CONTEXT_CANDIDATES)
+            timings.add("search", time.monotonic() - stage_started)
+            sources = chunk_hits_to_documents(hits)
+        else:
+            stage, stage_started = "search", time.monotonic()
+            # The page memoizes searches for a while; the benchmark measures every query.
+            hits = get_search_client().search(query, SEARCH_INDEXES, profile=PROFILE_CHUNKS)
+            timings.add("search", time.monotonic() - stage_started)
+
+            stage, stage_started = "chunk", time.monotonic()
+            file_content = OrderedDict()
+            for hit in hits:
+                file_content.setdefault(hit["content"]["transcription_id"], hit)
+            docs = [doc for hit in file_content.values()
+                    for doc in chunk_conversation(hit["content"], source=hit["metadata_storage_path"])]
+            timings.add("chunk", time.monotonic() - stage_started)
+
+            stage, stage_started = "embed", time.monotonic()
+            index = embed_docs(docs=docs, language="en")
+            timings.add("embed", time.monotonic() - stage_started)
+
+            stage, stage_started = "retrieve", time.monotonic()
+            sources = search_docs(index=index, query=query, k=CONTEXT_CANDIDATES)
+            timings.add("retrieve", time.monotonic() - stage_started)
+
+        stage, stage_started = "context", time.monotonic()
+        context, cited_sources = build_context(sources)
+        timings.add("context", time.monotonic() - stage_started)
+
+        stage, stage_started = "answer", time.monotonic()
+        if args.stream:
+            pieces = stream_answer(query, context)
+            try:
+                answer = next(pieces, "")
+                timings.add("first token", time.monotonic() - stage_started)
+                answer += "".join(pieces)
+            finally:
+                pieces.close()
+        else:
+            answer = get_answer(query, context)
+        timings.add("answer", time.monotonic() - stage_started)
+    except Exception as e:
+        timings.fail(stage)
+        timings.fail("question")
+        logging.getLogger(__name__).warning("Question failed in %s: %r", stage, e)
+        return
+    timings.add("question", time.monotonic() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=50, help="Number of questions.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions answered at the same time.")
+    parser.add_argument("--hybrid", action="store_true", help="Answer from a hybrid query of a chunk index.")
+    parser.add_argument("--stream", action="store_true", help="Stream answers and report time to first token.")
+    parser.add_argument("--embedding-cache", help="Embedding cache directory, by default a new, empty one.")
+    add_stand_in_arguments(parser)
+    args = parser.parse_args()
+    config = stand_in_config(args)
+    logging.basicConfig(level=logging.WARNING)
+
+    with StandInServer(config) as server, tempfile.TemporaryDirectory() as directory:
+        # Read when the app's modules are imported, so set before importing them.
+        os.environ["AZURE_SEARCH_ENDPOINT"] = server.url
+        os.environ["AZURE_SEARCH_KEY"] = "stand-in"
+        os.environ["AZURE_OPENAI_ENDPOINT"] = server.url
+        os.environ["AZURE_OPENAI_API_KEY"] = "stand-in"
+        os.environ["EMBEDDING_CACHE_DIR"] = args.embedding_cache or directory
+        sys.path.insert(0, APP_DIR)
+        # Imported up front, so the first questions do not pay for loading langchain and FAISS.
+        import langchain.vectorstores.faiss  # noqa: F401
+        import utils  # noqa: F401
+
+        timings = Timings()
+        questions = make_questions(args.questions, args.seed)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda query: answer_question(query, args, timings), questions))
+        elapsed = time.monotonic() - started
+
+    summaries = [summarize(stage, timings.seconds[stage], elapsed, errors=timings.errors[stage])
+                 for stage in STAGES if timings.seconds[stage] or timings.errors[stage]]
+    print(f"Answered {len(timings.seconds['question'])} of {len(questions)} question(s) in {elapsed:.1f} seconds, "
+          f"{args.concurrency} at a time")
+    print()
+    print(format_summaries(summaries))
+    print()
+    print(format_counts(server.counts))
+    if args.json:
+        write_json(args.json, summaries, server.counts, config)
+
+
+if __name__ == "__main__":
+    main()
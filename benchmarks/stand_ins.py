@@ -0,0 +1,496 @@
+"""Local HTTP stand-ins for the Azure services the ingestion scripts and the app call.
+
+One server answers for every service, routed by path:
+
+- Speech to Text v3.0: ``/speechtotext/v3.0/transcriptions`` and the result files under ``/results``.
+- Blob Storage, path-style like the storage emulator: ``/{account}/{container}/{blob}``.
+- Cognitive Search: ``/indexes/{index}``, ``/indexes/{index}/docs`` and ``/indexes/{index}/docs/search``.
+- Azure OpenAI: ``/openai/deployments/{deployment}/embeddings`` and ``/chat/completions``.
+
+Each service adds a configurable latency and can be throttled, either by a request rate or by
+answering a fraction of requests with the service's throttling status and a retry-after header.
+Payloads are synthetic conversations whose size is set by PayloadConfig.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SERVICES = ["speech", "blob", "search", "openai"]
+
+# Key the blob stand-in hands out; any base64 value works since signatures are not checked.
+ACCOUNT_KEY = base64.b64encode(b"stand-in-account-key").decode()
+
+TICKS_PER_SECOND = 10_000_000
+
+EMBEDDING_POOL_SIZE = 256
+
+_WORDS = (
+    "account address agent balance billing call cancel card charge check confirm contract credit customer "
+    "date delivery details email help internet issue last line month name number order payment phone plan "
+    "problem refund replace reset service speed support thank today transfer update week yes"
+).split()
+
+_TRANSCRIPTIONS = re.compile(r"^/speechtotext/v3\.0/transcriptions(?:/(?P<id>[0-9a-f-]{36})(?P<files>/files)?)?$")
+_RESULT = re.compile(r"^/results/(?P<id>[0-9a-f-]{36})/(?P<number>\d+)\.json$")
+_SEARCH = re.compile(r"^/indexes/(?P<index>[^/]+)/docs(?P<search>/search)?$")
+_INDEX = re.compile(r"^/indexes/(?P<index>[^/]+)$")
+_OPENAI = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/(?P<operation>embeddings|chat/completions)$")
+
+
+@dataclass
+class ServiceConfig:
+    """Latency and throttling of one stand-in service."""
+    latency_ms: float = 20.0
+    jitter_ms: float = 5.0
+    requests_per_second: float = 0.0
+    """Requests per second served before throttling, or 0 for no limit."""
+    throttle_fraction: float = 0.0
+    """Fraction of requests throttled at random, on top of the rate limit."""
+    retry_after_ms: int = 500
+
+
+@dataclass
+class PayloadConfig:
+    """Sizes of the synthetic payloads."""
+    phrases_per_call: int = 120
+    words_per_phrase: int = 12
+    corpus_size: int = 50
+    """Number of distinct conversations transcribed and searched."""
+    transcription_seconds: float = 1.0
+    """Seconds a transcription stays running before it succeeds."""
+    search_hits: int = 5
+    embedding_dimensions: int = 1536
+    answer_words: int = 80
+    stream_chunk_words: int = 3
+
+
+@dataclass
+class StandInConfig:
+    services: Dict[str, ServiceConfig] = field(default_factory=lambda: {service: ServiceConfig() for service in SERVICES})
+    payload: PayloadConfig = field(default_factory=PayloadConfig)
+    seed: int = 0
+
+
+class _Throttle:
+    """Decides which requests of a service are throttled."""
+
+    def __init__(self, config: ServiceConfig, rng: random.Random) -> None:
+        self.config = config
+        self.rng = rng
+        self.level = config.requests_per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.config.throttle_fraction and self.rng.random() < self.config.throttle_fraction:
+                return False
+            if not self.config.requests_per_second:
+                return True
+            now = time.monotonic()
+            self.level = min(self.config.requests_per_second,
+                             self.level + (now - self.updated) * self.config.requests_per_second)
+            self.updated = now
+            if self.level < 1:
+                return False
+            self.level -= 1
+            return True
+
+
+def _duration(ticks: int) -> str:
+    return f"PT{ticks / TICKS_PER_SECOND:.2f}S"
+
+
+class StandInServer:
+    """Serves every stand-in from one local port, on a background thread.
+
+    Example:
+        .. code-block:: python
+
+            with StandInServer(StandInConfig()) as server:
+                os.environ["AZURE_SEARCH_ENDPOINT"] = server.url
+                ...
+            print(server.counts)
+    """
+
+    def __init__(self, config: Optional[StandInConfig] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config or StandInConfig()
+        rng = random.Random(self.config.seed)
+        self._rng = rng
+        self._rng_lock = threading.Lock()
+        self._throttles = {service: _Throttle(self.config.services[service], random.Random(rng.random()))
+                           for service in SERVICES}
+        self._lock = threading.Lock()
+        self._transcriptions: Dict[str, Dict[str, Any]] = {}
+        self._blobs: Dict[str, int] = {}
+        self._containers = set()
+        self.counts: Dict[str, Dict[str, int]] = {service: {"requests": 0, "throttled": 0, "bytes_in": 0, "bytes_out": 0}
+                                                  for service in SERVICES}
+        self.conversations = [self._make_conversation(rng) for _ in range(self.config.payload.corpus_size)]
+        # Embeddings are picked from a pool serialized up front, so the stand-in adds no CPU time of its own.
+        self._vectors = [json.dumps([round(rng.gauss(0, 1), 6) for _ in range(self.config.payload.embedding_dimensions)])
+                         for _ in range(EMBEDDING_POOL_SIZE)]
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StandInServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-ins", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _make_conversation(self, rng: random.Random) -> List[Tuple[int, int, int, str]]:
+        """Phrases of one call, as (speaker, offset in ticks, duration in ticks, text)."""
+        payload = self.config.payload
+        phrases = []
+        offset = 0
+        for number in range(payload.phrases_per_call):
+            text = " ".join(rng.choice(_WORDS) for _ in range(payload.words_per_phrase)).capitalize() + "."
+            duration = int(payload.words_per_phrase * 0.4 * TICKS_PER_SECOND)
+            phrases.append((number % 2, offset, duration, text))
+            offset += duration
+        return phrases
+
+    def _conversation(self, key: str) -> List[Tuple[int, int, int, str]]:
+        return self.conversations[zlib.crc32(key.encode()) % len(self.conversations)]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server._dispatch(self)
+
+            def do_POST(self) -> None:
+                server._dispatch(self)
+
+            def do_PUT(self) -> None:
+                server._dispatch(self)
+
+            def do_DELETE(self) -> None:
+                server._dispatch(self)
+
+        return Handler
+
+    # Routing
+
+    def _dispatch(self, request: BaseHTTPRequestHandler) -> None:
+        parts = urlsplit(request.path)
+        query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+
+        if parts.path.startswith(("/speechtotext/", "/results/")):
+            service = "speech"
+        elif parts.path.startswith("/indexes/"):
+            service = "search"
+        elif parts.path.startswith("/openai/"):
+            service = "openai"
+        else:
+            service = "blob"
+
+        config = self.config.services[service]
+        with self._rng_lock:
+            delay = max(0.0, config.latency_ms + self._rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+        time.sleep(delay)
+
+        with self._lock:
+            self.counts[service]["requests"] += 1
+            self.counts[service]["bytes_in"] += len(body)
+
+        if not self._throttles[service].allow():
+            with self._lock:
+                self.counts[service]["throttled"] += 1
+            self._throttled(request, service, config)
+            return
+
+        try:
+            handler = getattr(self, f"_{service}")
+            status, headers, payload = handler(request.command, parts.path, query, body)
+        except KeyError as e:
+            status, headers, payload = HTTPStatus.NOT_FOUND, {}, json.dumps({"error": f"Not found: {e}"}).encode()
+
+        if callable(payload):
+            # Streamed responses are written as they are generated.
+            self._send_stream(request, status, headers, payload)
+            return
+        with self._lock:
+            self.counts[service]["bytes_out"] += len(payload)
+        self._send(request, status, headers, payload)
+
+    def _send(self, request: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], payload: bytes) -> None:
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(payload)))
+        request.send_header("x-ms-request-id", str(uuid.uuid4()))
+        request.end_headers()
+        if request.command != "HEAD":
+            request.wfile.write(payload)
+
+    def _send_stream(self, request: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], payload) -> None:
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Transfer-Encoding", "chunked")
+        request.end_headers()
+        sent = 0
+        for piece in payload():
+            request.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            request.wfile.flush()
+            sent += len(piece)
+        request.wfile.write(b"0\r\n\r\n")
+        with self._lock:
+            self.counts["openai"]["bytes_out"] += sent
+
+    def _throttled(self, request: BaseHTTPRequestHandler, service: str, config: ServiceConfig) -> None:
+        headers = {"Retry-After": str(max(1, round(config.retry_after_ms / 1000))),
+                   "retry-after-ms": str(config.retry_after_ms)}
+        if service == "blob":
+            headers["x-ms-error-code"] = "ServerBusy"
+            payload = (b'<?xml version="1.0" encoding="utf-8"?><Error><Code>ServerBusy</Code>'
+                       b"<Message>The server is busy.</Message></Error>")
+            self._send(request, HTTPStatus.SERVICE_UNAVAILABLE, dict(headers, **{"Content-Type": "application/xml"}), payload)
+            return
+        status = HTTPStatus.SERVICE_UNAVAILABLE if service == "search" else HTTPStatus.TOO_MANY_REQUESTS
+        payload = json.dumps({"error": {"code": str(int(status)), "message": "Requests to this stand-in are throttled."}})
+        self._send(request, status, dict(headers, **{"Content-Type": "application/json"}), payload.encode())
+
+    # Speech to Text v3.0
+
+    def _transcription(self, transcription_id: str) -> Dict[str, Any]:
+        transcription = self._transcriptions[transcription_id]
+        running = time.monotonic() - transcription["created"] < self.config.payload.transcription_seconds
+        return {
+            "self": f"{self.url}/speechtotext/v3.0/transcriptions/{transcription_id}",
+            "status": "Running" if running else "Succeeded",
+            "displayName": transcription["displayName"],
+            "locale": transcription["locale"],
+        }
+
+    def _speech(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        headers = {"Content-Type": "application/json"}
+        match = _RESULT.match(path)
+        if match:
+            source = self._transcriptions[match["id"]]["contentUrls"][int(match["number"])]
+            return HTTPStatus.OK, headers, self._transcription_result(source)
+
+        match = _TRANSCRIPTIONS.match(path)
+        if match is None:
+            raise KeyError(path)
+        transcription_id = match["id"]
+
+        if transcription_id is None and method == "POST":
+            content = json.loads(body)
+            transcription_id = str(uuid.uuid4())
+            with self._lock:
+                self._transcriptions[transcription_id] = dict(content, created=time.monotonic())
+            return HTTPStatus.CREATED, headers, json.dumps(self._transcription(transcription_id)).encode()
+
+        if transcription_id is None:
+            skip, top = int(query.get("skip", 0)), int(query.get("top", 100))
+            with self._lock:
+                transcription_ids = list(reversed(list(self._transcriptions)))
+            page = {"values": [self._transcription(value) for value in transcription_ids[skip:skip + top]]}
+            if skip + top < len(transcription_ids):
+                page["@nextLink"] = f"{self.url}/speechtotext/v3.0/transcriptions?skip={skip + top}&top={top}"
+            return HTTPStatus.OK, headers, json.dumps(page).encode()
+
+        if method == "DELETE":
+            with self._lock:
+                self._transcriptions.pop(transcription_id)
+            return HTTPStatus.NO_CONTENT, {}, b""
+
+        if match["files"]:
+            content_urls = self._transcriptions[transcription_id]["contentUrls"]
+            values = [{"kind": "Transcription", "links": {"contentUrl": f"{self.url}/results/{transcription_id}/{number}.json"}}
+                      for number in range(len(content_urls))]
+            return HTTPStatus.OK, headers, json.dumps({"values": values}).encode()
+
+        return HTTPStatus.OK, headers, json.dumps(self._transcription(transcription_id)).encode()
+
+    def _transcription_result(self, source: str) -> bytes:
+        phrases = self._conversation(source.split("?")[0])
+        duration = phrases[-1][1] + phrases[-1][2] if phrases else 0
+        return json.dumps({
+            "source": source,
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "durationInTicks": duration,
+            "duration": _duration(duration),
+            "recognizedPhrases": [{
+                "recognitionStatus": "Success",
+                "speaker": speaker + 1,
+                "offset": _duration(offset),
+                "duration": _duration(ticks),
+                "offsetInTicks": offset,
+                "durationInTicks": ticks,
+                "nBest": [{"confidence": 0.9, "lexical": text.lower(), "display": text}],
+            } for speaker, offset, ticks, text in phrases],
+        }).encode()
+
+    # Blob Storage
+
+    def _blob(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        now = datetime.utcnow()
+        headers = {"ETag": f'"0x{uuid.uuid4().hex[:16].upper()}"',
+                   "Last-Modified": now.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+                   "x-ms-version": "2021-08-06"}
+        segments = path.strip("/").split("/", 2)
+
+        if query.get("comp") == "userdelegationkey":
+            key = (
+                '<?xml version="1.0" encoding="utf-8"?><UserDelegationKey>'
+                f"<SignedOid>{uuid.uuid4()}</SignedOid><SignedTid>{uuid.uuid4()}</SignedTid>"
+                f"<SignedStart>{now:%Y-%m-%dT%H:%M:%SZ}</SignedStart>"
+                f"<SignedExpiry>{now + timedelta(hours=6):%Y-%m-%dT%H:%M:%SZ}</SignedExpiry>"
+                f"<SignedService>b</SignedService><SignedVersion>2020-02-10</SignedVersion>"
+                f"<Value>{ACCOUNT_KEY}</Value></UserDelegationKey>"
+            )
+            return HTTPStatus.OK, dict(headers, **{"Content-Type": "application/xml"}), key.encode()
+
+        if len(segments) == 2 and query.get("restype") == "container":
+            with self._lock:
+                exists = path in self._containers
+                self._containers.add(path)
+            if exists:
+                error = (b'<?xml version="1.0" encoding="utf-8"?><Error><Code>ContainerAlreadyExists</Code>'
+                         b"<Message>The specified container already exists.</Message></Error>")
+                return HTTPStatus.CONFLICT, dict(headers, **{"x-ms-error-code": "ContainerAlreadyExists",
+                                                              "Content-Type": "application/xml"}), error
+            return HTTPStatus.CREATED, headers, b""
+
+        if len(segments) == 3 and method == "PUT":
+            with self._lock:
+                if query.get("comp") != "block":
+                    # Blocks count toward the blob when the block list is committed.
+                    self._blobs[path] = self._blobs.get(path, 0) + len(body)
+            return HTTPStatus.CREATED, dict(headers, **{"x-ms-request-server-encrypted": "true"}), b""
+
+        raise KeyError(path)
+
+    # Cognitive Search
+
+    def _search(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        match = _INDEX.match(path)
+        if match is not None:
+            # The fields SearchClient.has_structured_phrases reads, as notebooks/search.ipynb defines them.
+            phrases = {"name": "phrases", "type": "Collection(Edm.ComplexType)", "fields": []}
+            definition = {"name": match["index"], "fields": [
+                {"name": "metadata_storage_path", "type": "Edm.String"},
+                {"name": "content", "type": "Edm.ComplexType", "fields": [phrases]},
+            ]}
+            return HTTPStatus.OK, {"Content-Type": "application/json"}, json.dumps(definition).encode()
+
+        match = _SEARCH.match(path)
+        if match is None:
+            raise KeyError(path)
+        payload = self.config.payload
+        request = json.loads(body) if body else query
+        top = int(request.get("top") or request.get("$top") or payload.search_hits)
+        text = request.get("search") or ""
+        numbers = random.Random(f"{match['index']}|{text}").sample(range(len(self.conversations)),
+                                                                   min(top, len(self.conversations)))
+
+        hits = []
+        for rank, number in enumerate(numbers):
+            score = round(10.0 / (rank + 1), 4)
+            source = f"https://stand-in.blob.core.windows.net/transcription/call-{number:05d}.wav.json"
+            phrases = [{"role": "Agent" if speaker == 0 else "Customer", "display": text,
+                        "offsetInTicks": offset, "duration": _duration(ticks)}
+                       for speaker, offset, ticks, text in self.conversations[number]]
+            if match["search"]:
+                # A chunk index hit, see notebooks/search.ipynb.
+                window = phrases[:max(1, len(phrases) // 10)]
+                hits.append({"@search.score": score, "id": f"call-{number:05d}-0", "source": source,
+                             "transcription_id": f"call-{number:05d}", "chunk": 0,
+                             "start_seconds": window[0]["offsetInTicks"] / TICKS_PER_SECOND,
+                             "end_seconds": window[-1]["offsetInTicks"] / TICKS_PER_SECOND,
+                             "content": "".join(f"{phrase['role']}: {phrase['display']} \n" for phrase in window)})
+            else:
+                hits.append({"@search.score": score, "metadata_storage_path": source,
+                             "content": {"transcription_id": f"call-{number:05d}", "phrases": phrases}})
+        return HTTPStatus.OK, {"Content-Type": "application/json"}, json.dumps({"value": hits}).encode()
+
+    # Azure OpenAI
+
+    def _openai(self, method: str, path: str, query: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str], Any]:
+        match = _OPENAI.match(path)
+        if match is None:
+            raise KeyError(path)
+        payload = self.config.payload
+        request = json.loads(body)
+        headers = {"Content-Type": "application/json"}
+
+        if match["operation"] == "embeddings":
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            data = ",".join(
+                f'{{"object":"embedding","index":{number},'
+                f'"embedding":{self._vectors[zlib.crc32(str(text).encode()) % len(self._vectors)]}}}'
+                for number, text in enumerate(texts))
+            tokens = sum(len(str(text).split()) for text in texts)
+            response = (f'{{"object":"list","model":{json.dumps(match["deployment"])},"data":[{data}],'
+                        f'"usage":{{"prompt_tokens":{tokens},"total_tokens":{tokens}}}}}')
+            return HTTPStatus.OK, headers, response.encode()
+
+        with self._rng_lock:
+            words = [self._rng.choice(_WORDS) for _ in range(payload.answer_words)]
+        answer = " ".join(words).capitalize() + ". [1]"
+        created = int(time.time())
+        if not request.get("stream"):
+            response = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": created,
+                        "model": match["deployment"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": answer}}],
+                        "usage": {"completion_tokens": len(words)}}
+            return HTTPStatus.OK, headers, json.dumps(response).encode()
+
+        latency = self.config.services["openai"]
+
+        def events():
+            pieces = answer.split(" ")
+            step = max(1, payload.stream_chunk_words)
+            for start in range(0, len(pieces), step):
+                # Tokens trickle out after the first one, like a deployment generating them.
+                time.sleep(latency.jitter_ms / 1000)
+                content = " ".join(pieces[start:start + step]) + ("" if start + step >= len(pieces) else " ")
+                chunk = {"id": "chatcmpl-stand-in", "object": "chat.completion.chunk", "created": created,
+                         "model": match["deployment"],
+                         "choices": [{"index": 0, "finish_reason": None, "delta": {"content": content}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return HTTPStatus.OK, dict(headers, **{"Content-Type": "text/event-stream"}), events
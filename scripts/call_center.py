@@ -1,100 +1,69 @@
-from json import dumps
 import glob
 import os
 
-from utils import speech, blobs
+from utils import conversation, manifest, pipeline, rest_helper
 
 
-def process_files(audio_files, storage_account_name, source_container_name, target_container_name):
+def process_files(audio_files, storage_account_name, source_container_name, target_container_name,
+                  max_workers=8, batch_size=1, manifest_path="ingestion_manifest.db", output_format=conversation.FORMAT_JSON):
     """
     Process audio files in the specified directory.
     Uploads each file to Azure Blob Storage and transcribes it using Azure Speech Services.
     Saves the transcription as a JSON file in another Azure Blob Storage container.
+    Files move through the upload, transcription and publish stages concurrently.
+    Progress is recorded in a local manifest, so a rerun skips published files and resumes unfinished ones.
 
     Args:
         audio_files (str): Path to directory containing audio files to be processed.
         storage_account_name (str): Name of Azure Blob Storage account.
         source_container_name (str): Name of Azure Blob Storage container for input files.
         target_container_name (str): Name of Azure Blob Storage container for output files.
+        max_workers (int): Number of worker threads for each pipeline stage.
+        batch_size (int): Maximum number of audio files submitted in a single transcription job.
+        manifest_path (str): Path to the SQLite manifest of processed files, or None to process every file again.
+        output_format (str): Format of the published conversations, one of conversation.OUTPUT_FORMATS.
+
+    Returns:
+        IngestionStats: Counters and timings for the run.
     """
     
     # Set up reusable variables for speech-related values
     speech_endpoint = os.environ.get("AZURE_SPEECH_ENDPOINT") #"eastus.api.cognitive.microsoft.com"
     speech_subscription_key = os.environ.get("AZURE_SPEECH_KEY") #"b72f533b22da4aa78a927d1dd4d81497"
     locale = "en-US"
-    
-    for audio_file_path in glob.glob(audio_files):
-        print(f"Processing '{audio_file_path}'")
-        
-        # Upload audio file to Azure Blob Storage        
-        blobs.upload_audio_file_to_container(audio_file_path = audio_file_path
-                                            , storage_account_name = storage_account_name
-                                            , container_name = source_container_name)
-
-        # Get SAS URL for uploaded audio file
-        input_audio_url = blobs.create_sas_token_for_audio(storage_account_name = storage_account_name
-                                                            , container_name = source_container_name
-                                                            , audio_file_path = audio_file_path)
-
-        # Create transcription job using Azure Speech Services
-        transcription_id = speech.create_transcription(speech_endpoint = speech_endpoint
-                                                        , speech_subscription_key = speech_subscription_key
-                                                        , input_audio_url = input_audio_url
-                                                        , use_stereo_audio = None
-                                                        , locale = locale)
-        print(f"Transcription ID: {transcription_id}")
-
-        # Wait for transcription job to complete
-        speech.wait_for_transcription(transcription_id = transcription_id
-                                      , speech_endpoint = speech_endpoint
-                                      , speech_subscription_key = speech_subscription_key)
-
-        # Get URLs for transcription results from Azure Speech Services
-        transcription_files = speech.get_transcription_files(transcription_id = transcription_id
-                                                            , speech_endpoint = speech_endpoint
-                                                            , speech_subscription_key = speech_subscription_key)
-
-        # Get URL for JSON-formatted transcription result from Azure Speech Services
-        transcription_url = speech.get_transcription_url(transcription_files = transcription_files)
-        
-        print(f"Transcription URI: {transcription_url}")
-
-        # Download and parse JSON-formatted transcription result from Azure Blob Storage
-        transcription = speech.get_transcription(transcription_url = transcription_url)
-        
-        # Extract conversation items from parsed transcript 
-        phrases = speech.get_transcription_phrases(transcription = transcription)
-        
-        conversation_items = speech.transcription_phrases_to_conversation_items(phrases)
-
-        # Save conversation items as a JSON file in another Azure Blob Storage container
-        blob_name = f"{os.path.basename(audio_file_path)}.json"
-        json_data = dumps(conversation_items)
-
-        conversation = ""
-
-        for conversation_item in conversation_items:
-            conversation += f"{conversation_item['role']}: {conversation_item['display']} \n"
-
-        json_data_final = {
-            "source": transcription["source"]
-            , "transcription_id": transcription_id
-            , "transcription_url": transcription_url
-            , "conversationDuration": transcription["duration"]
-            , "conversation": conversation
-            , "phrases": json_data   
-        }    
 
-        blobs.upload_json_to_container(blob_name = blob_name
-                                       , json_data = dumps(json_data_final)
-                                       , storage_account_name = storage_account_name
-                                       , container_name = target_container_name)
+    ingestion_manifest = manifest.IngestionManifest(manifest_path) if manifest_path else None
+
+    ingestion_pipeline = pipeline.IngestionPipeline(storage_account_name = storage_account_name
+                                                    , source_container_name = source_container_name
+                                                    , target_container_name = target_container_name
+                                                    , speech_endpoint = speech_endpoint
+                                                    , speech_subscription_key = speech_subscription_key
+                                                    , locale = locale
+                                                    , max_workers = max_workers
+                                                    , batch_size = batch_size
+                                                    , ingestion_manifest = ingestion_manifest
+                                                    , output_format = output_format)
+
+    try:
+        stats = ingestion_pipeline.run(glob.glob(audio_files))
+    finally:
+        if ingestion_manifest is not None:
+            ingestion_manifest.close()
+    print(stats.report())
+    print(rest_helper.format_endpoint_stats())
+
+    return stats
 
 if __name__ == "__main__":
      storage_account_name = os.environ.get("AZURE_STORAGE_ACCOUNT_NAME") #"saccgpt0001"
      source_container_name = "landing"
      target_container_name = "transcription"
      audio_files = "../data/*"
+     max_workers = int(os.environ.get("CALL_CENTER_MAX_WORKERS", 8))
+     batch_size = int(os.environ.get("CALL_CENTER_BATCH_SIZE", 1))
+     manifest_path = os.environ.get("CALL_CENTER_MANIFEST", "ingestion_manifest.db")
+     output_format = os.environ.get("CALL_CENTER_OUTPUT_FORMAT", conversation.FORMAT_JSON)
 
      print(f"Processing files...")
     
@@ -102,4 +71,8 @@ if __name__ == "__main__":
      process_files(audio_files = audio_files
                    , storage_account_name = storage_account_name
                    , source_container_name = source_container_name
-                   , target_container_name = target_container_name)
\ No newline at end of file
+                   , target_container_name = target_container_name
+                   , max_workers = max_workers
+                   , batch_size = batch_size
+                   , manifest_path = manifest_path
+                   , output_format = output_format)
\ No newline at end of file
@@ -0,0 +1,6 @@
+"""Tests of the ingestion scripts. Run from this folder's parent: ``python -m pytest tests``."""
+import os
+import sys
+
+# The scripts import their helpers as the top-level utils package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
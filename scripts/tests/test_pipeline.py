@@ -0,0 +1,161 @@
+import os
+import shutil
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from utils import manifest, pipeline, speech
+
+
+class FakeServices:
+    """Blob storage, Speech batch transcription and the poller, kept in memory.
+
+    As in Azure, a transcription only has results for the audio URLs whose blobs exist.
+    """
+
+    def __init__(self):
+        self.uploaded = []
+        self.published = []
+        self.transcriptions = {}
+
+    def upload_audio_file_to_container(self, audio_file_path, storage_account_name, container_name):
+        self.uploaded.append(os.path.basename(audio_file_path))
+
+    def create_sas_token_for_audio(self, storage_account_name, container_name, audio_file_path):
+        return f"https://{storage_account_name}.blob/{container_name}/{os.path.basename(audio_file_path)}?sig=fake"
+
+    def create_batch_transcription(self, speech_endpoint, speech_subscription_key, input_audio_urls, use_stereo_audio, locale):
+        transcription_id = f"transcription-{len(self.transcriptions)}"
+        self.transcriptions[transcription_id] = list(input_audio_urls)
+        return transcription_id
+
+    def get_transcription_files(self, transcription_id, speech_endpoint, speech_subscription_key):
+        return [f"{transcription_id}/{i}" for i, url in enumerate(self.transcriptions[transcription_id])
+                if url.split("?")[0].rsplit("/", 1)[1] in self.uploaded]
+
+    def get_transcription_urls(self, transcription_files):
+        return transcription_files
+
+    def read_transcription(self, transcription_url):
+        transcription_id, i = transcription_url.split("/")
+        return {"source": self.transcriptions[transcription_id][int(i)], "duration": "PT1S"}, speech.PhraseStore()
+
+    def upload_json_to_container(self, blob_name, json_data, storage_account_name, container_name, content_type, content_encoding):
+        self.published.append(blob_name)
+
+    def poller(self, **kwargs):
+        services = self
+
+        class FakePoller:
+            def start(self):
+                pass
+
+            def stop(self):
+                pass
+
+            def watch(self, transcription_id, audio_duration_seconds=None, callback=None, spans=()):
+                future = Future()
+                if transcription_id in services.transcriptions:
+                    future.set_result(True)
+                else:
+                    future.set_exception(Exception(f"Transcription {transcription_id} not found"))
+                callback(future)
+                return future
+
+        return FakePoller()
+
+
+@pytest.fixture
+def services(monkeypatch):
+    services = FakeServices()
+    for name in ("upload_audio_file_to_container", "create_sas_token_for_audio", "upload_json_to_container"):
+        monkeypatch.setattr(pipeline.blobs, name, getattr(services, name))
+    for name in ("create_batch_transcription", "get_transcription_files", "get_transcription_urls", "read_transcription"):
+        monkeypatch.setattr(pipeline.speech, name, getattr(services, name))
+    monkeypatch.setattr(pipeline, "TranscriptionPoller", services.poller)
+    return services
+
+
+def _write_recording(path, content=b"RIFF recording"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as recording:
+        recording.write(content)
+    return path
+
+
+def _run(audio_file_paths, ingestion_manifest=None, batch_size=1):
+    ingestion_pipeline = pipeline.IngestionPipeline(storage_account_name = "account"
+                                                    , source_container_name = "landing"
+                                                    , target_container_name = "transcription"
+                                                    , speech_endpoint = "https://speech"
+                                                    , speech_subscription_key = "key"
+                                                    , max_workers = 2
+                                                    , batch_size = batch_size
+                                                    , batch_linger_seconds = 0.05
+                                                    , ingestion_manifest = ingestion_manifest)
+    # run() blocks until every recording is finished, so a recording that is never finished hangs it.
+    result = {}
+    runner = threading.Thread(target=lambda: result.update(stats=ingestion_pipeline.run(audio_file_paths)), daemon=True)
+    runner.start()
+    runner.join(timeout=10)
+    assert not runner.is_alive(), "the pipeline did not finish every recording"
+    return result["stats"]
+
+
+def test_publishes_every_recording(tmp_path, services):
+    paths = [_write_recording(str(tmp_path / f"call-{i}.wav"), f"call {i}".encode()) for i in range(5)]
+    stats = _run(paths, batch_size=2)
+    assert (stats.succeeded, stats.failed) == (5, 0)
+    assert sorted(services.published) == [f"call-{i}.wav.json" for i in range(5)]
+
+
+def test_resumes_submitted_recording_without_uploading_it_again(tmp_path, services):
+    path = _write_recording(str(tmp_path / "call.wav"))
+    ingestion_manifest = manifest.IngestionManifest(str(tmp_path / "manifest.db"))
+    transcription_id = services.create_batch_transcription(None, None, [services.create_sas_token_for_audio("account", "landing", path)], None, None)
+    services.uploaded.append("call.wav")
+    ingestion_manifest.record(manifest.hash_audio_file(path), path, manifest.STAGE_SUBMITTED, transcription_id = transcription_id)
+
+    stats = _run([path], ingestion_manifest)
+    assert (stats.succeeded, stats.failed, stats.transcriptions) == (1, 0, 0)
+    assert services.uploaded == ["call.wav"]
+    assert ingestion_manifest.get(manifest.hash_audio_file(path)).stage == manifest.STAGE_PUBLISHED
+
+
+@pytest.mark.parametrize("stage", [manifest.STAGE_UPLOADED, manifest.STAGE_SUBMITTED])
+def test_renamed_recording_is_uploaded_again(tmp_path, services, stage):
+    old_path = _write_recording(str(tmp_path / "call.wav"))
+    ingestion_manifest = manifest.IngestionManifest(str(tmp_path / "manifest.db"))
+    transcription_id = None
+    services.uploaded.append("call.wav")
+    if stage == manifest.STAGE_SUBMITTED:
+        transcription_id = services.create_batch_transcription(None, None, [services.create_sas_token_for_audio("account", "landing", old_path)], None, None)
+    ingestion_manifest.record(manifest.hash_audio_file(old_path), old_path, stage, transcription_id = transcription_id)
+
+    # The run was interrupted, then the recording was renamed.
+    new_path = str(tmp_path / "renamed.wav")
+    shutil.move(old_path, new_path)
+
+    stats = _run([new_path], ingestion_manifest)
+    assert (stats.succeeded, stats.failed) == (1, 0)
+    assert services.uploaded[-1] == "renamed.wav"
+    assert services.published == ["renamed.wav.json"]
+    entry = ingestion_manifest.get(manifest.hash_audio_file(new_path))
+    assert (entry.audio_file_path, entry.stage) == (new_path, manifest.STAGE_PUBLISHED)
+
+
+def test_recordings_with_the_same_name_in_one_batch_are_all_finished(tmp_path, services):
+    paths = [_write_recording(str(tmp_path / folder / "call.wav"), folder.encode()) for folder in ("monday", "tuesday")]
+    stats = _run(paths, batch_size=2)
+    assert (stats.succeeded, stats.failed, stats.transcriptions) == (2, 0, 1)
+
+
+def test_recordings_without_a_result_fail(tmp_path, services, monkeypatch):
+    paths = [_write_recording(str(tmp_path / f"call-{i}.wav"), f"call {i}".encode()) for i in range(2)]
+    get_transcription_files = services.get_transcription_files
+    monkeypatch.setattr(pipeline.speech, "get_transcription_files", lambda **kwargs: get_transcription_files(**kwargs)[:1])
+    stats = _run(paths, batch_size=2)
+    assert (stats.succeeded, stats.failed) == (1, 1)
+    # Uploads finish in any order, so either recording may be the one left without a result.
+    assert ["returned no result" in error for error in stats.errors.values()] == [True]
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+COPIES = [os.path.join(ROOT, "app", "tracing.py"), os.path.join(ROOT, "scripts", "utils", "tracing.py")]
+
+
+def test_copies_are_the_same():
+    app_copy, scripts_copy = (open(path, "rb").read() for path in COPIES)
+    assert app_copy == scripts_copy, "app/tracing.py and scripts/utils/tracing.py differ, copy the edited one over the other"
+
+
+def test_each_copy_names_its_service():
+    env = {key: value for key, value in os.environ.items() if key != "TRACE_SERVICE_NAME"}
+    names = [
+        subprocess.run([sys.executable, "-c", "import tracing; print(tracing.SERVICE_NAME)"], cwd=os.path.dirname(path),
+                       env=env, capture_output=True, text=True, check=True).stdout.strip()
+        for path in COPIES
+    ]
+    assert names == ["gpt-call-center-app", "gpt-call-center-ingestion"]
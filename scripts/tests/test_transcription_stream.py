@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from utils.transcription_stream import PHRASES_FIELD, TranscriptionStreamParser, iter_transcription
+
+
+def _phrase(i, display):
+    return {
+        "recognitionStatus": "Success",
+        "channel": 0,
+        "speaker": i % 2 + 1,
+        "offset": f"PT{i}.5S",
+        "duration": "PT1.2S",
+        "offsetInTicks": i * 10_000_000 + 5_000_000,
+        "durationInTicks": 12_000_000,
+        "nBest": [
+            {
+                "confidence": 0.9,
+                "lexical": display.lower(),
+                "display": display,
+                "words": [{"word": word, "offset": "PT0S", "duration": "PT0.1S"} for word in display.split()],
+            },
+            {"confidence": 0.1, "display": "an alternative {with [brackets]}"},
+        ],
+    }
+
+
+DOCUMENT = {
+    "source": "https://example.blob.core.windows.net/audio/call.wav",
+    "timestamp": "2023-06-01T12:00:00Z",
+    "durationInTicks": 120_000_000,
+    "duration": "PT12S",
+    "combinedRecognizedPhrases": [{"channel": 0, "display": "Everything said, {\"quoted\": [1, 2]}"}],
+    "recognizedPhrases": [
+        _phrase(0, "Hello, how can I help you?"),
+        _phrase(1, 'My order says "shipped" but \\ nothing {arrived} [yet].'),
+        _phrase(2, "Déjà vu — café \U0001F600"),
+    ],
+}
+
+EXPECTED_METADATA = [("source", DOCUMENT["source"]), ("timestamp", DOCUMENT["timestamp"]),
+                     ("durationInTicks", DOCUMENT["durationInTicks"]), ("duration", DOCUMENT["duration"])]
+EXPECTED_PHRASES = [
+    {
+        "channel": phrase["channel"],
+        "speaker": phrase["speaker"],
+        "offset": phrase["offset"],
+        "duration": phrase["duration"],
+        "offsetInTicks": phrase["offsetInTicks"],
+        "durationInTicks": phrase["durationInTicks"],
+        "nBest": [{"display": phrase["nBest"][0]["display"]}],
+    }
+    for phrase in DOCUMENT["recognizedPhrases"]
+]
+
+
+def _parse(data, cuts):
+    chunks = [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+    results = list(iter_transcription(chunks))
+    metadata = [(field, value) for field, value in results if field != PHRASES_FIELD]
+    phrases = [value for field, value in results if field == PHRASES_FIELD]
+    return metadata, phrases
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_whole_document(indent):
+    data = json.dumps(DOCUMENT, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert _parse(data, []) == (EXPECTED_METADATA, EXPECTED_PHRASES)
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_every_split_point(ensure_ascii):
+    data = json.dumps(DOCUMENT, ensure_ascii=ensure_ascii).encode("utf-8")
+    for cut in range(1, len(data)):
+        assert _parse(data, [cut]) == (EXPECTED_METADATA, EXPECTED_PHRASES), cut
+
+
+def test_one_byte_chunks():
+    data = json.dumps(DOCUMENT, indent=1).encode("utf-8")
+    assert _parse(data, list(range(1, len(data)))) == (EXPECTED_METADATA, EXPECTED_PHRASES)
+
+
+def test_escape_split_from_the_character_it_escapes():
+    data = json.dumps({"recognizedPhrases": [{"speaker": 1, "nBest": [{"display": 'a\\"b\\\\'}]}]}).encode("utf-8")
+    for cut in (i + 1 for i, byte in enumerate(data) if byte == ord("\\")):
+        assert _parse(data, [cut]) == ([], [{"speaker": 1, "nBest": [{"display": 'a\\"b\\\\'}]}]), cut
+
+
+def test_skips_unselected_fields():
+    data = json.dumps(DOCUMENT).encode("utf-8")
+    parser = TranscriptionStreamParser(metadata_fields={"source"})
+    results = list(parser.feed(data))
+    assert results[0] == ("source", DOCUMENT["source"])
+    assert all(field in ("source", PHRASES_FIELD) for field, _ in results)
+    for _, phrase in results[1:]:
+        assert "words" not in json.dumps(phrase) and "alternative" not in json.dumps(phrase)
+
+
+def test_yields_each_phrase_once_it_is_complete():
+    data = json.dumps(DOCUMENT).encode("utf-8")
+    third_display = data.index(b'"display": "D')
+    parser = TranscriptionStreamParser()
+    phrases = [value for field, value in parser.feed(data[:third_display]) if field == PHRASES_FIELD]
+    assert phrases == EXPECTED_PHRASES[:2]
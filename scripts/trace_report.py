@@ -0,0 +1,130 @@
+"""
+Summarizes the spans written to TRACE_FILE by the app and the ingestion scripts.
+
+For every span name the report lists how many spans there were, how many failed,
+their total and self time (time not spent in child spans), latency percentiles,
+and the bytes and tokens they recorded, so it shows where the seconds and tokens go.
+
+Usage:
+    python trace_report.py traces/*.jsonl
+    python trace_report.py app-traces.jsonl --since 2023-06-01T00:00 --sort tokens
+"""
+import argparse
+import glob
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List
+
+TOKEN_ATTRIBUTES = ["tokens", "prompt_tokens", "completion_tokens"]
+
+SORT_KEYS = {
+    "self": lambda row: row["self_seconds"],
+    "total": lambda row: row["total_seconds"],
+    "count": lambda row: row["count"],
+    "bytes": lambda row: row["bytes"],
+    "tokens": lambda row: row["tokens"],
+}
+
+
+def read_spans(paths: Iterable[str], since_ns: int = 0) -> Iterator[Dict]:
+    """
+    Reads finished spans from JSON lines files, skipping lines that are not spans.
+
+    Args:
+        paths (iterable): Paths of the trace files.
+        since_ns (int): Only spans that started at or after this Unix time in nanoseconds.
+
+    Returns:
+        Iterator[dict]: The spans.
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(span, dict) and span.get("end_time_unix_nano") and span["start_time_unix_nano"] >= since_ns:
+                    yield span
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(spans: Iterable[Dict]) -> List[Dict]:
+    """
+    Aggregates spans by service and name.
+
+    Self time is the duration of a span less the time covered by its children, so
+    summing it over every row counts each second once, however deeply spans nest.
+
+    Args:
+        spans (iterable): Spans read by read_spans.
+
+    Returns:
+        List[dict]: One row per service and span name.
+    """
+    spans = list(spans)
+    child_seconds = defaultdict(float)
+    for span in spans:
+        if span.get("parent_span_id"):
+            child_seconds[(span["trace_id"], span["parent_span_id"])] += _seconds(span)
+
+    rows = {}
+    for span in spans:
+        service = (span.get("resource") or {}).get("service.name", "")
+        row = rows.setdefault((service, span["name"]), {
+            "service": service, "name": span["name"], "count": 0, "errors": 0, "seconds": [],
+            "total_seconds": 0.0, "self_seconds": 0.0, "bytes": 0, "tokens": 0,
+        })
+        seconds = _seconds(span)
+        attributes = span.get("attributes") or {}
+        row["count"] += 1
+        row["errors"] += (span.get("status") or {}).get("code") == "ERROR"
+        row["seconds"].append(seconds)
+        row["total_seconds"] += seconds
+        row["self_seconds"] += max(0.0, seconds - child_seconds[(span["trace_id"], span["span_id"])])
+        row["bytes"] += attributes.get("bytes") or 0
+        row["tokens"] += sum(attributes.get(name) or 0 for name in TOKEN_ATTRIBUTES)
+    return list(rows.values())
+
+
+def _seconds(span: Dict) -> float:
+    return (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e9
+
+
+def format_report(rows: List[Dict], sort: str = "self") -> str:
+    """Formats the rows of summarize as a table, with each row's share of the self time and tokens."""
+    total_self = sum(row["self_seconds"] for row in rows) or 1.0
+    total_tokens = sum(row["tokens"] for row in rows) or 1
+    lines = [f"{'service':<26} {'span':<20} {'count':>7} {'errors':>6} {'self s':>9} {'self %':>6} {'total s':>9} "
+             f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'MB':>8} {'tokens':>9} {'tok %':>5}"]
+    for row in sorted(rows, key=SORT_KEYS[sort], reverse=True):
+        lines.append(f"{row['service']:<26} {row['name']:<20} {row['count']:>7} {row['errors']:>6} "
+                     f"{row['self_seconds']:>9.1f} {row['self_seconds'] / total_self * 100:>6.1f} {row['total_seconds']:>9.1f} "
+                     f"{percentile(row['seconds'], 50) * 1000:>8.1f} {percentile(row['seconds'], 95) * 1000:>8.1f} "
+                     f"{percentile(row['seconds'], 99) * 1000:>8.1f} {row['bytes'] / 1024 / 1024:>8.2f} "
+                     f"{row['tokens']:>9} {row['tokens'] / total_tokens * 100:>5.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the spans of TRACE_FILE trace files.")
+    parser.add_argument("paths", nargs="+", help="Trace files, glob patterns allowed.")
+    parser.add_argument("--since", help="Only spans that started at or after this ISO date and time.")
+    parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="self", help="Column the rows are sorted by.")
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.paths for path in (glob.glob(pattern) or [pattern])]
+    since_ns = int(datetime.fromisoformat(args.since).timestamp() * 1e9) if args.since else 0
+    rows = summarize(read_spans(paths, since_ns))
+    if not rows:
+        print("No spans found.")
+    else:
+        print(format_report(rows, args.sort))
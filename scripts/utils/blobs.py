@@ -1,16 +1,274 @@
 import json
 import logging
+import mmap
 import os
+import threading
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Dict, Set
 
+from azure.core.exceptions import ResourceExistsError
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import AzureDeveloperCliCredential
-from azure.storage.blob import (BlobSasPermissions, BlobServiceClient,
+from azure.storage.blob import (BlobBlock, BlobSasPermissions,
+                                BlobServiceClient, ContainerClient,
+                                ContentSettings, UserDelegationKey,
                                 generate_blob_sas)
 
+from utils import rest_helper, tracing
+
 # Use the current user identity to connect to Azure services unless a key is explicitly set for any of them
 credential = AzureDeveloperCliCredential()
 
+# URL of a storage account's blob service; "{account}" is replaced by the account name.
+# Point it at a local emulator or stand-in, together with AZURE_STORAGE_ACCOUNT_KEY since
+# the identity credential is only sent over HTTPS.
+STORAGE_ACCOUNT_URL = os.environ.get("AZURE_STORAGE_ACCOUNT_URL", "https://{account}.blob.core.windows.net")
+
+# How long a user delegation key is requested for, and how long before it expires a new one is requested.
+# A SAS URL is only valid while its delegation key is, so every SAS URL lasts at least DELEGATION_KEY_REFRESH_MARGIN.
+DELEGATION_KEY_LIFETIME = timedelta(hours=6)
+DELEGATION_KEY_REFRESH_MARGIN = timedelta(hours=1)
+
+# Audio files of at least this size are uploaded as blocks staged in parallel.
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+BLOCK_SIZE = 8 * 1024 * 1024
+MAX_BLOCK_CONCURRENCY = 8
+
+_blob_sessions: Dict[str, "BlobSession"] = {}
+_blob_sessions_lock = threading.Lock()
+
+
+def get_blob_service_client(storage_account_name: str) -> BlobServiceClient:
+    """
+    Creates a BlobServiceClient that sends its requests through the shared, pooled REST session.
+
+    Args:
+        storage_account_name (str): Name of Azure Blob Storage account.
+
+    Returns:
+        BlobServiceClient: Client for the storage account.
+    """
+    transport = RequestsTransport(session=rest_helper.get_session(), session_owner=False)
+    account_key = os.environ.get("AZURE_STORAGE_ACCOUNT_KEY")
+    account_credential = {"account_name": storage_account_name, "account_key": account_key} if account_key else credential
+    return BlobServiceClient(account_url=STORAGE_ACCOUNT_URL.format(account=storage_account_name),
+                             credential=account_credential, transport=transport)
+
+
+class BlobSession:
+    """
+    Reusable connection to one Azure Blob Storage account.
+
+    Keeps the service and container clients, remembers which containers are known to exist,
+    and reuses one user delegation key for every SAS URL until shortly before it expires.
+    When AZURE_STORAGE_ACCOUNT_KEY is set, SAS URLs are signed with the account key instead.
+    """
+
+    def __init__(self, storage_account_name: str) -> None:
+        """
+        Initialize a BlobSession instance.
+
+        Args:
+            storage_account_name (str): Name of Azure Blob Storage account.
+        """
+        self.storage_account_name = storage_account_name
+        self.account_key = os.environ.get("AZURE_STORAGE_ACCOUNT_KEY")
+        self.service_client = get_blob_service_client(storage_account_name)
+        self._container_clients: Dict[str, ContainerClient] = {}
+        self._checked_containers: Set[str] = set()
+        self._container_locks: Dict[str, threading.Lock] = {}
+        self._delegation_key: UserDelegationKey = None
+        self._delegation_key_expiry = datetime.min
+        # Network calls are made under the lock of their container or of the delegation key,
+        # never under self._lock, so a slow container check does not hold up SAS signing.
+        self._lock = threading.Lock()
+        self._delegation_key_lock = threading.Lock()
+
+    def get_container_client(self, container_name: str) -> ContainerClient:
+        """
+        Returns the client for a container, creating the container the first time it is used.
+
+        Args:
+            container_name (str): Name of Azure Blob Storage container.
+
+        Returns:
+            ContainerClient: Client for the container.
+        """
+        with self._lock:
+            blob_container_client = self._container_clients.get(container_name)
+            if blob_container_client is None:
+                blob_container_client = self.service_client.get_container_client(container_name)
+                self._container_clients[container_name] = blob_container_client
+            if container_name in self._checked_containers:
+                return blob_container_client
+            container_lock = self._container_locks.setdefault(container_name, threading.Lock())
+
+        # Callers of the same container wait for its check, callers of other containers do not.
+        with container_lock:
+            if container_name not in self._checked_containers:
+                # A single create call both checks and creates the container.
+                try:
+                    blob_container_client.create_container()
+                except ResourceExistsError:
+                    pass
+                with self._lock:
+                    self._checked_containers.add(container_name)
+
+        return blob_container_client
+
+    def upload_audio_file(self, audio_file_path: str, container_name: str) -> None:
+        """
+        Uploads a file to an Azure Blob Storage container.
+        Files of at least LARGE_FILE_THRESHOLD bytes are uploaded with upload_large_audio_file.
+
+        Args:
+            audio_file_path (str): Path to audio file to be uploaded.
+            container_name (str): Name of Azure Blob Storage container.
+        """
+        if os.path.getsize(audio_file_path) >= LARGE_FILE_THRESHOLD:
+            self.upload_large_audio_file(audio_file_path, container_name)
+            return
+
+        blob_container_client = self.get_container_client(container_name)
+        blob_name = os.path.basename(audio_file_path)
+
+        with open(audio_file_path,"rb") as data:
+            blob_container_client.upload_blob(blob_name, data, overwrite=True)
+
+    def upload_large_audio_file(self, audio_file_path: str, container_name: str, block_size: int = BLOCK_SIZE,
+                                max_concurrency: int = MAX_BLOCK_CONCURRENCY) -> float:
+        """
+        Uploads a large file to an Azure Blob Storage container as blocks staged in parallel.
+        The file is memory-mapped, so at most max_concurrency blocks are held in memory at once.
+
+        Args:
+            audio_file_path (str): Path to audio file to be uploaded.
+            container_name (str): Name of Azure Blob Storage container.
+            block_size (int): Size in bytes of each staged block.
+            max_concurrency (int): Number of blocks staged at the same time.
+
+        Returns:
+            float: Upload throughput in bytes per second.
+        """
+        blob_client = self.get_container_client(container_name).get_blob_client(os.path.basename(audio_file_path))
+        file_size = os.path.getsize(audio_file_path)
+        block_count = max(1, -(-file_size // block_size))
+        started = time.monotonic()
+
+        with open(audio_file_path, "rb") as data, mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            def stage_block(index: int) -> BlobBlock:
+                # Block IDs must all have the same length within a blob.
+                block_id = f"{index:08d}"
+                blob_client.stage_block(block_id, mapped[index * block_size:(index + 1) * block_size])
+                return BlobBlock(block_id=block_id)
+
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                block_list = list(executor.map(stage_block, range(block_count)))
+
+        blob_client.commit_block_list(block_list)
+
+        bytes_per_second = file_size / max(time.monotonic() - started, 1e-9)
+        print(f"Uploaded '{audio_file_path}' in {block_count} block(s) at {bytes_per_second / 1024 / 1024:.2f} MB/s")
+        return bytes_per_second
+
+    def upload_json(self, blob_name: str, json_data: str, container_name: str,
+                    content_type: str = None, content_encoding: str = None) -> None:
+        """
+        Uploads a JSON-formatted string as a file to an Azure Blob Storage container.
+
+        Args:
+            blob_name (str): Name of output file.
+            json_data (str): JSON-formatted data to be saved in output file, as a string or encoded bytes.
+            container_name (str): Name of Azure Blob Storage container.
+            content_type (str): Optional Content-Type of the blob.
+            content_encoding (str): Optional Content-Encoding of the blob, for example "gzip".
+        """
+        content_settings = None
+        if content_type or content_encoding:
+            content_settings = ContentSettings(content_type=content_type, content_encoding=content_encoding)
+        self.get_container_client(container_name).upload_blob(blob_name, json_data, overwrite=True, content_settings=content_settings)
+
+    def get_user_delegation_key(self) -> UserDelegationKey:
+        """
+        Returns the cached user delegation key, requesting a new one when it is about to expire.
+
+        Returns:
+            UserDelegationKey: Key for signing user delegation SAS tokens.
+        """
+        with self._delegation_key_lock:
+            now = datetime.utcnow()
+            if self._delegation_key is None or now + DELEGATION_KEY_REFRESH_MARGIN >= self._delegation_key_expiry:
+                with tracing.span("sas.delegation_key"):
+                    self._delegation_key_expiry = now + DELEGATION_KEY_LIFETIME
+                    self._delegation_key = self.service_client.get_user_delegation_key(now, self._delegation_key_expiry)
+            return self._delegation_key
+
+    def create_sas_url(self, container_name: str, audio_file_path: str) -> str:
+        """
+        Creates a SAS URL for an audio file stored in an Azure Blob Storage container.
+
+        Args:
+            container_name (str): Name of Azure Blob Storage container where audio file is stored.
+            audio_file_path (str): Path to audio file.
+
+        Returns:
+            str: SAS URL for the specified audio file.
+        """
+        audio_filename = get_filename_from_blob_url(audio_file_path)
+
+        blob_client = self.service_client.get_blob_client(container=container_name, blob=audio_filename)
+
+        sas_expiry_time = datetime.utcnow() + timedelta(hours=730)  # set the expiry time for the SAS token
+
+        permissions = BlobSasPermissions(read=True)
+
+        # Only Azure AD identities get user delegation keys; with a shared key the SAS is signed by the key itself.
+        if self.account_key:
+            signing_key = {"account_key": self.account_key}
+        else:
+            signing_key = {"user_delegation_key": self.get_user_delegation_key()}
+
+        # generate the SAS token
+        sas_token = generate_blob_sas(permission = permissions
+            , expiry = sas_expiry_time
+            , account_name = self.storage_account_name
+            , container_name = container_name
+            , blob_name = audio_filename
+            , **signing_key
+            , resource_types = "object"
+            , protocol = "https"
+            , version = "2020-02-10"
+            , snapshot = None
+            , cache_control = None
+            , content_disposition = None
+            , content_encoding = None
+            , content_language = None
+            , content_type = None
+        )
+
+        return f"{blob_client.url}?{sas_token}"
+
+
+def get_blob_session(storage_account_name: str) -> BlobSession:
+    """
+    Returns the BlobSession for a storage account, creating it on first use.
+
+    Args:
+        storage_account_name (str): Name of Azure Blob Storage account.
+
+    Returns:
+        BlobSession: Cached session for the storage account.
+    """
+    with _blob_sessions_lock:
+        blob_session = _blob_sessions.get(storage_account_name)
+        if blob_session is None:
+            blob_session = BlobSession(storage_account_name)
+            _blob_sessions[storage_account_name] = blob_session
+        return blob_session
+
 
 def upload_audio_file_to_container(audio_file_path: str, storage_account_name: str, container_name: str) -> None:
     """
@@ -21,22 +279,11 @@ def upload_audio_file_to_container(audio_file_path: str, storage_account_name: s
         storage_account_name (str): Name of Azure Blob Storage account.
         container_name (str): Name of Azure Blob Storage container.
     """
-    
-    # Create connection to Azure Blob Storage account and container 
-    blob_service_client = BlobServiceClient(account_url=f"https://{storage_account_name}.blob.core.windows.net", credential=credential)
-    blob_container_client = blob_service_client.get_container_client(container_name)
-
-    if not blob_container_client.exists():
-        blob_container_client.create_container()
+    get_blob_session(storage_account_name).upload_audio_file(audio_file_path, container_name)
 
-    # Upload file to container 
-    blob_name = os.path.basename(audio_file_path)
-    
-    with open(audio_file_path,"rb") as data:
-        blob_container_client.upload_blob(blob_name, data, overwrite=True)
 
-
-def upload_json_to_container(blob_name: str, json_data: dict, storage_account_name: str, container_name: str) -> None:
+def upload_json_to_container(blob_name: str, json_data: dict, storage_account_name: str, container_name: str,
+                             content_type: str = None, content_encoding: str = None) -> None:
     """
     Uploads a JSON-formatted string as a file to an Azure Blob Storage container.
 
@@ -45,16 +292,11 @@ def upload_json_to_container(blob_name: str, json_data: dict, storage_account_na
         json_data (dict): Dictionary containing data to be saved in output file.
         storage_account_name (str): Name of Azure Blob Storage account.
         container_name (str): Name of Azure Blob Storage container.
+        content_type (str): Optional Content-Type of the blob.
+        content_encoding (str): Optional Content-Encoding of the blob, for example "gzip".
     """
-    
-    # Create connection to Azure Blob Storage account and container 
-    blob_service_client = BlobServiceClient(account_url=f"https://{storage_account_name}.blob.core.windows.net", credential=credential)
-    blob_container_client = blob_service_client.get_container_client(container_name)
-
-    if not blob_container_client.exists():
-        blob_container_client.create_container()
-    
-    blob_container_client.upload_blob(blob_name, json_data, overwrite=True)
+    get_blob_session(storage_account_name).upload_json(blob_name, json_data, container_name,
+                                                       content_type=content_type, content_encoding=content_encoding)
 
 def get_filename_from_blob_url(blob_url: str) -> str:
    try:
@@ -74,43 +316,6 @@ def create_sas_token_for_audio(storage_account_name: str, container_name: str, a
        audio_file_path (str): Path to audio file.
 
    Returns:
-       str: SAS URL for the specified audio file. 
+       str: SAS URL for the specified audio file.
    """
-
-   # Create connection to Azure Blob Storage account and get URL for specified audio file 
-   service_client = BlobServiceClient(account_url=f"https://{storage_account_name}.blob.core.windows.net", credential=credential)
-   
-   audio_filename = get_filename_from_blob_url(audio_file_path)
-   
-   blob_client = service_client.get_blob_client(container=container_name, blob=audio_filename)
-   
-   sas_expiry_time = datetime.utcnow() + timedelta(hours=730)  # set the expiry time for the SAS token
-  
-   permissions = BlobSasPermissions(read=True)
-
-   # Get user delegation key and generate SAS token for the specified audio file 
-   delegation_key = service_client.get_user_delegation_key(datetime.utcnow()
-                                                           , datetime.utcnow() + timedelta(hours=1))
-  
-    
-   # generate the SAS token   
-   sas_token = generate_blob_sas(permission = permissions
-      , expiry = sas_expiry_time
-      , account_name = storage_account_name
-      , container_name = container_name
-      , blob_name = audio_filename
-      , user_delegation_key = delegation_key
-      , resource_types = "object"
-      , protocol = "https"
-      , version = "2020-02-10"
-      , snapshot = None
-      , cache_control = None
-      , content_disposition = None
-      , content_encoding = None
-      , content_language = None
-      , content_type = None
-   )
-
-   sas_url = f"{blob_client.url}?{sas_token}"
-
-   return sas_url
\ No newline at end of file
+   return get_blob_session(storage_account_name).create_sas_url(container_name, audio_file_path)
@@ -0,0 +1,79 @@
+import gzip
+from json import dumps
+from typing import Dict, Iterable, Tuple
+
+from utils import speech
+
+# Output formats for published conversations.
+# Only FORMAT_JSON fits the transcription index of notebooks/search.ipynb. The blob indexer reads
+# FORMAT_JSONL as one search document per line, and cannot read FORMAT_JSON_GZIP at all.
+FORMAT_JSON = "json"
+FORMAT_JSONL = "jsonl"
+FORMAT_JSON_GZIP = "json.gz"
+
+OUTPUT_FORMATS = [FORMAT_JSON, FORMAT_JSONL, FORMAT_JSON_GZIP]
+
+
+def build_conversation_document(metadata: Dict, phrases: Iterable[speech.TranscriptionPhrase],
+                                transcription_id: str, transcription_url: str) -> Dict:
+    """
+    Converts a Speech batch transcription result into the document published to the target container.
+    The phrases are nested as a list of conversation items rather than an escaped JSON string.
+
+    Args:
+        metadata (dict): Top-level fields of the transcription result, see speech.read_transcription.
+        phrases (iterable): TranscriptionPhrase objects of the transcription result, in conversation order.
+        transcription_id (str): ID of the transcription job.
+        transcription_url (str): URL the transcription result was downloaded from.
+
+    Returns:
+        dict: Document containing the conversation text and its phrases.
+    """
+    conversation_items = speech.transcription_phrases_to_conversation_items(phrases)
+
+    # Joining once keeps building the conversation text linear in its length.
+    conversation = "".join(f"{conversation_item['role']}: {conversation_item['display']} \n"
+                           for conversation_item in conversation_items)
+
+    return {
+        "source": metadata["source"]
+        , "transcription_id": transcription_id
+        , "transcription_url": transcription_url
+        , "conversationDuration": metadata["duration"]
+        , "conversation": conversation
+        , "phrases": conversation_items
+    }
+
+
+def serialize_conversation_document(document: Dict, output_format: str = FORMAT_JSON) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Serializes a conversation document for upload.
+
+    FORMAT_JSON writes the document as compact JSON. FORMAT_JSONL writes a header line with every
+    field but the phrases, including the conversation text, followed by one line per phrase carrying
+    the transcription ID and source, for consumers that stream phrases.
+    FORMAT_JSON_GZIP writes gzip-compressed JSON for consumers other than the search indexer.
+
+    Args:
+        document (dict): Document returned by build_conversation_document.
+        output_format (str): One of OUTPUT_FORMATS.
+
+    Returns:
+        Tuple[bytes, dict]: The serialized document, and the blob name extension, content type and
+        content encoding to upload it with.
+    """
+    if output_format == FORMAT_JSONL:
+        header = {name: value for name, value in document.items() if name != "phrases"}
+        phrases = (dict(phrase, transcription_id=document["transcription_id"], source=document["source"])
+                   for phrase in document["phrases"])
+        lines = (dumps(line, ensure_ascii=False, separators=(",", ":")) for line in [header, *phrases])
+        data = "\n".join(lines).encode("utf-8")
+        return data, {"extension": "jsonl", "content_type": "application/x-ndjson", "content_encoding": None}
+
+    data = dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if output_format == FORMAT_JSON_GZIP:
+        return gzip.compress(data), {"extension": "json.gz", "content_type": "application/json", "content_encoding": "gzip"}
+    if output_format == FORMAT_JSON:
+        return data, {"extension": "json", "content_type": "application/json", "content_encoding": None}
+
+    raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
@@ -0,0 +1,111 @@
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+# Stages recorded for each audio file, in the order they are reached.
+STAGE_UPLOADED = "uploaded"
+STAGE_SUBMITTED = "submitted"
+STAGE_TRANSCRIBED = "transcribed"
+STAGE_PUBLISHED = "published"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    content_hash TEXT PRIMARY KEY,
+    audio_file_path TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    transcription_id TEXT,
+    transcription_url TEXT,
+    updated_at TEXT NOT NULL
+)
+"""
+
+
+@dataclass
+class ManifestEntry:
+    """The furthest stage an audio file has reached in a previous run."""
+    content_hash: str
+    audio_file_path: str
+    stage: str
+    transcription_id: Optional[str]
+    transcription_url: Optional[str]
+    updated_at: str
+
+
+def hash_audio_file(audio_file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Computes the SHA-256 hash of an audio file without reading it into memory at once.
+
+    Args:
+        audio_file_path (str): Path to the audio file.
+        chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(audio_file_path, "rb") as data:
+        for chunk in iter(lambda: data.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    Local SQLite record of how far each audio file got, keyed by the hash of its content.
+    Lets a rerun of the ingestion pipeline skip published files and resume unfinished ones.
+    """
+
+    def __init__(self, path: str = "ingestion_manifest.db") -> None:
+        """
+        Initialize an IngestionManifest instance, creating the database if it does not exist.
+
+        Args:
+            path (str): Path to the SQLite database file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+
+    def get(self, content_hash: str) -> Optional[ManifestEntry]:
+        """
+        Looks up the recorded stage of an audio file.
+
+        Args:
+            content_hash (str): Hash of the audio file content, see hash_audio_file.
+
+        Returns:
+            ManifestEntry: The recorded entry, or None if the file has not been seen before.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_hash, audio_file_path, stage, transcription_id, transcription_url, updated_at "
+                "FROM files WHERE content_hash = ?", (content_hash,)).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def record(self, content_hash: str, audio_file_path: str, stage: str,
+               transcription_id: Optional[str] = None, transcription_url: Optional[str] = None) -> None:
+        """
+        Records that an audio file has reached a stage.
+
+        Args:
+            content_hash (str): Hash of the audio file content.
+            audio_file_path (str): Path to the audio file.
+            stage (str): One of the STAGE_* constants.
+            transcription_id (str): ID of the transcription job, once submitted.
+            transcription_url (str): URL of the transcription result, once transcribed.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (content_hash, audio_file_path, stage, transcription_id, transcription_url, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, audio_file_path, stage, transcription_id, transcription_url, datetime.utcnow().isoformat()))
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,418 @@
+import os
+import threading
+import time
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from utils import speech, blobs, conversation, manifest, tracing
+from utils.poller import TranscriptionPoller
+
+# Stages of the ingestion pipeline, in the order a recording moves through them.
+STAGES = ["upload", "submit", "poll", "download", "publish"]
+
+# Bytes per second of 16 kHz, 16-bit mono PCM, used to estimate the duration of non-WAV recordings.
+ESTIMATED_AUDIO_BYTES_PER_SECOND = 32000
+
+
+@dataclass
+class IngestionJob:
+    """The state of a single recording as it moves through the pipeline."""
+    audio_file_path: str
+    content_hash: Optional[str] = None
+    resumed: bool = False
+    audio_bytes: int = 0
+    audio_duration_seconds: float = 0.0
+    input_audio_url: Optional[str] = None
+    transcription_id: Optional[str] = None
+    transcription_url: Optional[str] = None
+    document: Optional[Dict] = None
+    started_at: float = field(default_factory=time.monotonic)
+    span: Optional[tracing.Span] = None
+
+
+@dataclass
+class IngestionStats:
+    """Counters and timings collected while the pipeline runs."""
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    transcriptions: int = 0
+    audio_bytes: int = 0
+    elapsed_seconds: float = 0.0
+    stage_seconds: Dict[str, float] = field(default_factory=lambda: {stage: 0.0 for stage in STAGES})
+    file_seconds: List[float] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def report(self) -> str:
+        """
+        Formats the collected counters as a human readable throughput report.
+
+        Returns:
+            str: Multi-line throughput report.
+        """
+        elapsed = max(self.elapsed_seconds, 1e-9)
+        lines = [
+            f"Processed {self.succeeded} file(s), {self.failed} failed, {self.skipped} already published, in {self.transcriptions} transcription job(s) and {self.elapsed_seconds:.1f} seconds",
+            f"Throughput: {self.succeeded * 60 / elapsed:.2f} files/min, {self.audio_bytes / elapsed / 1024 / 1024:.2f} MB/s of audio",
+        ]
+        completed = max(self.succeeded + self.failed, 1)
+        for stage in STAGES:
+            lines.append(f"  {stage:<9} {self.stage_seconds[stage] / completed:8.2f} s/file")
+        return "\n".join(lines)
+
+
+def estimate_audio_duration(audio_file_path: str) -> float:
+    """
+    Estimates the duration of an audio file, reading the header of WAV files and falling back to the file size.
+
+    Args:
+        audio_file_path (str): Path to the audio file.
+
+    Returns:
+        float: Estimated duration in seconds.
+    """
+    try:
+        with wave.open(audio_file_path, "rb") as audio:
+            return audio.getnframes() / audio.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return os.path.getsize(audio_file_path) / ESTIMATED_AUDIO_BYTES_PER_SECOND
+
+
+def _strip_query(url: str) -> str:
+    return url.split("?")[0]
+
+
+class IngestionPipeline:
+    """
+    Uploads, transcribes and publishes many audio files concurrently.
+
+    Every stage runs on its own bounded thread pool so a slow stage never starves the others,
+    and at most ``max_in_flight`` recordings are between upload and publish at any time.
+    Uploaded recordings are packed into transcription jobs of up to ``batch_size`` files,
+    and outstanding transcriptions are polled together by a shared TranscriptionPoller.
+    With a manifest, files that were already published are skipped and unfinished files
+    resume from the last stage they reached.
+    """
+
+    def __init__(self, storage_account_name: str, source_container_name: str, target_container_name: str,
+                 speech_endpoint: str, speech_subscription_key: str, locale: str = "en-US",
+                 max_workers: int = 8, stage_workers: Optional[Dict[str, int]] = None,
+                 max_in_flight: int = 200, poll_seconds: float = 2,
+                 batch_size: int = 1, batch_linger_seconds: float = 5,
+                 ingestion_manifest: Optional[manifest.IngestionManifest] = None,
+                 output_format: str = conversation.FORMAT_JSON) -> None:
+        """
+        Initialize an IngestionPipeline instance.
+
+        Args:
+            storage_account_name (str): Name of Azure Blob Storage account.
+            source_container_name (str): Name of Azure Blob Storage container for input files.
+            target_container_name (str): Name of Azure Blob Storage container for output files.
+            speech_endpoint (str): The endpoint of the Speech to Text API.
+            speech_subscription_key (str): The subscription key for the Speech to Text API.
+            locale (str): The locale of the audio files.
+            max_workers (int): Number of worker threads for each stage, unless overridden in stage_workers.
+            stage_workers (dict): Optional per-stage worker counts, keyed by stage name.
+            max_in_flight (int): Maximum number of recordings being processed at once.
+            poll_seconds (float): Shortest number of seconds between two status checks of a transcription.
+            batch_size (int): Maximum number of recordings submitted in a single transcription job.
+            batch_linger_seconds (float): How long a partially filled batch waits for more recordings.
+            ingestion_manifest (IngestionManifest): Optional record of the stage each file reached in earlier runs.
+            output_format (str): Format of the published conversations, one of conversation.OUTPUT_FORMATS.
+        """
+        self.storage_account_name = storage_account_name
+        self.source_container_name = source_container_name
+        self.target_container_name = target_container_name
+        self.speech_endpoint = speech_endpoint
+        self.speech_subscription_key = speech_subscription_key
+        self.locale = locale
+        self.poll_seconds = poll_seconds
+        self.batch_size = max(1, batch_size)
+        self.batch_linger_seconds = batch_linger_seconds
+        self.manifest = ingestion_manifest
+        self.output_format = output_format
+        self.stage_workers = {stage: max_workers for stage in STAGES}
+        self.stage_workers.update(stage_workers or {})
+
+        self._in_flight = threading.BoundedSemaphore(max(max_in_flight, self.batch_size))
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = 0
+        self._batch: List[IngestionJob] = []
+        self._batch_started = 0.0
+        self._poller: Optional[TranscriptionPoller] = None
+        self._stopped = threading.Event()
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self.stats = IngestionStats()
+
+    def run(self, audio_file_paths: Iterable[str]) -> IngestionStats:
+        """
+        Processes every audio file and blocks until all of them are published or have failed.
+
+        Args:
+            audio_file_paths (iterable): Paths of the audio files to process.
+
+        Returns:
+            IngestionStats: Counters and timings for the run.
+        """
+        started = time.monotonic()
+        # Polling needs no workers of its own, the shared poller resolves every outstanding transcription.
+        self._executors = {stage: ThreadPoolExecutor(max_workers=self.stage_workers[stage], thread_name_prefix=f"ingest-{stage}")
+                           for stage in STAGES if stage != "poll"}
+        self._poller = TranscriptionPoller(speech_endpoint = self.speech_endpoint
+                                           , speech_subscription_key = self.speech_subscription_key
+                                           , min_interval = self.poll_seconds)
+        self._poller.start()
+        batcher = threading.Thread(target=self._batch_loop, name="ingest-batcher", daemon=True)
+        batcher.start()
+
+        try:
+            for audio_file_path in audio_file_paths:
+                # Blocks once max_in_flight recordings are being processed.
+                self._in_flight.acquire()
+                with self._lock:
+                    self._pending += 1
+                job = IngestionJob(audio_file_path = audio_file_path)
+                job.span = tracing.start_span("ingest", file = os.path.basename(audio_file_path))
+                self._submit("upload", self._upload, [job])
+
+            with self._done:
+                while self._pending:
+                    self._done.wait()
+        finally:
+            self._stopped.set()
+            batcher.join()
+            self._poller.stop()
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+
+        self.stats.elapsed_seconds = time.monotonic() - started
+        return self.stats
+
+    def _submit(self, stage: str, func, jobs: List[IngestionJob]) -> None:
+        self._executors[stage].submit(self._run_stage, stage, func, jobs)
+
+    def _run_stage(self, stage: str, func, jobs: List[IngestionJob]) -> None:
+        stage_started = time.monotonic()
+        try:
+            func(jobs)
+        except Exception as e:
+            for job in jobs:
+                self._finish(job, error = e)
+        finally:
+            with self._lock:
+                self.stats.stage_seconds[stage] += time.monotonic() - stage_started
+
+    def _finish(self, job: IngestionJob, error: Optional[Exception] = None, skipped: bool = False) -> None:
+        if error is not None and self.manifest is not None and job.transcription_id is not None:
+            # The transcription can not be resumed, the next run submits the recording again.
+            self.manifest.record(job.content_hash, job.audio_file_path, manifest.STAGE_UPLOADED)
+
+        with self._done:
+            if skipped:
+                self.stats.skipped += 1
+            elif error is None:
+                self.stats.succeeded += 1
+                self.stats.audio_bytes += job.audio_bytes
+                self.stats.file_seconds.append(time.monotonic() - job.started_at)
+            else:
+                self.stats.failed += 1
+                self.stats.errors[job.audio_file_path] = str(error)
+                print(f"Failed '{job.audio_file_path}': {error}")
+            self._pending -= 1
+            self._done.notify_all()
+        if job.span is not None:
+            job.span.set("skipped", skipped)
+            job.span.end(error = error)
+        self._in_flight.release()
+
+    def _upload(self, jobs: List[IngestionJob]) -> None:
+        job, = jobs
+        print(f"Processing '{job.audio_file_path}'")
+        job.audio_bytes = os.path.getsize(job.audio_file_path)
+        job.audio_duration_seconds = estimate_audio_duration(job.audio_file_path)
+
+        entry = None
+        if self.manifest is not None:
+            job.content_hash = manifest.hash_audio_file(job.audio_file_path)
+            entry = self.manifest.get(job.content_hash)
+
+        if entry is not None and entry.stage == manifest.STAGE_PUBLISHED:
+            print(f"Skipping '{job.audio_file_path}', already published")
+            self._finish(job, skipped = True)
+            return
+
+        if entry is not None and os.path.basename(entry.audio_file_path) != os.path.basename(job.audio_file_path):
+            # Blobs are named after the file, so a renamed or copied recording was never uploaded under
+            # this name, and a transcription of the old blob can not be matched to it.
+            print(f"'{job.audio_file_path}' was recorded as '{entry.audio_file_path}', uploading it again")
+            entry = None
+
+        if entry is None:
+            # Upload audio file to Azure Blob Storage
+            with tracing.span("upload", parent = job.span, bytes = job.audio_bytes):
+                blobs.upload_audio_file_to_container(audio_file_path = job.audio_file_path
+                                                    , storage_account_name = self.storage_account_name
+                                                    , container_name = self.source_container_name)
+            if self.manifest is not None:
+                self.manifest.record(job.content_hash, job.audio_file_path, manifest.STAGE_UPLOADED)
+
+        # Get SAS URL for uploaded audio file
+        with tracing.span("sas", parent = job.span):
+            job.input_audio_url = blobs.create_sas_token_for_audio(storage_account_name = self.storage_account_name
+                                                                    , container_name = self.source_container_name
+                                                                    , audio_file_path = job.audio_file_path)
+
+        if entry is not None and entry.transcription_id is not None:
+            # Wait for the transcription submitted by an earlier run instead of submitting a new one.
+            print(f"Resuming '{job.audio_file_path}' from transcription {entry.transcription_id}")
+            job.resumed = True
+            job.transcription_id = entry.transcription_id
+            self._watch([job])
+            return
+
+        self._add_to_batch(job)
+
+    def _add_to_batch(self, job: IngestionJob) -> None:
+        with self._lock:
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append(job)
+            if len(self._batch) < self.batch_size:
+                # Partially filled batches are flushed by the batcher once they have lingered long enough.
+                return
+            batch, self._batch = self._batch, []
+        self._submit("submit", self._create_transcription, batch)
+
+    def _flush_batch(self) -> None:
+        with self._lock:
+            if not self._batch or time.monotonic() - self._batch_started < self.batch_linger_seconds:
+                return
+            batch, self._batch = self._batch, []
+        self._submit("submit", self._create_transcription, batch)
+
+    def _create_transcription(self, jobs: List[IngestionJob]) -> None:
+        # Create a single transcription job for every recording in the batch using Azure Speech Services
+        # Spans of work shared by a batch are recorded in the trace of its first recording.
+        with tracing.span("submit", parent = jobs[0].span, files = len(jobs)) as submit_span:
+            transcription_id = speech.create_batch_transcription(speech_endpoint = self.speech_endpoint
+                                                                 , speech_subscription_key = self.speech_subscription_key
+                                                                 , input_audio_urls = [job.input_audio_url for job in jobs]
+                                                                 , use_stereo_audio = None
+                                                                 , locale = self.locale)
+            submit_span.set("transcription_id", transcription_id)
+        print(f"Transcription ID: {transcription_id} ({len(jobs)} file(s))")
+
+        with self._lock:
+            self.stats.transcriptions += 1
+            for job in jobs:
+                job.transcription_id = transcription_id
+
+        if self.manifest is not None:
+            for job in jobs:
+                self.manifest.record(job.content_hash, job.audio_file_path, manifest.STAGE_SUBMITTED, transcription_id = transcription_id)
+
+        self._watch(jobs)
+
+    def _watch(self, jobs: List[IngestionJob]) -> None:
+        submitted_at = time.monotonic()
+        self._poller.watch(transcription_id = jobs[0].transcription_id
+                           , audio_duration_seconds = max(job.audio_duration_seconds for job in jobs)
+                           , spans = [job.span for job in jobs if job.span is not None]
+                           , callback = lambda future: self._on_transcription_done(jobs, future, submitted_at))
+
+    def _batch_loop(self) -> None:
+        while not self._stopped.wait(min(self.batch_linger_seconds, 1)):
+            self._flush_batch()
+
+    def _on_transcription_done(self, jobs: List[IngestionJob], future: Future, submitted_at: float) -> None:
+        with self._lock:
+            self.stats.stage_seconds["poll"] += (time.monotonic() - submitted_at) * len(jobs)
+
+        error = future.exception()
+        if error is not None:
+            for job in jobs:
+                if job.resumed:
+                    # Transcriptions from an earlier run may have expired, submit the recording again.
+                    print(f"Unable to resume '{job.audio_file_path}': {error}")
+                    job.resumed = False
+                    job.transcription_id = None
+                    self._add_to_batch(job)
+                else:
+                    self._finish(job, error = error)
+            return
+        self._submit("download", self._download, jobs)
+
+    def _download(self, jobs: List[IngestionJob]) -> None:
+        transcription_id = jobs[0].transcription_id
+
+        # Get URLs for transcription results from Azure Speech Services
+        with tracing.span("download.files", parent = jobs[0].span, transcription_id = transcription_id):
+            transcription_files = speech.get_transcription_files(transcription_id = transcription_id
+                                                                 , speech_endpoint = self.speech_endpoint
+                                                                 , speech_subscription_key = self.speech_subscription_key)
+        transcription_urls = speech.get_transcription_urls(transcription_files = transcription_files)
+
+        # Fan the per-file results back out to the recordings they were transcribed from. Recordings with the
+        # same file name share a blob URL, and each of them takes one of the results for it.
+        jobs_by_source: Dict[str, List[IngestionJob]] = {}
+        for job in jobs:
+            jobs_by_source.setdefault(_strip_query(job.input_audio_url), []).append(job)
+
+        try:
+            for transcription_url in transcription_urls:
+                print(f"Transcription URI: {transcription_url}")
+
+                # Download and incrementally parse JSON-formatted transcription result from Azure Blob Storage
+                with tracing.span("download", parent = jobs[0].span) as download_span:
+                    metadata, phrase_store = speech.read_transcription(transcription_url = transcription_url)
+                    download_span.set("phrases", len(phrase_store))
+                waiting = jobs_by_source.get(_strip_query(metadata["source"]))
+                if not waiting:
+                    continue
+                job = waiting.pop(0)
+
+                job.transcription_url = transcription_url
+                try:
+                    if self.manifest is not None:
+                        self.manifest.record(job.content_hash, job.audio_file_path, manifest.STAGE_TRANSCRIBED
+                                             , transcription_id = transcription_id, transcription_url = transcription_url)
+                    with tracing.span("parse", parent = job.span, phrases = len(phrase_store)):
+                        job.document = conversation.build_conversation_document(metadata = metadata
+                                                                                , phrases = phrase_store.time_ordered_phrases()
+                                                                                , transcription_id = transcription_id
+                                                                                , transcription_url = transcription_url)
+                except Exception as e:
+                    self._finish(job, error = e)
+                    continue
+                self._submit("publish", self._publish, [job])
+        except Exception as e:
+            # Recordings already handed to the publish stage are finished there.
+            for waiting in jobs_by_source.values():
+                for job in waiting:
+                    self._finish(job, error = e)
+            return
+
+        for waiting in jobs_by_source.values():
+            for job in waiting:
+                self._finish(job, error = Exception(f"Transcription {transcription_id} returned no result for '{job.audio_file_path}'"))
+
+    def _publish(self, jobs: List[IngestionJob]) -> None:
+        job, = jobs
+
+        # Save conversation items as a JSON file in another Azure Blob Storage container
+        with tracing.span("publish", parent = job.span, format = self.output_format) as publish_span:
+            data, blob_settings = conversation.serialize_conversation_document(job.document, self.output_format)
+            publish_span.set("bytes", len(data))
+            blobs.upload_json_to_container(blob_name = f"{os.path.basename(job.audio_file_path)}.{blob_settings['extension']}"
+                                           , json_data = data
+                                           , storage_account_name = self.storage_account_name
+                                           , container_name = self.target_container_name
+                                           , content_type = blob_settings["content_type"]
+                                           , content_encoding = blob_settings["content_encoding"])
+        if self.manifest is not None:
+            self.manifest.record(job.content_hash, job.audio_file_path, manifest.STAGE_PUBLISHED
+                                 , transcription_id = job.transcription_id, transcription_url = job.transcription_url)
+        self._finish(job)
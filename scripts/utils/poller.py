@@ -0,0 +1,246 @@
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+
+from utils import speech, tracing
+
+
+@dataclass
+class _WatchedTranscription:
+    """A transcription the poller is waiting on."""
+    transcription_id: str
+    future: Future
+    next_check: float
+    interval: float
+    submitted_at: float = field(default_factory=time.time)
+    running_at: Optional[float] = None
+    errors: int = 0
+    spans: List[tracing.Span] = field(default_factory=list)
+
+
+class TranscriptionPoller:
+    """
+    Tracks every outstanding transcription and refreshes their statuses together.
+
+    A single background thread pages through the List Transcriptions API, which returns the
+    status of many jobs per request, and only falls back to per-job status calls for jobs it
+    could not find in the first few pages. Each job is first checked around the time it is
+    expected to finish, based on the duration of its audio, and then with a growing interval.
+    Waiters get a Future that resolves to True once the transcription has succeeded.
+    A job only fails when Speech reports it failed, or when its status could not be read
+    max_status_errors times in a row.
+    The time a job spent queued and running is recorded as spans, as precisely as the checks observe it.
+    """
+
+    def __init__(self, speech_endpoint: str, speech_subscription_key: str, min_interval: float = 2,
+                 max_interval: float = 60, backoff: float = 1.5, realtime_factor: float = 0.1,
+                 list_page_size: int = 100, max_list_pages: int = 5, max_status_errors: int = 5) -> None:
+        """
+        Initialize a TranscriptionPoller instance.
+
+        Args:
+            speech_endpoint (str): The endpoint of the Speech to Text API.
+            speech_subscription_key (str): The subscription key for the Speech to Text API.
+            min_interval (float): Shortest time in seconds between two checks of the same job.
+            max_interval (float): Longest time in seconds between two checks of the same job.
+            backoff (float): Factor the check interval grows by after each unfinished check.
+            realtime_factor (float): Expected transcription time as a fraction of the audio duration.
+            list_page_size (int): Number of transcriptions requested per List Transcriptions page.
+            max_list_pages (int): Maximum number of pages read per refresh before falling back to per-job calls.
+            max_status_errors (int): Consecutive failed status checks of a job before it is failed.
+        """
+        self.speech_endpoint = speech_endpoint
+        self.speech_subscription_key = speech_subscription_key
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.realtime_factor = realtime_factor
+        self.list_page_size = list_page_size
+        self.max_list_pages = max_list_pages
+        self.max_status_errors = max_status_errors
+        self.list_calls = 0
+        self.status_calls = 0
+
+        self._watched: Dict[str, _WatchedTranscription] = {}
+        self._changed = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "TranscriptionPoller":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Starts the background polling thread."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="transcription-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background polling thread. Transcriptions still being watched are left unresolved."""
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def watch(self, transcription_id: str, audio_duration_seconds: Optional[float] = None,
+              callback: Optional[Callable[[Future], None]] = None, spans: Iterable[tracing.Span] = ()) -> Future:
+        """
+        Starts tracking a transcription.
+
+        Args:
+            transcription_id (str): ID of the transcription to wait for.
+            audio_duration_seconds (float): Duration of the longest audio file in the job, if known.
+            callback (callable): Optional function called with the Future once the transcription has finished.
+            spans (iterable): Spans of the work waiting on the transcription; its queue and run time are recorded under each.
+
+        Returns:
+            Future: Resolves to True when the transcription succeeds, or raises if it fails.
+        """
+        first_check = self.min_interval
+        if audio_duration_seconds:
+            first_check = max(self.min_interval, audio_duration_seconds * self.realtime_factor)
+
+        with self._changed:
+            watched = self._watched.get(transcription_id)
+            if watched is None:
+                # Several waiters on the same transcription share its Future.
+                watched = _WatchedTranscription(transcription_id = transcription_id
+                                                , future = Future()
+                                                , next_check = time.monotonic() + first_check
+                                                , interval = self.min_interval)
+                self._watched[transcription_id] = watched
+                self._changed.notify_all()
+            watched.spans.extend(spans)
+
+        if callback is not None:
+            watched.future.add_done_callback(callback)
+        return watched.future
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = [watched.transcription_id for watched in self._watched.values() if watched.next_check <= now]
+                if not due:
+                    next_check = min((watched.next_check for watched in self._watched.values()), default=None)
+                    self._changed.wait(None if next_check is None else next_check - now)
+                    continue
+
+            try:
+                self._refresh(due)
+            except Exception as e:
+                print(f"Unable to refresh transcription statuses: {e}")
+                self._reschedule(due)
+
+    def _refresh(self, due: Iterable[str]) -> None:
+        remaining = set(due)
+        uri = None
+
+        # Every page refreshes all watched jobs it contains, not only the ones that are due.
+        for _ in range(self.max_list_pages):
+            page = speech.list_transcriptions(speech_endpoint = self.speech_endpoint
+                                              , speech_subscription_key = self.speech_subscription_key
+                                              , uri = uri
+                                              , top = self.list_page_size)
+            self.list_calls += 1
+
+            for transcription in page.get("values", []):
+                transcription_id = transcription["self"].split("/")[-1]
+                if self._update(transcription_id, transcription["status"], transcription):
+                    remaining.discard(transcription_id)
+
+            uri = page.get("@nextLink")
+            if not remaining or not uri:
+                break
+
+        # Jobs beyond the pages we read are checked one by one.
+        for transcription_id in remaining:
+            self.status_calls += 1
+            try:
+                done = speech.get_transcription_status(transcription_id = transcription_id
+                                                       , speech_endpoint = self.speech_endpoint
+                                                       , speech_subscription_key = self.speech_subscription_key)
+            except requests.RequestException as e:
+                # Timeouts, dropped connections, throttling and 5xx responses are retried like an unfinished job.
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code is None or status_code == 429 or status_code >= 500:
+                    self._retry(transcription_id, e)
+                else:
+                    self._resolve(transcription_id, error = e)
+                continue
+            except Exception as e:
+                self._resolve(transcription_id, error = e)
+                continue
+            self._update(transcription_id, "Succeeded" if done else "Running", None)
+
+    def _retry(self, transcription_id: str, error: Exception) -> None:
+        with self._changed:
+            watched = self._watched.get(transcription_id)
+            if watched is None:
+                return
+            watched.errors += 1
+            if watched.errors < self.max_status_errors:
+                print(f"Unable to check transcription {transcription_id}, retrying: {error}")
+                watched.next_check = time.monotonic() + watched.interval
+                watched.interval = min(watched.interval * self.backoff, self.max_interval)
+                return
+
+        self._resolve(transcription_id, error = error)
+
+    def _update(self, transcription_id: str, status: str, transcription: Optional[Dict]) -> bool:
+        with self._changed:
+            watched = self._watched.get(transcription_id)
+            if watched is None:
+                return False
+            watched.errors = 0
+            if status.lower() not in ("succeeded", "failed"):
+                if status.lower() == "running" and watched.running_at is None:
+                    watched.running_at = time.time()
+                if watched.next_check <= time.monotonic():
+                    watched.next_check = time.monotonic() + watched.interval
+                    watched.interval = min(watched.interval * self.backoff, self.max_interval)
+                return True
+
+        if status.lower() == "succeeded":
+            self._resolve(transcription_id)
+        else:
+            self._resolve(transcription_id, error = Exception(f"Unable to transcribe audio input. Response:\n{transcription}"))
+        return True
+
+    def _resolve(self, transcription_id: str, error: Optional[Exception] = None) -> None:
+        with self._changed:
+            watched = self._watched.pop(transcription_id, None)
+        if watched is None:
+            return
+
+        finished_at = time.time()
+        running_at = watched.running_at or finished_at
+        for parent in watched.spans:
+            tracing.record_span("transcription.queue", watched.submitted_at, running_at, parent = parent
+                                , transcription_id = transcription_id)
+            tracing.record_span("transcription.run", running_at, finished_at, parent = parent
+                                , transcription_id = transcription_id, failed = error is not None)
+
+        if error is None:
+            watched.future.set_result(True)
+        else:
+            watched.future.set_exception(error)
+
+    def _reschedule(self, transcription_ids: Iterable[str]) -> None:
+        with self._changed:
+            for transcription_id in transcription_ids:
+                watched = self._watched.get(transcription_id)
+                if watched is not None:
+                    watched.next_check = time.monotonic() + watched.interval
@@ -5,12 +5,117 @@
 
 # To install, run:
 # python -m pip install requests
+import re
+import threading
 import requests
-from typing import Dict, List
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+# Number of hosts with a connection pool, and the maximum number of keep-alive connections to each host.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 64
+
+# Seconds to wait for a connection to be established and for the server to respond.
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+_GUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_endpoint_stats : Dict[str, Dict[str, float]] = {}
+
+class _TimeoutHTTPAdapter(HTTPAdapter) :
+    """An HTTPAdapter that applies a default timeout to requests that do not set their own."""
+    def __init__(self, timeout : Tuple[float, float], **kwargs) :
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs) :
+        if kwargs.get("timeout") is None :
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+def _endpoint(method : str, uri : str) -> str :
+    # Group requests by host and path, with transcription IDs and other GUIDs collapsed.
+    parts = urlsplit(uri)
+    return f"{method} {parts.netloc}{_GUID_PATTERN.sub('{id}', parts.path)}"
+
+def _record_response(response : requests.Response, *args, **kwargs) -> None :
+    endpoint = _endpoint(response.request.method, response.request.url)
+    with _stats_lock :
+        stats = _endpoint_stats.setdefault(endpoint, { "count" : 0, "errors" : 0, "total_seconds" : 0.0, "max_seconds" : 0.0 })
+        seconds = response.elapsed.total_seconds()
+        stats["count"] += 1
+        stats["errors"] += 0 if response.ok else 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+def _create_session(pool_connections : int, pool_maxsize : int, connect_timeout : float, read_timeout : float) -> requests.Session :
+    session = requests.Session()
+    adapter = _TimeoutHTTPAdapter(timeout=(connect_timeout, read_timeout), pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(_record_response)
+    return session
+
+def configure_session(pool_connections : int = POOL_CONNECTIONS, pool_maxsize : int = POOL_MAXSIZE,
+                      connect_timeout : float = CONNECT_TIMEOUT, read_timeout : float = READ_TIMEOUT) -> requests.Session :
+    """
+    Replaces the shared session used for every Speech and blob REST call.
+
+    Args:
+        pool_connections (int): Number of hosts to keep a connection pool for.
+        pool_maxsize (int): Maximum number of keep-alive connections to each host. Callers block when all are in use.
+        connect_timeout (float): Seconds to wait for a connection to be established.
+        read_timeout (float): Seconds to wait for the server to respond.
+
+    Returns:
+        requests.Session: The new shared session.
+    """
+    global _session
+    session = _create_session(pool_connections, pool_maxsize, connect_timeout, read_timeout)
+    with _session_lock :
+        previous, _session = _session, session
+    if previous is not None :
+        previous.close()
+    return session
+
+def get_session() -> requests.Session :
+    """
+    Returns the shared session, creating it with the default pool sizes and timeouts on first use.
+    Reusing the session keeps connections to the Speech and blob endpoints alive between requests.
+    """
+    global _session
+    with _session_lock :
+        if _session is None :
+            _session = _create_session(POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT)
+        return _session
+
+def get_endpoint_stats() -> Dict[str, Dict[str, float]] :
+    """
+    Returns the number of requests, failed requests and response latency for every endpoint called so far.
+
+    Returns:
+        Dict: Statistics keyed by "METHOD host/path", with "count", "errors", "total_seconds", "max_seconds" and "mean_seconds".
+    """
+    with _stats_lock :
+        return { endpoint : dict(stats, mean_seconds=stats["total_seconds"] / stats["count"])
+                 for endpoint, stats in _endpoint_stats.items() }
+
+def format_endpoint_stats() -> str :
+    """Formats the per-endpoint statistics as a human readable report."""
+    lines = []
+    for endpoint, stats in sorted(get_endpoint_stats().items()) :
+        lines.append(f"  {stats['count']:6d} requests {stats['errors']:4d} errors {stats['mean_seconds'] * 1000:8.1f} ms mean {stats['max_seconds'] * 1000:8.1f} ms max  {endpoint}")
+    return "\n".join(lines)
 
 def send_get(uri : str, key : str, expected_status_codes : List[int]) -> Dict :
     headers = {"Ocp-Apim-Subscription-Key": key}
-    response = requests.get(uri, headers=headers)
+    response = get_session().get(uri, headers=headers)
     if response.status_code not in expected_status_codes :
         raise Exception(f"The GET request to {uri} returned a status code {response.status_code} that was not in the expected status codes: {expected_status_codes}")
     else :
@@ -23,20 +128,20 @@ def send_get(uri : str, key : str, expected_status_codes : List[int]) -> Dict :
 
 def send_post(uri : str, content : Dict, key : str, expected_status_codes : List[int]) -> Dict :
     headers = {"Ocp-Apim-Subscription-Key": key}
-    
-    response = requests.post(uri, headers=headers, json=content)
-    
+
+    response = get_session().post(uri, headers=headers, json=content)
+
     if response.status_code not in expected_status_codes :
         raise Exception(f"The POST request to {uri} returned a status code {response.status_code} that was not in the expected status codes: {expected_status_codes}")
     else :
         try :
-            response_json = response.json()            
+            response_json = response.json()
             return { "headers" : response.headers, "text" : response.text, "json" : response_json }
         except Exception :
             return { "headers" : response.headers, "text" : response.text, "json" : None }
 
 def send_delete(uri : str, key : str, expected_status_codes : List[int]) -> None :
     headers = {"Ocp-Apim-Subscription-Key": key}
-    response = requests.delete(uri, headers=headers)
+    response = get_session().delete(uri, headers=headers)
     if response.status_code not in expected_status_codes :
-        raise Exception(f"The DELETE request to {uri} returned a status code {response.status_code} that was not in the expected status codes: {expected_status_codes}")
\ No newline at end of file
+        raise Exception(f"The DELETE request to {uri} returned a status code {response.status_code} that was not in the expected status codes: {expected_status_codes}")
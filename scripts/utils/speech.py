@@ -1,10 +1,12 @@
+from array import array
 from datetime import datetime
 from http import HTTPStatus
 from json import dumps, loads
+import heapq
 import time
 import uuid
-from utils import rest_helper
-from typing import Dict, List, Tuple, Any
+from utils import rest_helper, tracing, transcription_stream
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
 import requests
 
 
@@ -14,8 +16,13 @@ speech_transcription_path = "/speechtotext/v3.0/transcriptions"
 # How long to wait while polling batch transcription and conversation analysis status.
 WAIT_SECONDS = 10
 
+# Number of ticks (100 nanosecond units) per second in Speech offsets and durations.
+TICKS_PER_SECOND = 10_000_000
+
 class TranscriptionPhrase:
     """A class representing a phrase in a transcription."""
+    __slots__ = ("id", "display", "speaker_number", "offset", "offset_in_ticks", "duration")
+
     def __init__(
         self, id_: int, display: str, speaker_number: int, offset: str, offset_in_ticks: float, duration: str
     ) -> None:
@@ -37,6 +44,145 @@ class TranscriptionPhrase:
         self.offset_in_ticks = offset_in_ticks
         self.duration = duration
 
+def ticks_to_duration(ticks: int) -> str:
+    """
+    Formats a number of ticks as an ISO 8601 duration, the way the Speech to Text API formats offsets and durations.
+
+    Args:
+        ticks (int): Number of 100 nanosecond units.
+
+    Returns:
+        str: The duration, for example "PT1M3.28S".
+    """
+    hours, remainder = divmod(ticks, 3600 * TICKS_PER_SECOND)
+    minutes, remainder = divmod(remainder, 60 * TICKS_PER_SECOND)
+    seconds = f"{remainder / TICKS_PER_SECOND:.2f}".rstrip("0").rstrip(".")
+    return "PT" + (f"{hours}H" if hours else "") + (f"{minutes}M" if minutes else "") + f"{seconds}S"
+
+class _TextColumn:
+    """Strings kept in a single buffer indexed by start positions, instead of one object each."""
+
+    def __init__(self) -> None:
+        self.starts = array("Q", [0])
+        self._parts: List[str] = []
+        self._text = ""
+
+    def append(self, text: str) -> None:
+        self._parts.append(text)
+        self.starts.append(self.starts[-1] + len(text))
+
+    def __getitem__(self, row: int) -> str:
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts = []
+        return self._text[self.starts[row]:self.starts[row + 1]]
+
+class PhraseStore:
+    """
+    Column-oriented store for the phrases of a transcription.
+
+    Offsets, durations and speakers are kept in typed arrays, and the transcribed text and the
+    offset and duration strings Speech returned in single buffers indexed by start positions, so a
+    phrase costs a few bytes plus its text instead of a dictionary or object. Phrases are kept in
+    one stream per speaker; each stream arrives ordered by offset, so the conversation is rebuilt
+    with a linear k-way merge rather than a sort.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty PhraseStore instance."""
+        # Speech writes ticks as floating point numbers; doubles keep them as published before.
+        self.offsets = array("d")
+        self.durations = array("d")
+        self.speakers = array("h")
+        self._displays = _TextColumn()
+        self._offset_texts = _TextColumn()
+        self._duration_texts = _TextColumn()
+        self._streams: Dict[int, array] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def append(self, speaker_number: int, offset_in_ticks: float, duration_in_ticks: float, display: str,
+               offset: Optional[str] = None, duration: Optional[str] = None) -> None:
+        """
+        Adds a phrase to the store.
+
+        Args:
+            speaker_number (int): The number of the speaker.
+            offset_in_ticks (float): The time offset of the phrase in ticks.
+            duration_in_ticks (float): The phrase time in ticks.
+            display (str): The transcribed text.
+            offset (str): The time offset as returned by Speech, formatted from the ticks if not given.
+            duration (str): The phrase time as returned by Speech, formatted from the ticks if not given.
+        """
+        row = len(self.offsets)
+        self.offsets.append(offset_in_ticks)
+        self.durations.append(duration_in_ticks)
+        self.speakers.append(speaker_number)
+        self._displays.append(display)
+        self._offset_texts.append(offset if offset is not None else ticks_to_duration(int(offset_in_ticks)))
+        self._duration_texts.append(duration if duration is not None else ticks_to_duration(int(duration_in_ticks)))
+
+        stream = self._streams.setdefault(speaker_number, array("L"))
+        stream.append(row)
+
+    def append_recognized_phrase(self, phrase: Dict[str, Any]) -> None:
+        """
+        Adds a recognized phrase from the JSON transcription result.
+
+        Args:
+            phrase: The recognized phrase.
+        """
+        best = phrase["nBest"][0]
+        self.append(get_speaker_number(phrase), phrase["offsetInTicks"], phrase["durationInTicks"], best["display"],
+                    phrase.get("offset"), phrase.get("duration"))
+
+    def display(self, row: int) -> str:
+        """Returns the transcribed text of a phrase."""
+        return self._displays[row]
+
+    def time_ordered_rows(self) -> Iterator[int]:
+        """
+        Returns the rows of every phrase ordered by offset, interleaving the speakers.
+
+        Returns:
+            Iterator[int]: Row indexes in conversation order.
+        """
+        offsets = self.offsets
+        streams = []
+        for stream in self._streams.values():
+            if any(offsets[a] > offsets[b] for a, b in zip(stream, stream[1:])):
+                # Only streams that did not arrive in order need sorting.
+                stream = sorted(stream, key=offsets.__getitem__)
+            streams.append(stream)
+        return heapq.merge(*streams, key=offsets.__getitem__)
+
+    def time_ordered_phrases(self) -> Iterator[TranscriptionPhrase]:
+        """
+        Returns every phrase ordered by offset, numbered in conversation order.
+
+        Returns:
+            Iterator[TranscriptionPhrase]: The phrases in conversation order.
+        """
+        for id_, row in enumerate(self.time_ordered_rows()):
+            yield TranscriptionPhrase(id_, self.display(row), self.speakers[row], self._offset_texts[row],
+                                      self.offsets[row], self._duration_texts[row])
+
+def get_speech_base_url(speech_endpoint: str) -> str:
+    """
+    Returns the base URL of the Speech to Text API for an endpoint.
+
+    Args:
+        speech_endpoint (str): A host name such as "eastus.api.cognitive.microsoft.com", called over HTTPS,
+            or a URL with its scheme, for example of a local stand-in.
+
+    Returns:
+        str: The base URL, without a trailing slash.
+    """
+    if "://" in speech_endpoint:
+        return speech_endpoint.rstrip("/")
+    return f"https://{speech_endpoint}"
+
 def create_transcription(speech_endpoint: str, speech_subscription_key: str, input_audio_url: str,
                          use_stereo_audio: bool, locale: str) -> str:
     """
@@ -52,16 +198,41 @@ def create_transcription(speech_endpoint: str, speech_subscription_key: str, inp
     Returns:
         str: The ID of the created transcription.
 
+    Raises:
+        Exception: If the response from the Speech to Text API is not valid.
+    """
+    return create_batch_transcription(speech_endpoint=speech_endpoint,
+                                      speech_subscription_key=speech_subscription_key,
+                                      input_audio_urls=[input_audio_url],
+                                      use_stereo_audio=use_stereo_audio,
+                                      locale=locale)
+
+def create_batch_transcription(speech_endpoint: str, speech_subscription_key: str, input_audio_urls: List[str],
+                               use_stereo_audio: bool, locale: str) -> str:
+    """
+    Creates a single transcription job for several audio files using the Azure Speech to Text API.
+    The job produces one transcription result per audio file, see get_transcription_urls.
+
+    Args:
+        speech_endpoint (str): The endpoint of the Speech to Text API.
+        speech_subscription_key (str): The subscription key for the Speech to Text API.
+        input_audio_urls (List[str]): The URLs of the audio files to transcribe.
+        use_stereo_audio (bool): Indicates whether the audio files are stereo or not.
+        locale (str): The locale of the audio files.
+
+    Returns:
+        str: The ID of the created transcription.
+
     Raises:
         Exception: If the response from the Speech to Text API is not valid.
     """
     
     # Construct the URI for the API call.
-    uri = f"https://{speech_endpoint}{speech_transcription_path}"
+    uri = f"{get_speech_base_url(speech_endpoint)}{speech_transcription_path}"
 
     # Construct the request body.
     content = {
-        "contentUrls": [input_audio_url],
+        "contentUrls": input_audio_urls,
         "properties": {
             "diarizationEnabled": not use_stereo_audio,
             "timeToLive": "PT30M"
@@ -99,9 +270,9 @@ def get_transcription_status(transcription_id: str, speech_endpoint: str, speech
     :return: bool: True if the transcription succeeded, False otherwise
     :raises: Exception if the transcription failed
     """
-    uri = f"https://{speech_endpoint}{speech_transcription_path}/{transcription_id}"
+    uri = f"{get_speech_base_url(speech_endpoint)}{speech_transcription_path}/{transcription_id}"
     headers = {"Ocp-Apim-Subscription-Key": speech_subscription_key}
-    response = requests.get(uri, headers=headers)
+    response = rest_helper.get_session().get(uri, headers=headers)
 
     if response.status_code == requests.codes.ok:
         status = response.json()["status"]
@@ -112,6 +283,26 @@ def get_transcription_status(transcription_id: str, speech_endpoint: str, speech
     else:
         response.raise_for_status()
 
+def list_transcriptions(speech_endpoint: str, speech_subscription_key: str, uri: str = None, top: int = 100) -> Dict:
+    """
+    Get one page of the transcriptions owned by the subscription using the provided endpoint and subscription key.
+
+    :param speech_endpoint: str: endpoint to use for the Speech to Text API
+    :param speech_subscription_key: str: subscription key for the Speech to Text API
+    :param uri: str: the "@nextLink" of the previous page, or None for the first page
+    :param top: int: maximum number of transcriptions on the first page
+    :return: Dict: the page JSON, with the transcriptions in "values" and the next page in "@nextLink"
+    """
+    if uri is None:
+        uri = f"{get_speech_base_url(speech_endpoint)}{speech_transcription_path}?skip=0&top={top}"
+    headers = {"Ocp-Apim-Subscription-Key": speech_subscription_key}
+    response = rest_helper.get_session().get(uri, headers=headers)
+
+    if response.status_code == requests.codes.ok:
+        return response.json()
+    else:
+        response.raise_for_status()
+
 def wait_for_transcription(transcription_id: str, speech_endpoint: str, speech_subscription_key: str, wait_seconds: int = 15) -> None:
     """
     Wait for a given transcription to complete using the provided endpoint and subscription key.
@@ -122,10 +313,11 @@ def wait_for_transcription(transcription_id: str, speech_endpoint: str, speech_s
     :param wait_seconds: int: number of seconds to wait between checks, default is 15
     """
     done = False
-    while not done:
-        print(f"Waiting {wait_seconds} seconds for transcription to complete.")
-        time.sleep(wait_seconds)
-        done = get_transcription_status(transcription_id, speech_endpoint, speech_subscription_key)
+    with tracing.span("transcription.wait", transcription_id=transcription_id):
+        while not done:
+            print(f"Waiting {wait_seconds} seconds for transcription to complete.")
+            time.sleep(wait_seconds)
+            done = get_transcription_status(transcription_id, speech_endpoint, speech_subscription_key)
 
 def get_transcription_files(transcription_id: str, speech_endpoint: str, speech_subscription_key: str) -> Dict:
     """
@@ -134,16 +326,27 @@ def get_transcription_files(transcription_id: str, speech_endpoint: str, speech_
     :param transcription_id: str: ID of the transcription to get files for
     :param speech_endpoint: str: endpoint to use for the Speech to Text API
     :param speech_subscription_key: str: subscription key for the Speech to Text API
-    :return: Dict: the transcription files response JSON
+    :return: Dict: the transcription files response JSON, with the values of every result page
     """
-    uri = f"https://{speech_endpoint}{speech_transcription_path}/{transcription_id}/files"
+    uri = f"{get_speech_base_url(speech_endpoint)}{speech_transcription_path}/{transcription_id}/files"
     headers = {"Ocp-Apim-Subscription-Key": speech_subscription_key}
-    response = requests.get(uri, headers=headers)
+    transcription_files = None
 
-    if response.status_code == requests.codes.ok:
-        return response.json()
-    else:
-        response.raise_for_status()
+    # Jobs with many content URLs return their files across several pages.
+    while uri:
+        response = rest_helper.get_session().get(uri, headers=headers)
+
+        if response.status_code != requests.codes.ok:
+            response.raise_for_status()
+
+        page = response.json()
+        if transcription_files is None:
+            transcription_files = page
+        else:
+            transcription_files["values"].extend(page["values"])
+        uri = page.get("@nextLink")
+
+    return transcription_files
 
 def get_transcription_url(transcription_files: dict) -> str:
     """
@@ -167,6 +370,22 @@ def get_transcription_url(transcription_files: dict) -> str:
     return value['links']['contentUrl']
 
 
+def get_transcription_urls(transcription_files: dict) -> List[str]:
+    """
+    Get every transcription URL from the JSON response of the GetTranscriptionFiles API.
+    A job created with several content URLs has one transcription result per audio file;
+    the "source" field of each downloaded result identifies the audio file it belongs to.
+
+    Args:
+        transcription_files (dict): The JSON response from the GetTranscriptionFiles API.
+
+    Returns:
+        List[str]: The transcription URLs from the API response.
+    """
+    return [value['links']['contentUrl'] for value in transcription_files['values']
+            if value.get('kind', '').lower() == 'transcription']
+
+
 def get_transcription(transcription_url: str) -> Dict:
     """
     Get transcription data from a given URL.
@@ -174,55 +393,82 @@ def get_transcription(transcription_url: str) -> Dict:
     :param transcription_url: str: URL to get the transcription data from
     :return: Dict: the transcription response JSON
     """
-    response = requests.get(transcription_url)
+    response = rest_helper.get_session().get(transcription_url)
 
     if response.status_code == requests.codes.ok:
         return response.json()
     else:
         response.raise_for_status()
 
-def get_transcription_phrases(transcription: Dict[str, Any]) -> List[TranscriptionPhrase]:
+def _iter_transcription_response(transcription_url: str, chunk_size: int) -> Iterator[Tuple[str, Any]]:
+    with rest_helper.get_session().get(transcription_url, stream=True) as response:
+        if response.status_code != requests.codes.ok:
+            response.raise_for_status()
+
+        yield from transcription_stream.iter_transcription(_count_bytes(response.iter_content(chunk_size=chunk_size)))
+
+def _count_bytes(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        tracing.add("bytes", len(chunk))
+        yield chunk
+
+def read_transcription(transcription_url: str, chunk_size: int = 64 * 1024) -> Tuple[Dict[str, Any], PhraseStore]:
+    """
+    Downloads and incrementally parses transcription data from a given URL into a PhraseStore.
+
+    :param transcription_url: str: URL to get the transcription data from
+    :param chunk_size: int: number of bytes read from the response at a time
+    :return: Tuple: the metadata fields of the transcription, and a PhraseStore with its phrases
     """
-    Extracts transcription phrases from a given transcription.
+    metadata = {}
+    store = PhraseStore()
+
+    for field, value in _iter_transcription_response(transcription_url, chunk_size):
+        if field == transcription_stream.PHRASES_FIELD:
+            store.append_recognized_phrase(value)
+        else:
+            metadata[field] = value
+
+    return metadata, store
+
+def get_speaker_number(phrase: Dict[str, Any]) -> int:
+    """
+    Gets the zero-based speaker number of a recognized phrase, from its speaker or its channel.
 
     Args:
-        transcription: A dictionary containing recognized phrases.
-        user_config: A dictionary containing user configurations.
+        phrase: The recognized phrase.
 
     Returns:
-        A list of TranscriptionPhrase objects.
+        The speaker number.
     """
-    def helper(id_and_phrase: Tuple[int, Dict[str, Any]]) -> TranscriptionPhrase:
-        """
-        Helper function to extract a TranscriptionPhrase from a recognized phrase.
+    if "speaker" in phrase:
+        return phrase["speaker"] - 1
+    elif "channel" in phrase:
+        return phrase["channel"]
+    else:
+        raise Exception(f"nBest item contains neither channel nor speaker attribute.\n{phrase['nBest'][0]}")
 
-        Args:
-            id_and_phrase: A tuple containing the id and the recognized phrase.
+def get_transcription_phrases(transcription: Dict[str, Any]) -> List[TranscriptionPhrase]:
+    """
+    Extracts transcription phrases from a given transcription, in conversation order.
 
-        Returns:
-            A TranscriptionPhrase object.
-        """
-        id, phrase = id_and_phrase
-        best = phrase["nBest"][0]
-        speaker_number: int
-        if "speaker" in phrase:
-            speaker_number = phrase["speaker"] - 1
-        elif "channel" in phrase:
-            speaker_number = phrase["channel"]
-        else:
-            raise Exception(f"nBest item contains neither channel nor speaker attribute.\n{best}")
-        return TranscriptionPhrase(id, best["display"], speaker_number, phrase["offset"], phrase["offsetInTicks"], phrase["duration"])
+    Args:
+        transcription: A dictionary containing recognized phrases.
 
-    phrases = transcription["recognizedPhrases"]
-    phrases.sort(key=lambda x: x.get("channel", x.get("speaker", 0)))  # Sort phrases by speaker/channel number.
-    return [helper((i, phrase)) for i, phrase in enumerate(phrases)]
+    Returns:
+        A list of TranscriptionPhrase objects, ordered by offset.
+    """
+    store = PhraseStore()
+    for phrase in transcription["recognizedPhrases"]:
+        store.append_recognized_phrase(phrase)
+    return list(store.time_ordered_phrases())
 
-def transcription_phrases_to_conversation_items(phrases: List[TranscriptionPhrase]) -> List[Dict[str, Any]]:
+def transcription_phrases_to_conversation_items(phrases: Iterable[TranscriptionPhrase]) -> List[Dict[str, Any]]:
     """
     Converts TranscriptionPhrase objects to conversation items.
 
     Args:
-        phrases: A list of TranscriptionPhrase objects.
+        phrases: TranscriptionPhrase objects, for example from PhraseStore.time_ordered_phrases.
 
     Returns:
         A list of conversation items.
@@ -232,5 +478,7 @@ def transcription_phrases_to_conversation_items(phrases: List[TranscriptionPhras
         "display": phrase.display,
         "role": "Agent" if phrase.speaker_number == 0 else "Customer",  # The first person to speak is probably the agent.
         "participantId": phrase.speaker_number,
-        "duration": phrase.duration        
+        "offset": phrase.offset,
+        "offsetInTicks": phrase.offset_in_ticks,
+        "duration": phrase.duration
     } for phrase in phrases]
\ No newline at end of file
@@ -0,0 +1,234 @@
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Top-level fields of a transcription result that are kept; everything else is skipped unparsed.
+METADATA_FIELDS = {"source", "timestamp", "durationInTicks", "duration"}
+
+# The top-level array whose elements are parsed one at a time.
+PHRASES_FIELD = "recognizedPhrases"
+
+# Fields of each recognized phrase that are kept, and the fields kept of its best recognition,
+# nBest[0]. The other recognitions and the per-word timings are skipped unparsed.
+PHRASE_FIELDS = {"speaker", "channel", "offset", "duration", "offsetInTicks", "durationInTicks"}
+BEST_FIELDS = {"display"}
+
+_STRUCTURAL = re.compile(rb'[{}\[\]",:]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+# Everything up to the next bracket that opens a nested container or closes the current one,
+# in one match: whole strings, and whole objects and arrays that contain no further nesting,
+# such as the entries of a word timing array. A flat container is matched inside a lookahead
+# and then by backreference, which makes it atomic: when the chunk ends before the container
+# does, the match stops in front of it instead of backtracking through its contents.
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_FLAT = rb'(?=((?:[^"{}\[\]]+|' + _STRING + rb')*))\1'
+_SKIPPED = re.compile(rb'(?:[^"{}\[\]]+|' + _STRING + rb'|\{' + _FLAT + rb'\}|\[' + _FLAT + rb'\])*', re.DOTALL)
+
+# A selector maps the keys (in objects) or indexes (in arrays, "*" for any) of a container to
+# True for values that are decoded, or to the selector of a container that is read field by field.
+Selector = Dict[Any, Any]
+
+
+class _Container:
+    """An object or array being read, with the selector of its children and the value built from them."""
+    __slots__ = ("is_object", "selector", "value", "key", "index", "expect_key")
+
+    def __init__(self, is_object: bool, selector: Selector, value: Any) -> None:
+        self.is_object = is_object
+        self.selector = selector
+        self.value = value
+        self.key: Optional[str] = None
+        self.index = 0
+        self.expect_key = is_object
+
+    def child_selector(self) -> Any:
+        if self.is_object:
+            return self.selector.get(self.key)
+        return self.selector.get(self.index, self.selector.get("*"))
+
+
+class TranscriptionStreamParser:
+    """
+    Incremental parser for the JSON transcription result of the Speech batch transcription API.
+
+    Bytes are fed in as they arrive. The parser only tracks nesting and string boundaries, and
+    decodes nothing but the metadata fields it keeps and the selected fields of the recognized
+    phrase currently being read, so memory stays bounded by the largest single phrase rather than
+    the whole document. Large fields the pipeline does not use, such as combinedRecognizedPhrases,
+    the alternative recognitions of each phrase and their word timings, are skipped.
+    """
+
+    def __init__(self, metadata_fields: Optional[Set[str]] = None) -> None:
+        """
+        Initialize a TranscriptionStreamParser instance.
+
+        Args:
+            metadata_fields (set): Top-level fields to return, defaults to METADATA_FIELDS.
+        """
+        self.metadata_fields = METADATA_FIELDS if metadata_fields is None else metadata_fields
+        phrase = {name: True for name in PHRASE_FIELDS}
+        phrase["nBest"] = {0: {name: True for name in BEST_FIELDS}}
+        self._selector: Selector = {name: True for name in self.metadata_fields}
+        self._selector[PHRASES_FIELD] = {"*": phrase}
+
+        self._containers: List[_Container] = []
+        self._skip_depth = 0
+        self._in_string = False
+        self._escape_pending = False
+        self._capture: Optional[bytearray] = None
+        self._capture_kind: Optional[str] = None
+        self._capture_depth = 0
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[str, Any]]:
+        """
+        Parses the next chunk of the response body.
+
+        Args:
+            chunk (bytes): The next bytes of the JSON document.
+
+        Yields:
+            Tuple[str, Any]: (field, value) for kept top-level fields, and (PHRASES_FIELD, phrase)
+            for each complete recognized phrase, with only PHRASE_FIELDS and nBest[0].display.
+        """
+        pos = 0
+        capture_from = 0
+        end = len(chunk)
+
+        if self._escape_pending:
+            self._escape_pending = False
+            pos = 1
+
+        while pos < end:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(chunk, pos)
+                if match is None:
+                    break
+                if chunk[match.start()] == ord("\\"):
+                    pos = match.start() + 2
+                    if pos > end:
+                        self._escape_pending = True
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if self._capture_kind == "key":
+                    self._containers[-1].key = self._end_capture(chunk, capture_from, pos)
+                continue
+
+            if self._skip_depth:
+                # Inside a value nobody asked for: only its brackets matter. A string that runs
+                # past the end of the chunk is left to the string handling above.
+                pos = _SKIPPED.match(chunk, pos).end()
+                if pos == end:
+                    break
+                char = chunk[pos]
+                pos += 1
+                if char == ord('"'):
+                    self._in_string = True
+                elif char in b"{[":
+                    self._skip_depth += 1
+                else:
+                    self._skip_depth -= 1
+                continue
+
+            match = _STRUCTURAL.search(chunk, pos)
+            if match is None:
+                break
+            char = chunk[match.start()]
+            pos = match.end()
+
+            if char == ord('"'):
+                self._in_string = True
+                if self._capture is None and self._containers and self._containers[-1].expect_key:
+                    capture_from = self._start_capture("key", match.start())
+            elif self._capture_kind == "value":
+                # Inside a value being decoded: it ends at the first ',', '}' or ']' outside its own nesting.
+                if char in b"{[":
+                    self._capture_depth += 1
+                elif self._capture_depth:
+                    if char in b"}]":
+                        self._capture_depth -= 1
+                elif char != ord(":"):
+                    yield from self._set_value(self._end_capture(chunk, capture_from, match.start()))
+                    yield from self._structural(char)
+            else:
+                yield from self._structural(char)
+                if self._capture_kind == "value":
+                    capture_from = pos
+
+        if self._capture is not None:
+            self._capture.extend(chunk[capture_from:])
+
+    def _structural(self, char: int) -> Iterator[Tuple[str, Any]]:
+        container = self._containers[-1] if self._containers else None
+        if char in b"{[":
+            selector = self._selector if container is None else container.child_selector()
+            if not isinstance(selector, dict):
+                self._skip_depth = 1
+                return
+            # Only phrases and what they contain are built; the document and the phrases array are not.
+            value: Any = None
+            if container is not None and (container.value is not None or self._in_phrases()):
+                value = {} if char == ord("{") else []
+                if container.value is not None:
+                    if container.is_object:
+                        container.value[container.key] = value
+                    else:
+                        container.value.append(value)
+            self._containers.append(_Container(char == ord("{"), selector, value))
+        elif char in b"}]":
+            closed = self._containers.pop()
+            if self._in_phrases():
+                yield PHRASES_FIELD, closed.value
+        elif char == ord(":"):
+            if container.expect_key:
+                container.expect_key = False
+                if container.child_selector() is True:
+                    self._start_capture("value", 0)
+        elif char == ord(","):
+            if container.is_object:
+                container.expect_key = True
+                container.key = None
+            else:
+                container.index += 1
+
+    def _in_phrases(self) -> bool:
+        """Whether the innermost container is the recognizedPhrases array."""
+        return len(self._containers) == 2 and self._containers[0].key == PHRASES_FIELD
+
+    def _set_value(self, value: Any) -> Iterator[Tuple[str, Any]]:
+        container = self._containers[-1]
+        if container.value is None:
+            yield container.key, value
+        else:
+            container.value[container.key] = value
+
+    def _start_capture(self, kind: str, start: int) -> int:
+        self._capture = bytearray()
+        self._capture_kind = kind
+        self._capture_depth = 0
+        return start
+
+    def _end_capture(self, chunk: bytes, capture_from: int, stop: int) -> Any:
+        self._capture.extend(chunk[capture_from:stop])
+        value = json.loads(bytes(self._capture))
+        self._capture = None
+        self._capture_kind = None
+        return value
+
+
+def iter_transcription(chunks: Iterable[bytes], metadata_fields: Optional[Set[str]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Parses a JSON transcription result from an iterable of byte chunks, such as a streamed HTTP response.
+
+    Args:
+        chunks (iterable): The bytes of the JSON document, in order.
+        metadata_fields (set): Top-level fields to return, defaults to METADATA_FIELDS.
+
+    Yields:
+        Tuple[str, Any]: (field, value) for kept top-level fields, and
+        (PHRASES_FIELD, phrase) for each recognized phrase, in document order.
+    """
+    parser = TranscriptionStreamParser(metadata_fields)
+    for chunk in chunks:
+        if chunk:
+            yield from parser.feed(chunk)